@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Form, Request
 from fastapi.responses import HTMLResponse, JSONResponse
-from ...infrastructure.database.supabase_client import get_supabase
+from ...infrastructure.database.postgrest_async import get_postgrest
 import logging
 import traceback
 
@@ -31,8 +31,8 @@ def signup_form():
 
 
 @router.post("/signup", summary="Cria conta + usuário owner (teste)")
-def signup_create(request: Request, name: str = Form(...), whatsapp: str = Form(...)):
-    sb = get_supabase()
+async def signup_create(request: Request, name: str = Form(...), whatsapp: str = Form(...)):
+    db = get_postgrest()
     
     try:
         # Validação básica
@@ -44,10 +44,10 @@ def signup_create(request: Request, name: str = Form(...), whatsapp: str = Form(
             )
 
         # Cria conta via PostgREST
-        acc_insert = sb.table('accounts').insert({}).select('id').single().execute()
-        if not acc_insert.data or 'id' not in acc_insert.data:
+        acc_insert = await db.insert('accounts', {}, columns='id')
+        if not acc_insert or 'id' not in acc_insert[0]:
             raise RuntimeError(f"Falha ao criar conta: resposta inválida {acc_insert}")
-        account_id = acc_insert.data['id']
+        account_id = acc_insert[0]['id']
 
         # Cria usuário owner vinculado
         user_payload = {
@@ -56,15 +56,15 @@ def signup_create(request: Request, name: str = Form(...), whatsapp: str = Form(
             'whatsapp_number': whatsapp,
             'role': 'owner',
         }
-        user_insert = sb.table('users').insert(user_payload).select('id').single().execute()
-        if not user_insert.data or 'id' not in user_insert.data:
+        user_insert = await db.insert('users', user_payload, columns='id')
+        if not user_insert or 'id' not in user_insert[0]:
             raise RuntimeError(f"Falha ao criar usuário: resposta inválida {user_insert}")
 
         return JSONResponse(
             status_code=200,
             content={
                 "account_id": account_id,
-                "user_id": user_insert.data['id']
+                "user_id": user_insert[0]['id']
             }
         )
 
@@ -1,26 +1,27 @@
 import os
 from fastapi import APIRouter, Request, Query, Body
 from fastapi.responses import PlainTextResponse, JSONResponse
-from ...infrastructure.database.supabase_client import get_supabase
+from ...infrastructure.database.postgrest_async import PostgrestError, get_postgrest
+from ...infrastructure.database.wa_store import get_wa_store
 from ...services.message_parser import WhatsAppMessageParser
 from ...services.whatsapp_flow import WhatsAppFlowService
 from ...infrastructure.messaging.whatsapp_client import WhatsAppClient
 from ...services.flows import DemoFlowsService
+from ...services.click_analytics import get_click_pipeline
+from ...services.users_loader import UsersLoader
 from pydantic import BaseModel
 
 
 router = APIRouter(tags=["WhatsApp"], prefix="/_webhooks/whatsapp")
 
 
-def _load_catalog_item(sb, item_id: str) -> dict:
-    q = (
-        sb.table('wa_buttons_catalog')
-        .select('id,title,response_type,response_text,next_buttons,template_name,template_lang,template_vars,metadata')
-        .eq('id', item_id)
-        .maybe_single()
-        .execute()
+async def _load_catalog_item(db, item_id: str) -> dict:
+    item = await db.select_one(
+        'wa_buttons_catalog',
+        'id,title,response_type,response_text,next_buttons,template_name,template_lang,template_vars,metadata',
+        filters=[('id', 'eq', item_id)],
     )
-    return q.data or {}
+    return item or {}
 
 
 def _apply_defaults(text: str, md: dict) -> str:
@@ -84,8 +85,8 @@ class ImportStartBody(BaseModel):
 async def flow_import_start(req: ImportStartBody):
     """Dispara o início do fluxo de importação usando o item 'import_sales_start'."""
     to = _normalize_phone(req.to)
-    sb = get_supabase()
-    item = _load_catalog_item(sb, 'import_sales_start')
+    db = get_postgrest()
+    item = await _load_catalog_item(db, 'import_sales_start')
     if not item:
         return JSONResponse(status_code=404, content={"error": "catalog_item_not_found", "id": "import_sales_start"})
     text = _apply_defaults(item.get('response_text') or '', item.get('metadata') or {})
@@ -113,8 +114,8 @@ class ImportGenericBody(BaseModel):
 async def flow_import_summary(req: ImportGenericBody):
     """Envia resumo mock (top pizzas/bebidas) e agenda a pergunta de consumo com botão."""
     to = _normalize_phone(req.to)
-    sb = get_supabase()
-    item = _load_catalog_item(sb, 'view_summary')
+    db = get_postgrest()
+    item = await _load_catalog_item(db, 'view_summary')
     if not item:
         return JSONResponse(status_code=404, content={"error": "catalog_item_not_found", "id": "view_summary"})
     md = item.get('metadata') or {}
@@ -145,8 +146,8 @@ async def flow_import_summary(req: ImportGenericBody):
 @router.post("/_flows/import/consumption")
 async def flow_import_consumption(req: ImportGenericBody):
     to = _normalize_phone(req.to)
-    sb = get_supabase()
-    item = _load_catalog_item(sb, 'view_consumption')
+    db = get_postgrest()
+    item = await _load_catalog_item(db, 'view_consumption')
     if not item:
         return JSONResponse(status_code=404, content={"error": "catalog_item_not_found", "id": "view_consumption"})
     md = item.get('metadata') or {}
@@ -214,7 +215,7 @@ def _get_first(lst):
     return lst[0] if isinstance(lst, list) and lst else None
 
 
-def _ensure_contact(sb, wa_number: str, profile_name: str | None):
+async def _ensure_contact(db, wa_number: str, profile_name: str | None):
     """
     Garante o ID do contato para abertura de conversa usando a tabela 'perfis'.
     Observação importante: no schema atual, wa_conversations.contact_id referencia perfis(id),
@@ -229,29 +230,20 @@ def _ensure_contact(sb, wa_number: str, profile_name: str | None):
         norm = _normalize_phone(wa_number)
         print(f"[DEBUG][CONTACT] resolve start wa={wa_number} norm={norm}")
         # Busca direta por igualdade. Caso a base armazene com '+', tentamos as duas formas.
-        q = sb.table('perfis').select('id, whatsapp').eq('whatsapp', norm).maybe_single().execute()
-        data = getattr(q, 'data', None) or (q.get('data') if isinstance(q, dict) else None) or {}
+        data = await db.select_one('perfis', 'id,whatsapp', filters=[('whatsapp', 'eq', norm)]) or {}
         if data.get('id'):
             print(f"[DEBUG][CONTACT] matched exact digits perfis.id={data['id']} whatsapp={data.get('whatsapp')}")
             return data['id']
 
         # Tentativa alternativa com '+' prefixado
-        q2 = sb.table('perfis').select('id, whatsapp').eq('whatsapp', f"+{norm}").maybe_single().execute()
-        data2 = getattr(q2, 'data', None) or (q2.get('data') if isinstance(q2, dict) else None) or {}
+        data2 = await db.select_one('perfis', 'id,whatsapp', filters=[('whatsapp', 'eq', f"+{norm}")]) or {}
         if data2.get('id'):
             print(f"[DEBUG][CONTACT] matched exact +digits perfis.id={data2['id']} whatsapp={data2.get('whatsapp')}")
             return data2['id']
 
         # Como última tentativa, buscar por LIKE contendo o final do número (pode haver formatação diferente)
         try:
-            q3 = (
-                sb.table('perfis')
-                .select('id, whatsapp')
-                .like('whatsapp', f"%{norm}")
-                .limit(1)
-                .execute()
-            )
-            q3data = getattr(q3, 'data', None) or (q3.get('data') if isinstance(q3, dict) else None)
+            q3data = await db.select('perfis', 'id,whatsapp', filters=[('whatsapp', 'like', f"*{norm}")], limit=1)
             if q3data and isinstance(q3data, list) and q3data:
                 print(f"[DEBUG][CONTACT] matched LIKE perfis.id={q3data[0].get('id')} whatsapp={q3data[0].get('whatsapp')}")
                 return q3data[0].get('id')
@@ -265,42 +257,17 @@ def _ensure_contact(sb, wa_number: str, profile_name: str | None):
         return None
 
 
-def _ensure_open_conversation(sb, contact_id: str) -> str:
-    q = (
-        sb.table('wa_conversations')
-        .select('id')
-        .eq('contact_id', contact_id)
-        .eq('status', 'open')
-        .order('last_message_at', desc=True)
-        .maybe_single()
-        .execute()
-    )
-    qdata = getattr(q, 'data', None) or (q.get('data') if isinstance(q, dict) else None) or {}
+async def _ensure_open_conversation(db, contact_id: str) -> str:
+    open_filters = [('contact_id', 'eq', contact_id), ('status', 'eq', 'open')]
+    qdata = await db.select_one('wa_conversations', 'id', filters=open_filters, order='last_message_at.desc') or {}
     if qdata.get('id'):
         return qdata['id']
 
-    # Alguns clientes Supabase não suportam chaining .select() após insert.
-    ins = (
-        sb.table('wa_conversations')
-        .insert({'contact_id': contact_id, 'status': 'open'})
-        .execute()
-    )
-    ins_data = getattr(ins, 'data', None) or (ins.get('data') if isinstance(ins, dict) else None)
-    # ins_data pode ser um dict ou lista de dicts
-    if isinstance(ins_data, list):
-        ins_data = ins_data[0] if ins_data else {}
+    ins = await db.insert('wa_conversations', {'contact_id': contact_id, 'status': 'open'}, columns='id')
+    ins_data = ins[0] if ins else {}
     if not ins_data or not ins_data.get('id'):
         # como fallback, tente buscar imediatamente a conversa recém criada
-        q_new = (
-            sb.table('wa_conversations')
-            .select('id')
-            .eq('contact_id', contact_id)
-            .eq('status', 'open')
-            .order('created_at', desc=True)
-            .maybe_single()
-            .execute()
-        )
-        q_new_data = getattr(q_new, 'data', None) or (q_new.get('data') if isinstance(q_new, dict) else None) or {}
+        q_new_data = await db.select_one('wa_conversations', 'id', filters=open_filters, order='created_at.desc') or {}
         if q_new_data.get('id'):
             return q_new_data['id']
         raise RuntimeError("failed_to_create_conversation")
@@ -324,18 +291,19 @@ async def receive_update(request: Request):
         if not parsed_messages:
             return JSONResponse(status_code=200, content={"status": "no valid messages found"})
 
-        sb = get_supabase()
-        flow_service = WhatsAppFlowService(supabase_client=sb)
+        db = get_postgrest()
+        store = get_wa_store()
+        flow_service = WhatsAppFlowService(db=db, store=store)
 
         for msg in parsed_messages:
             try:
-                contact_id = _ensure_contact(sb, wa_number=msg.sender_number, profile_name=msg.profile_name)
+                contact_id = await _ensure_contact(db, wa_number=msg.sender_number, profile_name=msg.profile_name)
                 if not contact_id:
                     print(f"[WARN] No profile found in 'perfis' for number {msg.sender_number}; skipping message processing.")
                     # Opcional: aqui poderíamos enviar uma mensagem informando que o número não está cadastrado.
                     continue
 
-                conversation_id = _ensure_open_conversation(sb, contact_id)
+                conversation_id = await _ensure_open_conversation(db, contact_id)
 
                 # Persiste a mensagem de entrada aqui, antes de processar
                 try:
@@ -346,13 +314,12 @@ async def receive_update(request: Request):
                         'json_payload': msg.raw_message_payload,
                         'wa_message_id': msg.message_id,
                     }
-                    sb.table('wa_messages').insert(payload).execute()
-                    sb.table('wa_conversations').update({'last_message_at': 'now()'}).eq('id', conversation_id).execute()
+                    await store.insert_message(payload)
                 except Exception as e:
                     print(f'[WARN] Failed to persist inbound message: {repr(e)}')
 
                 # Delega toda a lógica para o serviço de fluxo
-                flow_service.process_message(conversation_id, contact_id, msg)
+                await flow_service.process_message(conversation_id, contact_id, msg)
 
             except Exception as e:
                 print(f'[ERROR] Failed to process message for contact {msg.sender_number}: {repr(e)}')
@@ -380,25 +347,117 @@ class WhatsAppTemplateRequest(BaseModel):
     variables: list[str] | None = None
 
 
-async def resolve_recipient(data: WhatsAppTemplateRequest):
+def _user_keys(data: WhatsAppTemplateRequest) -> tuple[list, list]:
+    """Chaves candidatas de `users` (ids, números) de um pedido de envio."""
+    return [data.user_id], [data.user_number_normalized, data.to]
+
+
+async def _contact_numbers(contact_ids: list) -> dict:
+    """Números de `wa_contacts` por id, em uma consulta. Falha devolve {} (cada envio resolve o seu)."""
+    ids = sorted({(c or '').strip() for c in contact_ids if (c or '').strip()})
+    if not ids:
+        return {}
+    try:
+        rows = await get_postgrest().select('wa_contacts', 'id,whatsapp_number', filters=[('id', 'in', ids)])
+    except Exception as e:
+        print(f"[WARN] Falha ao resolver contatos em lote ({len(ids)}): {repr(e)}")
+        return {}
+    return {str(r.get('id')): (r.get('whatsapp_number') or '').strip() for r in rows if r.get('id')}
+
+
+async def resolve_recipient(data: WhatsAppTemplateRequest, loader: UsersLoader | None = None, contacts: dict | None = None):
     if data.to:
         return data.to
     elif data.contact_id:
-        sb = get_supabase()
-        q = sb.table('wa_contacts').select('whatsapp_number').eq('id', data.contact_id).maybe_single().execute()
-        data = q.data or {}
-        return (data.get('whatsapp_number') or '').strip()
+        if contacts and data.contact_id in contacts:
+            return contacts[data.contact_id]
+        row = await get_postgrest().select_one('wa_contacts', 'whatsapp_number', filters=[('id', 'eq', data.contact_id)]) or {}
+        return (row.get('whatsapp_number') or '').strip()
     elif data.user_id:
-        sb = get_supabase()
-        q = sb.table('users').select('whatsapp_number_normalized').eq('id', data.user_id).maybe_single().execute()
-        data = q.data or {}
-        return (data.get('whatsapp_number_normalized') or '').strip()
+        row = await (loader or UsersLoader()).by_id(data.user_id) or {}
+        return (row.get('whatsapp_number_normalized') or '').strip()
     elif data.user_number_normalized:
         return data.user_number_normalized
     else:
         raise Exception("Recipient not found")
 
 
+async def _send_template_one(
+    data: WhatsAppTemplateRequest, loader: UsersLoader, client: WhatsAppClient, contacts: dict | None = None
+) -> tuple[int, dict]:
+    """Resolve destinatário/user_name via `loader` (e `contacts`, já resolvidos em lote) e envia o template. Retorna (status, corpo)."""
+    # Validação simplificada
+    if not data.template_name or not data.lang_code:
+        return 422, {"error": "template_name and lang_code are required"}
+
+    # Resolve recipient - aceita qualquer um dos campos
+    to_number = await resolve_recipient(data, loader, contacts)
+    # O número resolvido (ex.: via contact_id) entra na mesma consulta das demais chaves
+    loader.prime(numbers=[to_number])
+    # Normaliza para apenas dígitos (WhatsApp Cloud aceita sem '+')
+    import re as _re
+    to_number_normalized = _re.sub(r"\D", "", (to_number or "").strip())
+    if not to_number_normalized:
+        return 422, {"error": "invalid recipient"}
+
+    # Tenta obter user_name a partir dos identificadores fornecidos.
+    # Todas as chaves já foram carregadas em uma única consulta pelo loader.
+    user_name_val: str | None = None
+    try:
+        if data.user_id:
+            user_name_val = (await loader.by_id(data.user_id) or {}).get('user_name')
+        for num in (data.user_number_normalized, data.to, to_number):
+            if user_name_val:
+                break
+            user_name_val = (await loader.by_number(num) or {}).get('user_name')
+    except Exception as _e:
+        # Não falha se não encontrar; apenas segue sem variável automática
+        print(f"[DEBUG] Falha ao buscar user_name: {_e}")
+
+    components = data.components or []
+
+    # Se não vierem components mas vier uma lista de variables, monta automaticamente
+    if not components and (data.variables or []):
+        body_params = []
+        for v in (data.variables or []):
+            # Por padrão enviamos como texto
+            body_params.append({"type": "text", "text": str(v)})
+        components = [{"type": "body", "parameters": body_params}]
+
+    # Se ainda não houver components e também não houver variables, mas temos user_name,
+    # usamos user_name como {{1}}
+    if not components and not (data.variables or []):
+        if user_name_val:
+            components = [{
+                "type": "body",
+                "parameters": [{"type": "text", "text": str(user_name_val)}]
+            }]
+
+    payload = {
+        "to": to_number_normalized,
+        "template": data.template_name,
+        "language": data.lang_code,
+        "components": components
+    }
+    print(f"[DEBUG] WhatsAppClient.send_template PAYLOAD: {payload}")
+
+    try:
+        response = client.send_template(
+            to=payload["to"],
+            template=payload["template"],
+            language=payload["language"],
+            components=payload["components"]
+        )
+    except Exception as _e:
+        import traceback as _tb
+        print("[ERROR] Upstream Meta error:", repr(_e))
+        print(_tb.format_exc())
+        return 502, {"error": "meta_api_error", "details": str(_e)}
+
+    print(f"[DEBUG] WhatsApp API response: {response}")
+    return 200, {"ok": True, "to": to_number_normalized, "response": response}
+
+
 @router.post("/send-template")
 async def send_template(
     request: Request,
@@ -413,87 +472,11 @@ async def send_template(
         # if admin_token and request.headers.get("x-admin-token") != admin_token:
         #     return JSONResponse(status_code=403, content={"error": "forbidden"})
 
-        # Validação simplificada
-        if not data.template_name or not data.lang_code:
-            return JSONResponse(
-                status_code=422,
-                content={"error": "template_name and lang_code are required"}
-            )
-
-        # Resolve recipient - aceita qualquer um dos campos
-        to_number = await resolve_recipient(data)
-        # Normaliza para apenas dígitos (WhatsApp Cloud aceita sem '+')
-        import re as _re
-        to_number_normalized = _re.sub(r"\D", "", (to_number or "").strip())
-        if not to_number_normalized:
-            return JSONResponse(status_code=422, content={"error": "invalid recipient"})
-        
-        # Tenta obter user_name a partir dos identificadores fornecidos
-        user_name_val: str | None = None
-        try:
-            sb = get_supabase()
-            if data.user_id:
-                q = sb.table('users').select('user_name').eq('id', data.user_id).maybe_single().execute()
-                user_name_val = (q.data or {}).get('user_name')
-            if not user_name_val and data.user_number_normalized:
-                q = sb.table('users').select('user_name').eq('whatsapp_number_normalized', data.user_number_normalized).maybe_single().execute()
-                user_name_val = (q.data or {}).get('user_name')
-            if not user_name_val and data.to:
-                q = sb.table('users').select('user_name').eq('whatsapp_number_normalized', data.to).maybe_single().execute()
-                user_name_val = (q.data or {}).get('user_name')
-            if not user_name_val and to_number:
-                q = sb.table('users').select('user_name').eq('whatsapp_number_normalized', to_number).maybe_single().execute()
-                user_name_val = (q.data or {}).get('user_name')
-        except Exception as _e:
-            # Não falha se não encontrar; apenas segue sem variável automática
-            print(f"[DEBUG] Falha ao buscar user_name: {_e}")
-
-        # Envio
-        client = WhatsAppClient()
-        
-        # Adicionando logs para depuração
-        components = data.components or []
-
-        # Se não vierem components mas vier uma lista de variables, monta automaticamente
-        if not components and (data.variables or []):
-            body_params = []
-            for v in (data.variables or []):
-                # Por padrão enviamos como texto
-                body_params.append({"type": "text", "text": str(v)})
-            components = [{"type": "body", "parameters": body_params}]
-
-        # Se ainda não houver components e também não houver variables, mas temos user_name,
-        # usamos user_name como {{1}}
-        if not components and not (data.variables or []):
-            if user_name_val:
-                components = [{
-                    "type": "body",
-                    "parameters": [{"type": "text", "text": str(user_name_val)}]
-                }]
-
-        payload = {
-            "to": to_number_normalized,
-            "template": data.template_name,
-            "language": data.lang_code,
-            "components": components
-        }
-        print(f"[DEBUG] WhatsAppClient.send_template PAYLOAD: {payload}")
-
-        try:
-            response = client.send_template(
-                to=payload["to"],
-                template=payload["template"],
-                language=payload["language"],
-                components=payload["components"]
-            )
-        except Exception as _e:
-            import traceback as _tb
-            print("[ERROR] Upstream Meta error:", repr(_e))
-            print(_tb.format_exc())
-            return JSONResponse(status_code=502, content={"error": "meta_api_error", "details": str(_e)})
-        
-        print(f"[DEBUG] WhatsApp API response: {response}")
-        return JSONResponse(status_code=200, content={"ok": True, "to": to_number_normalized, "response": response})
+        loader = UsersLoader()
+        ids, numbers = _user_keys(data)
+        loader.prime(ids=ids, numbers=numbers)
+        status, content = await _send_template_one(data, loader, WhatsAppClient())
+        return JSONResponse(status_code=status, content=content)
         
     except Exception as e:
         import traceback
@@ -505,6 +488,47 @@ async def send_template(
         )
 
 
+class BulkTemplateRequest(BaseModel):
+    items: list[WhatsAppTemplateRequest]
+
+
+@router.post("/send-template/bulk")
+async def send_template_bulk(req: BulkTemplateRequest, request: Request):
+    """
+    Envio de templates em lote. As chaves de `users` de todos os destinatários são
+    resolvidas em uma única consulta antes dos envios.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token and request.headers.get("x-admin-token") != admin_token:
+        return JSONResponse(status_code=403, content={"error": "forbidden"})
+
+    loader = UsersLoader()
+    contacts = await _contact_numbers([item.contact_id for item in req.items if not item.to])
+    for item in req.items:
+        ids, numbers = _user_keys(item)
+        if not item.to and item.contact_id in contacts:
+            numbers.append(contacts[item.contact_id])
+        loader.prime(ids=ids, numbers=numbers)
+    # Falhas de chaves individuais (ex.: id inválido) ficam no loader e viram erro só do item
+    await loader.load()
+    try:
+        client = WhatsAppClient()
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    results = []
+    for item in req.items:
+        try:
+            status, content = await _send_template_one(item, loader, client, contacts)
+        except PostgrestError as e:
+            status, content = (422 if e.status_code == 400 else 502), {"error": str(e)}
+        except Exception as e:
+            status, content = 500, {"error": str(e)}
+        results.append({"status": status, **content})
+    sent = sum(1 for r in results if r["status"] == 200)
+    return {"ok": sent == len(results), "sent": sent, "total": len(results), "users_queries": loader.queries, "results": results}
+
+
 # ========================
 # Admin: listar templates
 # ========================
@@ -551,15 +575,13 @@ async def list_local_templates(request: Request):
     """
     # Endpoint público: sem necessidade de x-admin-token
 
-    sb = get_supabase()
-    q = (
-        sb.table('wa_buttons_catalog')
-        .select('id,title,response_type,response_text,next_state,next_buttons,template_name,template_lang,template_vars,metadata')
-        .eq('active', True)
-        .execute()
+    rows = await get_postgrest().select(
+        'wa_buttons_catalog',
+        'id,title,response_type,response_text,next_state,next_buttons,template_name,template_lang,template_vars,metadata',
+        filters=[('active', 'eq', True)],
     )
     items = []
-    for r in (q.data or []):
+    for r in rows:
         tname = (r.get('template_name') or '').strip()
         if not tname:
             continue
@@ -579,15 +601,12 @@ async def get_full_local_catalog(request: Request):
     Lista completa dos itens ativos do catálogo local (wa_buttons_catalog),
     incluindo campos de resposta (response_type/response_text) mesmo quando não há template.
     """
-    sb = get_supabase()
-    q = (
-        sb.table('wa_buttons_catalog')
-        .select('id,title,response_type,response_text,next_state,next_buttons,template_name,template_lang,template_vars,metadata')
-        .eq('active', True)
-        .execute()
+    rows = await get_postgrest().select(
+        'wa_buttons_catalog',
+        'id,title,response_type,response_text,next_state,next_buttons,template_name,template_lang,template_vars,metadata',
+        filters=[('active', 'eq', True)],
     )
-    items = q.data or []
-    return {"items": items}
+    return {"items": rows}
 
 
 class LocalSendRequest(BaseModel):
@@ -603,16 +622,12 @@ async def send_local_item(req: LocalSendRequest, request: Request):
     - Caso contrário e se response_type == 'text' e houver response_text: envia texto
     """
     to = _normalize_phone(req.to)
-    sb = get_supabase()
     # Busca item
-    item_q = (
-        sb.table('wa_buttons_catalog')
-        .select('id,title,response_type,response_text,template_name,template_lang,template_vars,next_buttons,metadata')
-        .eq('id', req.id)
-        .maybe_single()
-        .execute()
-    )
-    item = item_q.data or {}
+    item = await get_postgrest().select_one(
+        'wa_buttons_catalog',
+        'id,title,response_type,response_text,template_name,template_lang,template_vars,next_buttons,metadata',
+        filters=[('id', 'eq', req.id)],
+    ) or {}
     if not item:
         return JSONResponse(status_code=404, content={"error": "catalog_item_not_found"})
 
@@ -731,15 +746,13 @@ async def list_local_templates_public(request: Request):
     """
     Espelho público do endpoint de templates locais para evitar bloqueios por token.
     """
-    sb = get_supabase()
-    q = (
-        sb.table('wa_buttons_catalog')
-        .select('id,title,response_type,response_text,next_state,next_buttons,template_name,template_lang,template_vars,metadata')
-        .eq('active', True)
-        .execute()
+    rows = await get_postgrest().select(
+        'wa_buttons_catalog',
+        'id,title,response_type,response_text,next_state,next_buttons,template_name,template_lang,template_vars,metadata',
+        filters=[('active', 'eq', True)],
     )
     items = []
-    for r in (q.data or []):
+    for r in rows:
         tname = (r.get('template_name') or '').strip()
         if not tname:
             continue
@@ -881,42 +894,192 @@ async def simulate_click(req: SimulateClickRequest, request: Request):
         return JSONResponse(status_code=500, content={"ok": False, "error": str(_e_sim), "traceback": _tb.format_exc()})
 
 
+_USERS_PAGE_MAX = 1000
+_USERS_COLUMNS = 'id,whatsapp_number_normalized,created_at'
+
+
+def _encode_users_cursor(row: dict) -> str:
+    import base64 as _b64
+    import json as _json
+    raw = _json.dumps([row.get('created_at'), row.get('id')], separators=(',', ':'))
+    return _b64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_users_cursor(cursor: str) -> tuple[str, str]:
+    import base64 as _b64
+    import json as _json
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, uid = _json.loads(_b64.urlsafe_b64decode(padded.encode()).decode())
+    if not created_at or not uid:
+        raise ValueError("cursor inválido")
+    return str(created_at), str(uid)
+
+
+def _quote_or_value(value: str) -> str:
+    # Valores com '.', ':' ou ',' (ex.: timestamps) precisam de aspas no `or=(...)`
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+async def _users_page(q: str | None, cursor: tuple[str, str] | None, limit: int) -> list[dict]:
+    """
+    Uma página de `users` em ordem (created_at desc, id desc), por keyset:
+    a próxima página começa logo após a última linha da anterior, sem OFFSET.
+    Usa o índice users_keyset_idx (e users_number_prefix_idx quando há `q`).
+    Linhas sem created_at ficam de fora: não têm posição no keyset nem cursor válido.
+    """
+    filters = [('whatsapp_number_normalized', 'not.is', None), ('created_at', 'not.is', None)]
+    if q:
+        filters.append(('whatsapp_number_normalized', 'like', f'{q}*'))
+    extra = []
+    if cursor:
+        ts, uid = (_quote_or_value(v) for v in cursor)
+        extra.append(('or', f'(created_at.lt.{ts},and(created_at.eq.{ts},id.lt.{uid}))'))
+    return await get_postgrest().select(
+        'users',
+        _USERS_COLUMNS,
+        filters=filters,
+        order='created_at.desc,id.desc',
+        limit=limit,
+        extra=extra,
+    )
+
+
+def _user_item(r: dict) -> dict | None:
+    num = (r.get('whatsapp_number_normalized') or '').strip()
+    if not num:
+        return None
+    return {'id': r.get('id'), 'whatsapp_number_normalized': num, 'created_at': r.get('created_at')}
+
+
 @router.get("/_admin/users")
-async def list_users(request: Request):
+async def list_users(
+    request: Request,
+    limit: int = Query(200, ge=1, le=_USERS_PAGE_MAX),
+    cursor: str | None = Query(None, description="valor de next_cursor da página anterior"),
+    q: str | None = Query(None, description="prefixo do número normalizado"),
+    fmt: str = Query("json", alias="format", description="json (paginado) ou ndjson (exportação completa)"),
+):
+    """
+    Lista owners com paginação por cursor (keyset em created_at, id).
+
+    - `format=json`: uma página + `next_cursor` (null na última página).
+    - `format=ndjson`: percorre todas as páginas a partir de `cursor` e transmite
+      uma linha JSON por usuário (exportação em massa).
+    """
     try:
         admin_token = os.getenv("ADMIN_TOKEN")
         if admin_token and request.headers.get("x-admin-token") != admin_token:
             return JSONResponse(status_code=403, content={"error": "forbidden"})
 
-        sb = get_supabase()
-        
-        # Debug: Primeiro descobrir as colunas disponíveis
-        debug_q = sb.table('users').select('*').limit(1).execute()
-        print(f"[DEBUG] Estrutura da tabela users: {debug_q.data}")
-        
-        # Query principal usando colunas genéricas
-        q = (
-            sb.table('users')
-            .select('id,whatsapp_number_normalized')
-            .not_.eq('whatsapp_number_normalized', None)
-            .order('created_at', desc=True)
-            .limit(200)
-            .execute()
-        )
-        
-        items = []
-        for r in q.data or []:
-            num = (r.get('whatsapp_number_normalized') or '').strip()
-            if num:
-                items.append({
-                    'id': r.get('id'),
-                    'whatsapp_number_normalized': num
-                })
-        
-        return JSONResponse(status_code=200, content={"items": items})
+        import re as _re
+        prefix = _re.sub(r"\D", "", q or "") or None
+        try:
+            start = _decode_users_cursor(cursor) if cursor else None
+        except Exception:
+            return JSONResponse(status_code=400, content={"error": "invalid cursor"})
+
+        if fmt == "ndjson":
+            from fastapi.responses import StreamingResponse
+            import json as _json
+
+            async def _export():
+                pos = start
+                while True:
+                    rows = await _users_page(prefix, pos, _USERS_PAGE_MAX)
+                    for r in rows:
+                        item = _user_item(r)
+                        if item:
+                            yield _json.dumps(item, ensure_ascii=False) + "\n"
+                    if len(rows) < _USERS_PAGE_MAX:
+                        break
+                    pos = (rows[-1].get('created_at'), rows[-1].get('id'))
+
+            return StreamingResponse(_export(), media_type="application/x-ndjson")
+
+        rows = await _users_page(prefix, start, limit)
+        items = [it for it in (_user_item(r) for r in rows) if it]
+        next_cursor = _encode_users_cursor(rows[-1]) if len(rows) == limit else None
+        return JSONResponse(status_code=200, content={"items": items, "next_cursor": next_cursor})
         
     except Exception as e:
         return JSONResponse(
             status_code=500, 
             content={"error": "Internal server error", "details": str(e)}
         )
+
+
+# ========================
+# Admin: analytics de cliques (rollup por minuto)
+# ========================
+@router.get("/_admin/analytics/button-funnel")
+async def button_funnel(
+    request: Request,
+    steps: str,
+    hours: int = Query(24, ge=1, le=720),
+    account_id: str | None = None,
+):
+    """
+    Funil de conversão entre botões lido do rollup `wa_button_clicks_rollup`,
+    agregado no banco pela função `wa_button_funnel` (backend/sql/001_wa_button_clicks_rollup.sql).
+    - steps: ids de botões na ordem do funil (ex.: view_summary,view_consumption),
+      comparados exatamente como gravados no rollup
+    - hours: janela em horas (padrão 24, de 1 a 720)
+    - account_id: filtra uma conta específica (opcional)
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token and request.headers.get("x-admin-token") != admin_token:
+        return JSONResponse(status_code=403, content={"error": "forbidden"})
+
+    step_ids = [s.strip() for s in (steps or '').split(',') if s.strip()]
+    if not step_ids:
+        return JSONResponse(status_code=422, content={"error": "steps is required"})
+    import datetime as _dt
+    since = (_dt.datetime.now(_dt.timezone.utc) - _dt.timedelta(hours=hours)).isoformat()
+
+    try:
+        # Soma por botão no banco (RPC wa_button_funnel): uma linha por passo, sem truncar em max-rows
+        rows = await get_postgrest().rpc('wa_button_funnel', {
+            'p_button_ids': step_ids,
+            'p_since': since,
+            'p_account_id': account_id or None,
+        }) or []
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": "rollup_query_failed", "details": str(e)})
+
+    totals: dict[str, int] = {s: 0 for s in step_ids}
+    for r in rows:
+        btn = r.get('button_id')
+        if btn in totals:
+            totals[btn] += int(r.get('clicks') or 0)
+
+    first = totals[step_ids[0]]
+    funnel = []
+    prev = None
+    for s in step_ids:
+        n = totals[s]
+        funnel.append({
+            'button_id': s,
+            'clicks': n,
+            'conversion_from_first': round(n / first, 4) if first else None,
+            'conversion_from_previous': round(n / prev, 4) if prev else None,
+        })
+        prev = n
+    return {"since": since, "account_id": account_id, "funnel": funnel}
+
+
+@router.get("/_admin/analytics/button-clicks/pipeline")
+async def button_clicks_pipeline_stats(request: Request):
+    """Estatísticas do pipeline em memória de cliques (pendentes, gravados, erros)."""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token and request.headers.get("x-admin-token") != admin_token:
+        return JSONResponse(status_code=403, content={"error": "forbidden"})
+    return get_click_pipeline().snapshot()
+
+
+@router.get("/_admin/db/latency")
+async def db_latency(request: Request):
+    """Histogramas de latência por tabela das chamadas ao PostgREST deste processo."""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token and request.headers.get("x-admin-token") != admin_token:
+        return JSONResponse(status_code=403, content={"error": "forbidden"})
+    return {"tables": get_postgrest().latency_snapshot()}
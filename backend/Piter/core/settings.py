@@ -24,6 +24,12 @@ class Settings(BaseSettings):
     WA_PHONE_NUMBER_ID: str | None = None
     WA_API_BASE: str | None = "https://graph.facebook.com/v19.0"
 
+    # Backend das escritas quentes do webhook: postgrest | postgres
+    WA_STORAGE_BACKEND: str = "postgrest"
+    WA_DATABASE_URL: str | None = None
+    WA_DB_POOL_MIN: int = 1
+    WA_DB_POOL_MAX: int = 10
+
     class Config:
         case_sensitive = True
         env_file = ".env"
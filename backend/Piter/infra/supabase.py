@@ -3,6 +3,7 @@ from supabase import create_client, Client
 from ..core.settings import get_settings
 
 
+@lru_cache()
 def get_supabase() -> Client:
     settings = get_settings()
     
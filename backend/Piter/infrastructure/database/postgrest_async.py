@@ -0,0 +1,268 @@
+"""
+Cliente Assíncrono para o PostgREST do Supabase.
+
+Substitui as chamadas síncronas do supabase-py (`sb.table(...).execute()`) dentro
+de handlers async. Todas as requisições compartilham um único `httpx.AsyncClient`
+com keep-alive e pool de conexões, e cada chamada alimenta um histograma de
+latência por tabela (ou `rpc:<função>`), exposto para diagnóstico.
+"""
+
+import os
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+
+from ...core.settings import get_settings
+
+# Filtro no formato (coluna, operador PostgREST, valor). Ex.: ('id', 'eq', '123'),
+# ('whatsapp_number_normalized', 'not.is', None), ('button_id', 'in', ['a', 'b']).
+Filter = Tuple[str, str, Any]
+
+_LATENCY_BUCKETS_MS: Tuple[float, ...] = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """Histograma cumulativo de latência (ms) com buckets fixos."""
+
+    def __init__(self, buckets: Sequence[float] = _LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float, error: bool = False) -> None:
+        idx = len(self.buckets)
+        for i, upper in enumerate(self.buckets):
+            if ms <= upper:
+                idx = i
+                break
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if error:
+            self.errors += 1
+
+    def _quantile(self, q: float) -> Optional[float]:
+        """Estimativa pelo limite superior do bucket que contém o quantil."""
+        if not self.count:
+            return None
+        target = q * self.count
+        acc = 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{int(b)}" for b in self.buckets] + ["le_inf"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.sum_ms / self.count, 2) if self.count else None,
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": self._quantile(0.50),
+            "p95_ms": self._quantile(0.95),
+            "p99_ms": self._quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class PostgrestError(RuntimeError):
+    """Erro HTTP retornado pelo PostgREST."""
+
+    def __init__(self, status_code: int, body: str, label: str):
+        super().__init__(f"PostgREST {label} falhou com status {status_code}: {body[:500]}")
+        self.status_code = status_code
+        self.body = body
+        self.label = label
+
+
+def _encode_value(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _encode_list(values: Iterable[Any]) -> str:
+    out = []
+    for v in values:
+        s = _encode_value(v)
+        if any(c in s for c in ',()"\\ '):
+            s = '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        out.append(s)
+    return "(" + ",".join(out) + ")"
+
+
+def or_filter(*conditions: Filter) -> Tuple[str, str]:
+    """
+    Monta o parâmetro `or` do PostgREST a partir de filtros (coluna, operador, valor),
+    para uso em `extra`. Ex.: or_filter(('id', 'in', ids), ('n', 'eq', '55')).
+    """
+    parts = []
+    for col, op, value in conditions:
+        if op.endswith("in") and not isinstance(value, str):
+            parts.append(f"{col}.{op}.{_encode_list(value)}")
+        else:
+            parts.append(f"{col}.{op}.{_encode_value(value)}")
+    return ("or", "(" + ",".join(parts) + ")")
+
+
+class AsyncPostgrest:
+    """
+    Acesso assíncrono às tabelas expostas pelo PostgREST do Supabase.
+
+    Usa um único `httpx.AsyncClient` (criado sob demanda dentro do event loop),
+    reaproveitando conexões TLS entre requisições.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        timeout_s: Optional[float] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None,
+    ):
+        self.base_url = url.rstrip('/') + '/rest/v1'
+        self.timeout_s = float(timeout_s or os.getenv("POSTGREST_TIMEOUT_S", "10") or 10)
+        self.max_connections = int(max_connections or os.getenv("POSTGREST_MAX_CONNECTIONS", "20") or 20)
+        self.max_keepalive = int(max_keepalive or os.getenv("POSTGREST_MAX_KEEPALIVE", "10") or 10)
+        self._headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self._headers,
+                timeout=self.timeout_s,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=30.0,
+                ),
+            )
+        return self._client
+
+    @staticmethod
+    def _build_params(
+        columns: Optional[str] = None,
+        filters: Optional[Sequence[Filter]] = None,
+        order: Optional[str] = None,
+        limit: Optional[int] = None,
+        extra: Optional[Sequence[Tuple[str, str]]] = None,
+    ) -> List[Tuple[str, str]]:
+        params: List[Tuple[str, str]] = []
+        if columns:
+            params.append(("select", columns.replace(" ", "")))
+        for col, op, value in (filters or []):
+            if op.endswith("in") and not isinstance(value, str):
+                params.append((col, f"{op}.{_encode_list(value)}"))
+            else:
+                params.append((col, f"{op}.{_encode_value(value)}"))
+        if order:
+            params.append(("order", order))
+        if limit is not None:
+            params.append(("limit", str(int(limit))))
+        params.extend(extra or [])
+        return params
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        label: str,
+        params: Optional[List[Tuple[str, str]]] = None,
+        json: Any = None,
+        prefer: Optional[str] = None,
+    ) -> Any:
+        headers = {"Prefer": prefer} if prefer else None
+        hist = self.histograms.setdefault(label, LatencyHistogram())
+        t0 = time.perf_counter()
+        error = True
+        try:
+            resp = await self._get_client().request(method, path, params=params, json=json, headers=headers)
+            if resp.status_code >= 400:
+                raise PostgrestError(resp.status_code, resp.text, label)
+            error = False
+        finally:
+            hist.observe((time.perf_counter() - t0) * 1000.0, error=error)
+        if not resp.content:
+            return None
+        return resp.json()
+
+    # =============
+    # Operações
+    # =============
+    async def select(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Optional[Sequence[Filter]] = None,
+        order: Optional[str] = None,
+        limit: Optional[int] = None,
+        extra: Optional[Sequence[Tuple[str, str]]] = None,
+    ) -> List[Dict[str, Any]]:
+        params = self._build_params(columns, filters, order, limit, extra)
+        data = await self._request("GET", f"/{table}", table, params=params)
+        return data or []
+
+    async def select_one(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Optional[Sequence[Filter]] = None,
+        order: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Equivalente ao `.maybe_single()`: primeira linha ou None."""
+        rows = await self.select(table, columns, filters=filters, order=order, limit=1)
+        return rows[0] if rows else None
+
+    async def insert(self, table: str, rows: Any, *, returning: bool = True, columns: Optional[str] = None) -> List[Dict[str, Any]]:
+        params = [("select", columns.replace(" ", ""))] if (returning and columns) else None
+        prefer = "return=representation" if returning else "return=minimal"
+        data = await self._request("POST", f"/{table}", table, params=params, json=rows, prefer=prefer)
+        if isinstance(data, dict):
+            return [data]
+        return data or []
+
+    async def update(self, table: str, values: Dict[str, Any], *, filters: Sequence[Filter], returning: bool = True) -> List[Dict[str, Any]]:
+        if not filters:
+            raise ValueError("update sem filtros não é permitido")
+        params = self._build_params(filters=filters)
+        prefer = "return=representation" if returning else "return=minimal"
+        data = await self._request("PATCH", f"/{table}", table, params=params, json=values, prefer=prefer)
+        return data or []
+
+    async def rpc(self, fn: str, args: Optional[Dict[str, Any]] = None) -> Any:
+        return await self._request("POST", f"/rpc/{fn}", f"rpc:{fn}", json=args or {})
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    def latency_snapshot(self) -> Dict[str, Any]:
+        return {label: h.snapshot() for label, h in sorted(self.histograms.items())}
+
+
+@lru_cache()
+def get_postgrest() -> AsyncPostgrest:
+    """Retorna o cliente PostgREST assíncrono compartilhado pelo processo."""
+    settings = get_settings()
+    return AsyncPostgrest(settings.SUPABASE_URL, settings.SUPABASE_KEY)
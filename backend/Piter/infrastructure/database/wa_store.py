@@ -0,0 +1,192 @@
+"""
+Backend de Persistência das Escritas Quentes do Webhook do WhatsApp.
+
+As gravações de alta frequência (mensagens in/out, `last_message_at`, cliques e
+rollups de cliques) passam por um `WaStore`, selecionado por configuração:
+
+- `WA_STORAGE_BACKEND=postgrest` (padrão): PostgREST via `AsyncPostgrest`.
+- `WA_STORAGE_BACKEND=postgres`: conexão direta ao Postgres (`WA_DATABASE_URL`)
+  com pool `psycopg_pool`, statements preparados, pipeline mode e `COPY`.
+
+Leituras e fluxos de menor volume continuam no PostgREST.
+"""
+
+import abc
+import asyncio
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from ...core.settings import get_settings
+from .postgrest_async import AsyncPostgrest, get_postgrest
+
+try:
+    from psycopg.types.json import Jsonb
+    from psycopg_pool import AsyncConnectionPool
+except Exception:
+    Jsonb = None  # type: ignore
+    AsyncConnectionPool = None  # type: ignore
+
+
+class WaStore(abc.ABC):
+    """Interface das escritas quentes do webhook."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def insert_message(self, row: Dict[str, Any], touch_conversation: bool = True) -> None:
+        """Grava uma linha em wa_messages e, opcionalmente, atualiza last_message_at."""
+
+    @abc.abstractmethod
+    async def insert_clicks(self, rows: List[Dict[str, Any]]) -> None:
+        """Grava um lote de eventos em wa_button_clicks."""
+
+    @abc.abstractmethod
+    async def add_click_rollups(self, rows: List[Dict[str, Any]]) -> None:
+        """Soma contadores por minuto em wa_button_clicks_rollup."""
+
+    async def aclose(self) -> None:
+        return None
+
+
+class PostgrestWaStore(WaStore):
+    name = "postgrest"
+
+    def __init__(self, db: Optional[AsyncPostgrest] = None):
+        self.db = db or get_postgrest()
+
+    async def insert_message(self, row: Dict[str, Any], touch_conversation: bool = True) -> None:
+        await self.db.insert('wa_messages', row, returning=False)
+        if touch_conversation:
+            await self.db.update(
+                'wa_conversations',
+                {'last_message_at': 'now()'},
+                filters=[('id', 'eq', row['conversation_id'])],
+                returning=False,
+            )
+
+    async def insert_clicks(self, rows: List[Dict[str, Any]]) -> None:
+        if rows:
+            await self.db.insert('wa_button_clicks', rows, returning=False)
+
+    async def add_click_rollups(self, rows: List[Dict[str, Any]]) -> None:
+        if rows:
+            await self.db.rpc('wa_button_clicks_rollup_add', {'p_rows': rows})
+
+
+_INSERT_MESSAGE_SQL = (
+    "insert into wa_messages (conversation_id, direction, type, json_payload, wa_message_id) "
+    "values (%s, %s, %s, %s, %s)"
+)
+_TOUCH_CONVERSATION_SQL = "update wa_conversations set last_message_at = now() where id = %s"
+_COPY_CLICKS_SQL = (
+    "copy wa_button_clicks (conversation_id, contact_id, wa_message_id, button_id, button_title, clicked_at) "
+    "from stdin"
+)
+_CLICK_COLUMNS = ('conversation_id', 'contact_id', 'wa_message_id', 'button_id', 'button_title', 'clicked_at')
+_ROLLUP_INSERT_HEAD = "insert into wa_button_clicks_rollup as r (bucket_minute, button_id, account_id, clicks) values "
+_ROLLUP_INSERT_TAIL = (
+    " on conflict (bucket_minute, button_id, account_id) "
+    "do update set clicks = r.clicks + excluded.clicks, updated_at = now()"
+)
+
+
+class PostgresWaStore(WaStore):
+    """
+    Escritas diretas no Postgres via `psycopg_pool.AsyncConnectionPool`.
+
+    - Mensagem + `last_message_at` vão em um único round-trip (pipeline mode),
+      com statements preparados no servidor (`prepare=True`).
+    - Cliques em lote usam `COPY ... FROM STDIN`.
+    - Rollups usam um único `INSERT ... VALUES (...), (...) ON CONFLICT`.
+
+    Observação: statements preparados exigem conexão de sessão; use a porta
+    direta do Postgres (não o pooler em modo transaction) em `WA_DATABASE_URL`.
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10):
+        if AsyncConnectionPool is None:
+            raise RuntimeError("psycopg/psycopg_pool não instalados")
+        self.pool = AsyncConnectionPool(
+            dsn,
+            min_size=min_size,
+            max_size=max_size,
+            kwargs={"autocommit": True},
+            open=False,
+            name="wa_store",
+        )
+        self._opened = False
+        self._open_lock = asyncio.Lock()
+
+    async def _ensure_open(self) -> AsyncConnectionPool:
+        if not self._opened:
+            async with self._open_lock:
+                if not self._opened:
+                    await self.pool.open()
+                    self._opened = True
+        return self.pool
+
+    async def insert_message(self, row: Dict[str, Any], touch_conversation: bool = True) -> None:
+        pool = await self._ensure_open()
+        params = (
+            row['conversation_id'],
+            row.get('direction'),
+            row.get('type'),
+            Jsonb(row.get('json_payload')) if row.get('json_payload') is not None else None,
+            row.get('wa_message_id'),
+        )
+        async with pool.connection() as conn:
+            async with conn.pipeline():
+                async with conn.cursor() as cur:
+                    await cur.execute(_INSERT_MESSAGE_SQL, params, prepare=True)
+                    if touch_conversation:
+                        await cur.execute(_TOUCH_CONVERSATION_SQL, (row['conversation_id'],), prepare=True)
+
+    async def insert_clicks(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        pool = await self._ensure_open()
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                async with cur.copy(_COPY_CLICKS_SQL) as copy:
+                    for r in rows:
+                        await copy.write_row(tuple(r.get(c) for c in _CLICK_COLUMNS))
+
+    async def add_click_rollups(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        pool = await self._ensure_open()
+        values = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+        params: List[Any] = []
+        for r in rows:
+            params.extend([r['bucket_minute'], r['button_id'], r.get('account_id') or '', int(r['clicks'])])
+        async with pool.connection() as conn:
+            await conn.execute(_ROLLUP_INSERT_HEAD + values + _ROLLUP_INSERT_TAIL, params)
+
+    async def aclose(self) -> None:
+        if self._opened:
+            await self.pool.close()
+            self._opened = False
+
+
+@lru_cache()
+def get_wa_store() -> WaStore:
+    """Retorna o backend de escrita configurado em WA_STORAGE_BACKEND."""
+    settings = get_settings()
+    backend = (settings.WA_STORAGE_BACKEND or "postgrest").strip().lower()
+    if backend == "postgres":
+        if not settings.WA_DATABASE_URL:
+            print("[WARN] WA_STORAGE_BACKEND=postgres sem WA_DATABASE_URL; usando PostgREST.")
+        else:
+            try:
+                store = PostgresWaStore(
+                    settings.WA_DATABASE_URL,
+                    min_size=settings.WA_DB_POOL_MIN,
+                    max_size=settings.WA_DB_POOL_MAX,
+                )
+                print("[DEBUG] WaStore: usando Postgres direto (psycopg_pool).")
+                return store
+            except Exception as e:
+                print(f"[WARN] Falha ao iniciar PostgresWaStore: {repr(e)}; usando PostgREST.")
+    return PostgrestWaStore()
@@ -0,0 +1,193 @@
+"""
+Pipeline de Analytics de Cliques em Botões do WhatsApp.
+
+Os cliques deixam de ser gravados de forma síncrona no caminho da requisição:
+cada evento é enfileirado em memória e gravado em lote (bulk insert) em
+`wa_button_clicks` por uma task em background. Em paralelo, o pipeline mantém
+contadores por minuto (button_id x conta) que são descarregados na tabela de
+rollup `wa_button_clicks_rollup` (via o `WaStore` configurado).
+Consultas de funil/conversão leem o rollup em vez da tabela bruta de cliques.
+"""
+
+import asyncio
+import os
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..infrastructure.database.wa_store import get_wa_store
+from .message_parser import ParsedWhatsAppMessage
+
+
+class ButtonClickPipeline:
+    """
+    Buffer de eventos de clique com flush periódico e contadores por minuto.
+
+    `record()` nunca faz I/O: apenas adiciona o evento ao buffer e incrementa o
+    contador do minuto corrente. A gravação acontece em `flush()`, disparada
+    pelo intervalo configurado, quando o lote atinge `batch_size` ou no shutdown.
+    """
+
+    def __init__(
+        self,
+        flush_interval_s: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        max_buffer: Optional[int] = None,
+    ):
+        self.flush_interval_s = float(flush_interval_s or os.getenv("WA_CLICKS_FLUSH_INTERVAL_S", "5") or 5)
+        self.batch_size = int(batch_size or os.getenv("WA_CLICKS_BATCH_SIZE", "200") or 200)
+        self.max_buffer = int(max_buffer or os.getenv("WA_CLICKS_MAX_BUFFER", "10000") or 10000)
+
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        # (bucket_minute, button_id, account_id) -> cliques
+        self._rollup: Dict[Tuple[str, str, str], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.stats = {
+            "recorded": 0,
+            "dropped": 0,
+            "flushed_events": 0,
+            "flushed_rollups": 0,
+            "flush_errors": 0,
+        }
+
+    # =============
+    # Caminho da requisição
+    # =============
+    def record(self, conversation_id: str, contact_id: str, msg: ParsedWhatsAppMessage, account_id: Optional[str] = None) -> None:
+        """Enfileira um clique. Não bloqueia e não falha o fluxo do usuário."""
+        now = datetime.now(timezone.utc)
+        bucket = now.replace(second=0, microsecond=0).isoformat()
+        # O payload bruto já é persistido em wa_messages (mesmo wa_message_id);
+        # não o duplicamos em cada linha de clique.
+        event = {
+            'conversation_id': conversation_id,
+            'contact_id': contact_id,
+            'wa_message_id': msg.message_id,
+            'button_id': msg.button_id,
+            'button_title': msg.button_title,
+            'clicked_at': now.isoformat(),
+        }
+        key = (bucket, str(msg.button_id or ''), str(account_id or ''))
+
+        with self._lock:
+            if len(self._events) >= self.max_buffer:
+                self.stats["dropped"] += 1
+            else:
+                self._events.append(event)
+            self._rollup[key] = self._rollup.get(key, 0) + 1
+            self.stats["recorded"] += 1
+            should_wake = len(self._events) >= self.batch_size
+
+        # Sem event loop rodando os eventos ficam no buffer até o próximo flush.
+        if self._ensure_task() and should_wake and self._wakeup is not None:
+            self._wakeup.set()
+
+    # =============
+    # Background
+    # =============
+    def _ensure_task(self) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._stopping:
+            return False  # em shutdown: o flush final de close() grava o que sobrar
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        return True
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _drain(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        with self._lock:
+            events, self._events = self._events, []
+            rollup, self._rollup = self._rollup, {}
+        rows = [
+            {'bucket_minute': b, 'button_id': btn, 'account_id': acc, 'clicks': n}
+            for (b, btn, acc), n in rollup.items()
+        ]
+        return events, rows
+
+    def _requeue(self, events: List[Dict[str, Any]]) -> None:
+        """Devolve um lote que falhou ao buffer, respeitando o limite de memória."""
+        with self._lock:
+            room = max(0, self.max_buffer - len(self._events))
+            self._events[:0] = events[:room]
+            self.stats["dropped"] += max(0, len(events) - room)
+
+    def _requeue_rollup(self, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for r in rows:
+                key = (r['bucket_minute'], r['button_id'], r['account_id'])
+                self._rollup[key] = self._rollup.get(key, 0) + int(r['clicks'])
+
+    async def _write(self, events: List[Dict[str, Any]], rollup_rows: List[Dict[str, Any]]) -> None:
+        store = get_wa_store()
+        for i in range(0, len(events), self.batch_size):
+            chunk = events[i:i + self.batch_size]
+            try:
+                await store.insert_clicks(chunk)
+                self.stats["flushed_events"] += len(chunk)
+            except Exception as e:
+                self.stats["flush_errors"] += 1
+                print(f'[WARN] Failed to bulk insert button clicks ({len(chunk)}): {repr(e)}')
+                self._requeue(events[i:])
+                break
+        if rollup_rows:
+            try:
+                await store.add_click_rollups(rollup_rows)
+                self.stats["flushed_rollups"] += len(rollup_rows)
+            except Exception as e:
+                self.stats["flush_errors"] += 1
+                print(f'[WARN] Failed to flush button click rollups: {repr(e)}')
+                self._requeue_rollup(rollup_rows)
+
+    async def flush(self) -> None:
+        """Grava eventos pendentes e contadores acumulados."""
+        events, rows = self._drain()
+        if not events and not rows:
+            return
+        try:
+            await self._write(events, rows)
+        except Exception as e:
+            print(f'[WARN] Button click flush failed: {repr(e)}')
+
+    async def close(self) -> None:
+        """
+        Shutdown gracioso: sinaliza a parada, acorda o loop e espera a task terminar
+        (um flush em andamento é concluído, não cancelado), depois grava o que sobrou.
+        """
+        self._stopping = True
+        if self._task is not None and not self._task.done():
+            if self._wakeup is not None:
+                self._wakeup.set()
+            try:
+                await self._task
+            except Exception as e:
+                print(f'[WARN] Button click task failed on close: {repr(e)}')
+        self._task = None
+        await self.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            pending_events = len(self._events)
+            pending_rollups = len(self._rollup)
+        return {**self.stats, "pending_events": pending_events, "pending_rollups": pending_rollups}
+
+
+@lru_cache()
+def get_click_pipeline() -> ButtonClickPipeline:
+    """Retorna a instância única do pipeline de cliques do processo."""
+    return ButtonClickPipeline()
@@ -0,0 +1,113 @@
+"""
+Dataloader de Usuários (`users`) com Escopo de Requisição.
+
+Reúne todas as chaves candidatas (ids e números normalizados) de uma requisição
+— ou de um lote de envios — e resolve todas em uma única consulta `or=(...)` ao
+PostgREST. Os resultados (inclusive ausências) ficam memorizados até o fim da
+requisição, então buscas repetidas não voltam ao banco.
+
+Se a consulta em lote for recusada pelo PostgREST (ex.: um id com formato
+inválido), as chaves são resolvidas uma a uma e o erro fica associado só à
+chave culpada: quem pedir essa chave recebe a exceção, as demais seguem.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from ..infrastructure.database.postgrest_async import AsyncPostgrest, PostgrestError, get_postgrest, or_filter
+
+
+class UsersLoader:
+    """Carrega linhas de `users` por id ou por `whatsapp_number_normalized`, em lote."""
+
+    COLUMNS = 'id,user_name,whatsapp_number_normalized'
+
+    def __init__(self, db: Optional[AsyncPostgrest] = None):
+        self.db = db or get_postgrest()
+        self._by_id: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._by_number: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._pending_ids: Set[str] = set()
+        self._pending_numbers: Set[str] = set()
+        self._errors: Dict[Tuple[str, str], Exception] = {}
+        self.queries = 0
+
+    def prime(self, ids: Iterable[Optional[str]] = (), numbers: Iterable[Optional[str]] = ()) -> None:
+        """Registra chaves que serão buscadas no próximo carregamento."""
+        for i in ids:
+            i = (i or '').strip()
+            if i and i not in self._by_id and ('id', i) not in self._errors:
+                self._pending_ids.add(i)
+        for n in numbers:
+            n = (n or '').strip()
+            if n and n not in self._by_number and ('number', n) not in self._errors:
+                self._pending_numbers.add(n)
+
+    async def _fetch(self, ids: List[str], numbers: List[str]) -> None:
+        conditions = []
+        if ids:
+            conditions.append(('id', 'in', ids))
+        if numbers:
+            conditions.append(('whatsapp_number_normalized', 'in', numbers))
+        self.queries += 1
+        rows = await self.db.select('users', self.COLUMNS, extra=[or_filter(*conditions)])
+        for r in rows:
+            rid = str(r.get('id') or '')
+            if rid:
+                self._by_id[rid] = r
+            num = (r.get('whatsapp_number_normalized') or '').strip()
+            if num and self._by_number.get(num) is None:
+                self._by_number[num] = r
+        # Memoriza ausências para não repetir a consulta
+        for i in ids:
+            self._by_id.setdefault(i, None)
+        for n in numbers:
+            self._by_number.setdefault(n, None)
+
+    async def load(self) -> None:
+        """
+        Resolve todas as chaves pendentes em uma única consulta. Não levanta: falhas
+        ficam registradas por chave e são relançadas em `by_id`/`by_number`.
+        """
+        ids, numbers = sorted(self._pending_ids), sorted(self._pending_numbers)
+        self._pending_ids.clear()
+        self._pending_numbers.clear()
+        if not ids and not numbers:
+            return
+        keys = [('id', i) for i in ids] + [('number', n) for n in numbers]
+        try:
+            await self._fetch(ids, numbers)
+            return
+        except PostgrestError as e:
+            if len(keys) == 1 or e.status_code != 400:
+                self._errors.update({k: e for k in keys})
+                return
+        except Exception as e:
+            self._errors.update({k: e for k in keys})
+            return
+        # Lote recusado (400): números (texto) numa consulta, ids um a um para isolar o inválido
+        groups = [[('number', n) for n in numbers]] if numbers else []
+        groups += [[('id', i)] for i in ids]
+        for group in groups:
+            try:
+                await self._fetch([k for kind, k in group if kind == 'id'], [k for kind, k in group if kind == 'number'])
+            except Exception as e:
+                self._errors.update({k: e for k in group})
+
+    async def by_id(self, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        key = (user_id or '').strip()
+        if not key:
+            return None
+        self.prime(ids=[key])
+        await self.load()
+        if ('id', key) in self._errors:
+            raise self._errors[('id', key)]
+        return self._by_id.get(key)
+
+    async def by_number(self, number: Optional[str]) -> Optional[Dict[str, Any]]:
+        key = (number or '').strip()
+        if not key:
+            return None
+        self.prime(numbers=[key])
+        await self.load()
+        if ('number', key) in self._errors:
+            raise self._errors[('number', key)]
+        return self._by_number.get(key)
@@ -6,13 +6,22 @@ gerenciar o estado da conversa e orquestrar as respostas para o usuário.
 """
 
 import os
+import re
 import json
+import time
 from typing import Dict, Any, Optional, Tuple
-from ..infrastructure.database.supabase_client import get_supabase, SupabaseClient
+from ..infrastructure.database.postgrest_async import AsyncPostgrest, get_postgrest
+from ..infrastructure.database.wa_store import WaStore, get_wa_store
 from ..infrastructure.messaging.whatsapp_client import WhatsAppClient
 from .message_parser import ParsedWhatsAppMessage
+from .click_analytics import get_click_pipeline
 from .flows import DemoFlowsService # Para manter a lógica de demo por enquanto
 
+# Número normalizado -> (expira_em, account_id de `users`); evita uma consulta por clique
+_ACCOUNT_CACHE: Dict[str, Tuple[float, str]] = {}
+_ACCOUNT_CACHE_MAX = 10000
+
+
 class FlowResult:
     """Representa o resultado do processamento de uma etapa do fluxo."""
     def __init__(self, reply_text: Optional[str] = None, new_step: Optional[str] = None, context_patch: Optional[dict] = None):
@@ -24,22 +33,20 @@ class WhatsAppFlowService:
     """
     Orquestra o fluxo de conversa, processando mensagens e gerenciando o estado.
     """
-    def __init__(self, supabase_client: Optional[SupabaseClient] = None, whatsapp_client: Optional[WhatsAppClient] = None):
-        self.sb = supabase_client or get_supabase()
+    def __init__(self, db: Optional[AsyncPostgrest] = None, whatsapp_client: Optional[WhatsAppClient] = None, store: Optional[WaStore] = None):
+        self.db = db or get_postgrest()
+        self.store = store or get_wa_store()
         self.wa_client = whatsapp_client or WhatsAppClient()
         self.demo_flows = DemoFlowsService(self.wa_client) # Injeta o cliente
 
-    def _get_conversation_state(self, conversation_id: str) -> Tuple[str, dict]:
+    async def _get_conversation_state(self, conversation_id: str) -> Tuple[str, dict]:
         """Busca o estado atual da conversa no banco de dados (wa_conversation_state)."""
         try:
-            resp = (
-                self.sb.table('wa_conversation_state')
-                .select('state_key, data')
-                .eq('conversation_id', conversation_id)
-                .maybe_single()
-                .execute()
-            )
-            rdata = getattr(resp, 'data', None) or (resp.get('data') if isinstance(resp, dict) else None) or {}
+            rdata = await self.db.select_one(
+                'wa_conversation_state',
+                'state_key,data',
+                filters=[('conversation_id', 'eq', conversation_id)],
+            ) or {}
             state_key = (rdata.get('state_key') or 'welcome')
             state_data = (rdata.get('data') or {})
             return state_key, state_data
@@ -47,16 +54,16 @@ class WhatsAppFlowService:
             print(f"[WARN] _get_conversation_state failed: {repr(e)}")
             return 'welcome', {}
 
-    def _set_conversation_state(self, conversation_id: str, step: str, context: dict) -> None:
+    async def _set_conversation_state(self, conversation_id: str, step: str, context: dict) -> None:
         """Salva o novo estado da conversa no banco (RPC wa_set_conversation_state)."""
         try:
             # Tenta via RPC se existir
             try:
-                self.sb.rpc('wa_set_conversation_state', {
+                await self.db.rpc('wa_set_conversation_state', {
                     'p_conversation_id': str(conversation_id),
                     'p_state_key': str(step),
                     'p_data': context or None,
-                }).execute()
+                })
                 return
             except Exception:
                 pass
@@ -70,41 +77,61 @@ class WhatsAppFlowService:
                 'updated_at': 'now()',
             }
             # upsert (insert com on_conflict) pode não estar disponível em todos os SDKs; tentamos update->insert
-            upd = (
-                self.sb.table('wa_conversation_state')
-                .update(payload)
-                .eq('conversation_id', conversation_id)
-                .execute()
+            udata = await self.db.update(
+                'wa_conversation_state',
+                payload,
+                filters=[('conversation_id', 'eq', conversation_id)],
             )
-            udata = getattr(upd, 'data', None) or (upd.get('data') if isinstance(upd, dict) else None)
             if not udata:
                 # cria se não existir
-                self.sb.table('wa_conversation_state').insert({
+                await self.db.insert('wa_conversation_state', {
                     'conversation_id': str(conversation_id),
                     'state_key': str(step),
                     'data': context or None,
-                }).execute()
+                }, returning=False)
         except Exception as e:
             print(f"[WARN] Failed to set conversation state: {repr(e)}")
 
-    def _persist_button_click(self, conversation_id: str, contact_id: str, msg: ParsedWhatsAppMessage):
-        """Salva o evento de clique de botão para fins de análise."""
+    async def _account_for_number(self, number: Optional[str]) -> str:
+        """
+        account_id (`users.account_id`) do dono do número, com cache em memória
+        (WA_ACCOUNT_CACHE_TTL_S, padrão 300). Sem usuário ou em falha: '' (sem conta).
+        """
+        key = re.sub(r"\D", "", number or "")
+        if not key:
+            return ''
+        now = time.monotonic()
+        hit = _ACCOUNT_CACHE.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
         try:
-            self.sb.table('wa_button_clicks').insert({
-                'conversation_id': conversation_id,
-                'contact_id': contact_id,
-                'wa_message_id': msg.message_id,
-                'button_id': msg.button_id,
-                'button_title': msg.button_title,
-                'raw_payload': msg.raw_message_payload,
-                'clicked_at': 'now()',
-            }).execute()
+            row = await self.db.select_one(
+                'users',
+                'account_id',
+                filters=[('whatsapp_number_normalized', 'eq', key)],
+            ) or {}
         except Exception as e:
-            print(f'[WARN] Failed to persist button click: {repr(e)}')
+            print(f"[WARN] _account_for_number failed: {repr(e)}")
+            return ''
+        account_id = str(row.get('account_id') or '')
+        if len(_ACCOUNT_CACHE) >= _ACCOUNT_CACHE_MAX:
+            _ACCOUNT_CACHE.clear()
+        ttl = float(os.getenv("WA_ACCOUNT_CACHE_TTL_S", "300") or 300)
+        _ACCOUNT_CACHE[key] = (now + ttl, account_id)
+        return account_id
+
+    async def _persist_button_click(self, conversation_id: str, contact_id: str, msg: ParsedWhatsAppMessage):
+        """Enfileira o evento de clique de botão no pipeline de analytics (gravação em lote)."""
+        try:
+            # Dimensão de conta do rollup: a conta (accounts) do usuário dono do número, não o contato
+            account_id = await self._account_for_number(msg.sender_number)
+            get_click_pipeline().record(conversation_id, contact_id, msg, account_id=account_id)
+        except Exception as e:
+            print(f'[WARN] Failed to enqueue button click: {repr(e)}')
     
-    def _handle_text_based_flow(self, conversation_id: str, msg: ParsedWhatsAppMessage) -> Optional[FlowResult]:
+    async def _handle_text_based_flow(self, conversation_id: str, msg: ParsedWhatsAppMessage) -> Optional[FlowResult]:
         """Gerencia a lógica de conversa baseada em texto e estado."""
-        step, context = self._get_conversation_state(conversation_id)
+        step, context = await self._get_conversation_state(conversation_id)
         text = msg.text
 
         if step == 'welcome':
@@ -115,7 +142,7 @@ class WhatsAppFlowService:
                 "3) Suporte"
             )
             new_step = 'menu'
-            self._set_conversation_state(conversation_id, new_step, context)
+            await self._set_conversation_state(conversation_id, new_step, context)
             return FlowResult(reply_text=reply, new_step=new_step)
 
         if step == 'menu':
@@ -132,16 +159,16 @@ class WhatsAppFlowService:
             else:
                 reply = "Não entendi. Escolha 1, 2 ou 3."
                 new_step = 'menu'
-            self._set_conversation_state(conversation_id, new_step, context)
+            await self._set_conversation_state(conversation_id, new_step, context)
             return FlowResult(reply_text=reply, new_step=new_step)
 
         # Outros estados (collect_account_for_conciliation, etc.) continuam aqui...
 
         # Fallback
-        self._set_conversation_state(conversation_id, 'welcome', context)
+        await self._set_conversation_state(conversation_id, 'welcome', context)
         return FlowResult(reply_text="Voltando ao início...", new_step='welcome')
 
-    def _persist_outbound_message(self, conversation_id: str, msg_type: str, body: dict):
+    async def _persist_outbound_message(self, conversation_id: str, msg_type: str, body: dict):
         """Persiste uma mensagem de saída no banco de dados."""
         try:
             payload = {
@@ -150,12 +177,11 @@ class WhatsAppFlowService:
                 'type': msg_type,
                 'json_payload': body,
             }
-            self.sb.table('wa_messages').insert(payload).execute()
-            self.sb.table('wa_conversations').update({'last_message_at': 'now()'}).eq('id', conversation_id).execute()
+            await self.store.insert_message(payload)
         except Exception as e:
             print(f'[WARN] Failed to persist outbound message: {repr(e)}')
 
-    def _send_next_buttons(self, conversation_id: str, to_number: str, catalog_obj: Dict[str, Any]):
+    async def _send_next_buttons(self, conversation_id: str, to_number: str, catalog_obj: Dict[str, Any]):
         """Envia uma mensagem com os próximos botões, se definidos no catálogo."""
         try:
             next_btns = (catalog_obj or {}).get('next_buttons') or []
@@ -168,34 +194,37 @@ class WhatsAppFlowService:
             if next_btns:
                 body_txt = (catalog_obj or {}).get('response_text') or 'Selecione uma opção:'
                 self.wa_client.send_buttons(to_number, body_txt, next_btns)
-                self._persist_outbound_message(conversation_id, 'interactive', {
+                await self._persist_outbound_message(conversation_id, 'interactive', {
                     'interactive': {'type': 'button', 'action': {'buttons': next_btns}, 'body': {'text': body_txt}},
                 })
         except Exception as e:
             print(f'[WARN] Next buttons send failed: {repr(e)}')
 
-    def _apply_next_state(self, conversation_id: str, catalog_obj: Dict[str, Any]):
+    async def _apply_next_state(self, conversation_id: str, catalog_obj: Dict[str, Any]):
         """Aplica o próximo estado de conversa, se definido no catálogo (direto na tabela)."""
         try:
             next_state = (catalog_obj or {}).get('next_state')
             if next_state:
-                self._set_conversation_state(conversation_id, str(next_state), {})
+                await self._set_conversation_state(conversation_id, str(next_state), {})
         except Exception as e:
             print(f'[WARN] Next state update failed: {repr(e)}')
 
-    def _handle_button_click(self, conversation_id: str, contact_id: str, msg: ParsedWhatsAppMessage) -> bool:
+    async def _handle_button_click(self, conversation_id: str, contact_id: str, msg: ParsedWhatsAppMessage) -> bool:
         """Processa um clique de botão, consultando o catálogo e executando a ação."""
         btn_id = msg.button_id
         to_number = msg.sender_number
         if not btn_id or not to_number:
             return False
 
-        self._persist_button_click(conversation_id, contact_id, msg)
+        await self._persist_button_click(conversation_id, contact_id, msg)
 
         # 1. Tenta rotear pelo catálogo de botões
         try:
-            q_cat = self.sb.table('wa_buttons_catalog').select('*').eq('id', btn_id).eq('active', True).maybe_single().execute()
-            cat = q_cat.data if q_cat and q_cat.data else None
+            cat = await self.db.select_one(
+                'wa_buttons_catalog',
+                '*',
+                filters=[('id', 'eq', btn_id), ('active', 'eq', True)],
+            )
         except Exception as e:
             print(f'[WARN] Catalog lookup failed: {repr(e)}')
             cat = None
@@ -210,9 +239,9 @@ class WhatsAppFlowService:
                 resp_text = (cat.get('response_text') or '').strip()
                 if resp_text:
                     self.wa_client.send_text(to_number, resp_text)
-                    self._persist_outbound_message(conversation_id, 'text', {"text": {"body": resp_text}})
-                self._send_next_buttons(conversation_id, to_number, cat)
-                self._apply_next_state(conversation_id, cat)
+                    await self._persist_outbound_message(conversation_id, 'text', {"text": {"body": resp_text}})
+                await self._send_next_buttons(conversation_id, to_number, cat)
+                await self._apply_next_state(conversation_id, cat)
                 return True
             elif rtype == 'webhook':
                 # Executa um webhook externo definido em meta.webhook_url
@@ -232,7 +261,7 @@ class WhatsAppFlowService:
                         'contact_id': contact_id,
                         'to': to_number,
                         'button_id': btn_id,
-                        'state': self._get_conversation_state(conversation_id)[0],
+                        'state': (await self._get_conversation_state(conversation_id))[0],
                     }
                     resp = None
                     if url:
@@ -249,15 +278,15 @@ class WhatsAppFlowService:
                         txt = (j.get('text') or cat.get('response_text') or '').strip()
                         if txt:
                             self.wa_client.send_text(to_number, txt)
-                            self._persist_outbound_message(conversation_id, 'text', {"text": {"body": txt}})
+                            await self._persist_outbound_message(conversation_id, 'text', {"text": {"body": txt}})
                         # Permite que o webhook defina próximos botões/estado, senão usa do catálogo
                         override = {
                             'next_buttons': j.get('next_buttons', cat.get('next_buttons')),
                             'next_state': j.get('next_state', cat.get('next_state')),
                             'response_text': txt or cat.get('response_text'),
                         }
-                        self._send_next_buttons(conversation_id, to_number, override)
-                        self._apply_next_state(conversation_id, override)
+                        await self._send_next_buttons(conversation_id, to_number, override)
+                        await self._apply_next_state(conversation_id, override)
                         return True
                     # Se não houver webhook_url ou não houve resposta, tenta mocks locais
                     # 1) mock_summary
@@ -277,9 +306,9 @@ class WhatsAppFlowService:
                                 lines.append(f"{i}. {b.get('nome','?')} — {b.get('qtd',0)} un")
                         txt = "\n".join(lines)
                         self.wa_client.send_text(to_number, txt)
-                        self._persist_outbound_message(conversation_id, 'text', {"text": {"body": txt}})
-                        self._send_next_buttons(conversation_id, to_number, cat)
-                        self._apply_next_state(conversation_id, cat)
+                        await self._persist_outbound_message(conversation_id, 'text', {"text": {"body": txt}})
+                        await self._send_next_buttons(conversation_id, to_number, cat)
+                        await self._apply_next_state(conversation_id, cat)
                         return True
                     # 2) mock_consumption
                     mc = (meta or {}).get('mock_consumption')
@@ -289,9 +318,9 @@ class WhatsAppFlowService:
                             lines.append(f"- {it.get('insumo','?')}: {it.get('qtd',0)} {it.get('unidade','')}")
                         txt = "\n".join(lines)
                         self.wa_client.send_text(to_number, txt)
-                        self._persist_outbound_message(conversation_id, 'text', {"text": {"body": txt}})
-                        self._send_next_buttons(conversation_id, to_number, cat)
-                        self._apply_next_state(conversation_id, cat)
+                        await self._persist_outbound_message(conversation_id, 'text', {"text": {"body": txt}})
+                        await self._send_next_buttons(conversation_id, to_number, cat)
+                        await self._apply_next_state(conversation_id, cat)
                         return True
                     # 3) service inventory.low_stock_list
                     service = (meta or {}).get('service')
@@ -302,18 +331,18 @@ class WhatsAppFlowService:
                             {'insumo': 'Molho', 'qtd_atual': 5, 'qtd_min': 10, 'unid': 'kg'},
                         ]
                         self.demo_flows.send_low_stock_list(to_number, items)
-                        self._send_next_buttons(conversation_id, to_number, cat)
-                        self._apply_next_state(conversation_id, cat)
+                        await self._send_next_buttons(conversation_id, to_number, cat)
+                        await self._apply_next_state(conversation_id, cat)
                         return True
                 except Exception as e:
                     print(f'[WARN] Webhook execution failed: {repr(e)}')
                 # Se falhar, ainda tenta aplicar next do catálogo
-                self._send_next_buttons(conversation_id, to_number, cat)
-                self._apply_next_state(conversation_id, cat)
+                await self._send_next_buttons(conversation_id, to_number, cat)
+                await self._apply_next_state(conversation_id, cat)
                 return True
             elif rtype in ('none', 'noop'):
-                self._send_next_buttons(conversation_id, to_number, cat)
-                self._apply_next_state(conversation_id, cat)
+                await self._send_next_buttons(conversation_id, to_number, cat)
+                await self._apply_next_state(conversation_id, cat)
                 return True
 
         # 2. Fallback para a lógica de demonstração hardcoded
@@ -343,16 +372,16 @@ class WhatsAppFlowService:
 
         return False # Botão não foi tratado nem pelo catálogo, nem pelo fallback
 
-    def process_message(self, conversation_id: str, contact_id: str, msg: ParsedWhatsAppMessage):
+    async def process_message(self, conversation_id: str, contact_id: str, msg: ParsedWhatsAppMessage):
         """
         Ponto de entrada principal para processar uma nova mensagem.
         """
         handled = False
         if msg.button_id:
-            handled = self._handle_button_click(conversation_id, contact_id, msg)
+            handled = await self._handle_button_click(conversation_id, contact_id, msg)
 
         if not handled:
-            result = self._handle_text_based_flow(conversation_id, msg)
+            result = await self._handle_text_based_flow(conversation_id, msg)
             if result and result.reply_text:
                 self.wa_client.send_text(to=msg.sender_number, text=result.reply_text)
                 # Persistir resposta outbound
@@ -22,12 +22,18 @@ try:
     from backend.Piter.api.routers import forms as forms_router
     from backend.Piter.api.routers import whatsapp_webhook as wa_webhook_router
     from backend.Piter.api.routers import logs as logs_router
+    from backend.Piter.services.click_analytics import get_click_pipeline
+    from backend.Piter.infrastructure.database.postgrest_async import get_postgrest
+    from backend.Piter.infrastructure.database.wa_store import get_wa_store
 except ModuleNotFoundError:
     # Fallback quando o pacote raiz 'backend' não está no PYTHONPATH
     from Piter.api.routers import health as health_router
     from Piter.api.routers import forms as forms_router
     from Piter.api.routers import whatsapp_webhook as wa_webhook_router
     from Piter.api.routers import logs as logs_router
+    from Piter.services.click_analytics import get_click_pipeline
+    from Piter.infrastructure.database.postgrest_async import get_postgrest
+    from Piter.infrastructure.database.wa_store import get_wa_store
 
 # Importa router do SQL Agent (pode não existir em alguns ambientes)
 _SQLAGENT_IMPORT_ERR = None
@@ -108,6 +114,41 @@ async def _ensure_cors_headers(request: Request, call_next):
     response.headers.setdefault("Access-Control-Expose-Headers", "*")
     return response
 
+@app.on_event("startup")
+async def _startup_jobs():
+    # Refresh periódico do rollup diário do SQLAgent (SQLAGENT_ROLLUP_JOB=1)
+    if sqlagent_router:
+        try:
+            from sqlagent.services.rollup import start_rollup_job as _start_sqlagent_rollup  # type: ignore
+            _start_sqlagent_rollup()
+        except Exception as _e:
+            print("[WARN] Falha ao iniciar job de rollup do SQLAgent:", repr(_e))
+
+@app.on_event("shutdown")
+async def _shutdown_data_layer():
+    # Grava cliques/rollups ainda em memória e fecha os pools (Postgres/PostgREST)
+    await get_click_pipeline().close()
+    try:
+        await get_wa_store().aclose()
+    except Exception as _e:
+        print("[WARN] Falha ao fechar o WaStore:", repr(_e))
+    try:
+        await get_postgrest().aclose()
+    except Exception as _e:
+        print("[WARN] Falha ao fechar cliente PostgREST:", repr(_e))
+    if sqlagent_router:
+        try:
+            from sqlagent.infra.schema_catalog import close_catalog as _close_sqlagent_catalog  # type: ignore
+            from sqlagent.infra.db import close_pool as _close_sqlagent_pool  # type: ignore
+            from sqlagent.services.providers import close_providers as _close_sqlagent_providers  # type: ignore
+            from sqlagent.services.rollup import stop_rollup_job as _stop_sqlagent_rollup  # type: ignore
+            await _stop_sqlagent_rollup()
+            await _close_sqlagent_catalog()
+            await _close_sqlagent_pool()
+            await _close_sqlagent_providers()
+        except Exception as _e:
+            print("[WARN] Falha ao fechar pool do SQLAgent:", repr(_e))
+
 # Inclui routers do agente Piter
 app.include_router(health_router.router)
 app.include_router(forms_router.router)
@@ -0,0 +1,155 @@
+"""
+Benchmark das escritas quentes do webhook: PostgREST x Postgres direto.
+
+Dispara a mesma carga (taxa fixa de mensagens/s e lotes de cliques) contra cada
+backend de `WaStore` e reporta latência (p50/p95/p99) e throughput obtido.
+Grava linhas reais: use uma conversa de teste.
+
+Uso (script avulso; `backend/scripts` não é pacote, para não sombrear os
+imports legados `scripts.*` de backend/main.py):
+    python backend/scripts/bench_wa_storage.py --conversation-id <uuid> --contact-id <uuid> \
+        --rate 200 --seconds 10 --click-batch 200 [--backends postgrest,postgres]
+
+Requer SUPABASE_URL/SUPABASE_KEY (PostgREST) e WA_DATABASE_URL (Postgres).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List
+
+# Raiz do projeto no path para importar `backend.*` ao rodar pelo caminho do arquivo
+_PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
+
+from backend.Piter.infrastructure.database.postgrest_async import AsyncPostgrest
+from backend.Piter.infrastructure.database.wa_store import PostgresWaStore, PostgrestWaStore, WaStore
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(q * len(s)))], 2)
+
+
+async def _bench_messages(store: WaStore, conversation_id: str, rate: int, seconds: float, concurrency: int) -> Dict[str, float]:
+    """Taxa fixa: agenda uma mensagem a cada 1/rate s, limitada por `concurrency`."""
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await store.insert_message({
+                    'conversation_id': conversation_id,
+                    'direction': 'in',
+                    'type': 'text',
+                    'json_payload': {'bench': True, 'i': i},
+                    'wa_message_id': f"bench-{uuid.uuid4()}",
+                })
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"[WARN] {store.name} insert_message falhou: {repr(e)}")
+
+    total = int(rate * seconds)
+    interval = 1.0 / rate
+    tasks = []
+    start = time.perf_counter()
+    for i in range(total):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    return {
+        'sent': total,
+        'errors': errors,
+        'throughput_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': _pct(latencies, 0.50),
+        'p95_ms': _pct(latencies, 0.95),
+        'p99_ms': _pct(latencies, 0.99),
+    }
+
+
+async def _bench_clicks(store: WaStore, conversation_id: str, contact_id: str, batch: int, rounds: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    for r in range(rounds):
+        now = datetime.now(timezone.utc)
+        rows = [{
+            'conversation_id': conversation_id,
+            'contact_id': contact_id,
+            'wa_message_id': f"bench-{uuid.uuid4()}",
+            'button_id': 'bench',
+            'button_title': 'bench',
+            'clicked_at': now.isoformat(),
+        } for _ in range(batch)]
+        rollups = [{
+            'bucket_minute': now.replace(second=0, microsecond=0).isoformat(),
+            'button_id': 'bench',
+            'account_id': f"bench-{r}",
+            'clicks': batch,
+        }]
+        t0 = time.perf_counter()
+        await store.insert_clicks(rows)
+        await store.add_click_rollups(rollups)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    return {
+        'batch': batch,
+        'rounds': rounds,
+        'p50_ms': _pct(latencies, 0.50),
+        'p95_ms': _pct(latencies, 0.95),
+        'rows_per_s': round(batch * rounds / (sum(latencies) / 1000.0), 1) if latencies else 0.0,
+    }
+
+
+def _make_store(name: str) -> WaStore:
+    if name == 'postgres':
+        dsn = os.getenv('WA_DATABASE_URL')
+        if not dsn:
+            raise SystemExit('WA_DATABASE_URL não definido')
+        return PostgresWaStore(dsn, min_size=2, max_size=int(os.getenv('WA_DB_POOL_MAX', '10')))
+    url, key = os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY')
+    if not url or not key:
+        raise SystemExit('SUPABASE_URL/SUPABASE_KEY não definidos')
+    return PostgrestWaStore(AsyncPostgrest(url, key))
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--conversation-id', required=True)
+    ap.add_argument('--contact-id', required=True)
+    ap.add_argument('--backends', default='postgrest,postgres')
+    ap.add_argument('--rate', type=int, default=100, help='mensagens por segundo (mesma carga em todos os backends)')
+    ap.add_argument('--seconds', type=float, default=10.0)
+    ap.add_argument('--concurrency', type=int, default=20)
+    ap.add_argument('--click-batch', type=int, default=200)
+    ap.add_argument('--click-rounds', type=int, default=10)
+    args = ap.parse_args()
+
+    for name in [b.strip() for b in args.backends.split(',') if b.strip()]:
+        store = _make_store(name)
+        try:
+            msgs = await _bench_messages(store, args.conversation_id, args.rate, args.seconds, args.concurrency)
+            clicks = await _bench_clicks(store, args.conversation_id, args.contact_id, args.click_batch, args.click_rounds)
+        finally:
+            await store.aclose()
+            if isinstance(store, PostgrestWaStore):
+                await store.db.aclose()
+        print(f"[{name}] messages: {msgs}")
+        print(f"[{name}] clicks:   {clicks}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
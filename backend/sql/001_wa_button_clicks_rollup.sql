@@ -0,0 +1,49 @@
+-- Rollup por minuto de cliques em botões do WhatsApp.
+-- Alimentado pelo pipeline em backend/Piter/services/click_analytics.py
+-- (RPC wa_button_clicks_rollup_add) e lido pelas consultas de funil/conversão.
+
+create table if not exists public.wa_button_clicks_rollup (
+    bucket_minute timestamptz not null,
+    button_id     text        not null,
+    account_id    text        not null default '',
+    clicks        bigint      not null default 0,
+    updated_at    timestamptz not null default now(),
+    primary key (bucket_minute, button_id, account_id)
+);
+
+create index if not exists wa_button_clicks_rollup_button_idx
+    on public.wa_button_clicks_rollup (button_id, bucket_minute desc);
+
+create index if not exists wa_button_clicks_rollup_account_idx
+    on public.wa_button_clicks_rollup (account_id, bucket_minute desc);
+
+-- Soma incremental: p_rows = [{bucket_minute, button_id, account_id, clicks}, ...]
+create or replace function public.wa_button_clicks_rollup_add(p_rows jsonb)
+returns void
+language sql
+as $$
+    insert into public.wa_button_clicks_rollup as r (bucket_minute, button_id, account_id, clicks)
+    select (x->>'bucket_minute')::timestamptz,
+           x->>'button_id',
+           coalesce(x->>'account_id', ''),
+           (x->>'clicks')::bigint
+    from jsonb_array_elements(p_rows) as x
+    on conflict (bucket_minute, button_id, account_id)
+    do update set clicks = r.clicks + excluded.clicks,
+                  updated_at = now();
+$$;
+
+-- Funil: total de cliques por botão na janela, agregado no banco (uma linha por
+-- botão; não depende do max-rows do PostgREST). Usado por /_admin/analytics/button-funnel.
+create or replace function public.wa_button_funnel(p_button_ids text[], p_since timestamptz, p_account_id text default null)
+returns table (button_id text, clicks bigint)
+language sql
+stable
+as $$
+    select r.button_id, sum(r.clicks)::bigint
+    from public.wa_button_clicks_rollup r
+    where r.button_id = any(p_button_ids)
+      and r.bucket_minute >= p_since
+      and (p_account_id is null or r.account_id = p_account_id)
+    group by r.button_id;
+$$;
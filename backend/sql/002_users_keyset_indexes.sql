@@ -0,0 +1,12 @@
+-- Índices da listagem de owners em /_webhooks/whatsapp/_admin/users.
+-- Paginação keyset em (created_at desc, id desc) e busca por prefixo do
+-- número normalizado (like '5511%'), sem OFFSET.
+
+create index if not exists users_keyset_idx
+    on public.users (created_at desc, id desc)
+    where whatsapp_number_normalized is not null;
+
+-- text_pattern_ops permite usar o índice em LIKE 'prefixo%' independente da collation.
+create index if not exists users_number_prefix_idx
+    on public.users (whatsapp_number_normalized text_pattern_ops)
+    where whatsapp_number_normalized is not null;
@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+from backend.Piter.services import click_analytics
+from backend.Piter.services.click_analytics import ButtonClickPipeline
+
+
+class _SlowStore:
+    """WaStore falso: insert_clicks demora, para o close() chegar no meio do _write."""
+
+    def __init__(self, delay_s: float):
+        self.delay_s = delay_s
+        self.started = asyncio.Event()
+        self.clicks = []
+        self.rollups = []
+
+    async def insert_clicks(self, rows):
+        self.started.set()
+        await asyncio.sleep(self.delay_s)
+        self.clicks.extend(rows)
+
+    async def add_click_rollups(self, rows):
+        self.rollups.extend(rows)
+
+
+def _click(i: int):
+    return SimpleNamespace(message_id=f"m{i}", button_id="btn", button_title="Btn")
+
+
+def test_close_during_slow_write_keeps_in_flight_batch(monkeypatch):
+    async def scenario():
+        store = _SlowStore(delay_s=0.2)
+        monkeypatch.setattr(click_analytics, "get_wa_store", lambda: store)
+        pipeline = ButtonClickPipeline(flush_interval_s=60, batch_size=2)
+        pipeline.record("conv", "contact", _click(0), account_id="acc")
+        pipeline.record("conv", "contact", _click(1), account_id="acc")  # atinge batch_size: acorda o flush
+        await asyncio.wait_for(store.started.wait(), timeout=1)
+        pipeline.record("conv", "contact", _click(2), account_id="acc")  # chega durante o _write
+        await pipeline.close()
+        return store, pipeline
+
+    store, pipeline = asyncio.run(scenario())
+    assert sorted(e["wa_message_id"] for e in store.clicks) == ["m0", "m1", "m2"]
+    assert sum(r["clicks"] for r in store.rollups) == 3
+    assert pipeline.snapshot()["pending_events"] == 0
+    assert pipeline.stats["flush_errors"] == 0
+
+
+def test_record_after_close_is_flushed_on_next_close(monkeypatch):
+    async def scenario():
+        store = _SlowStore(delay_s=0)
+        monkeypatch.setattr(click_analytics, "get_wa_store", lambda: store)
+        pipeline = ButtonClickPipeline(flush_interval_s=60, batch_size=10)
+        await pipeline.close()
+        pipeline.record("conv", "contact", _click(0))
+        assert pipeline._task is None  # em shutdown não recria a task
+        await pipeline.close()
+        return store
+
+    store = asyncio.run(scenario())
+    assert [e["wa_message_id"] for e in store.clicks] == ["m0"]
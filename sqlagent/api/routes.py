@@ -1,21 +1,202 @@
+import asyncio
+import json
 import time
 import os
-from fastapi import APIRouter, Request, HTTPException
+from typing import Any, Callable, Dict
+from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from ..services.sqlgen import generate_sql
-from ..services.presets import list_presets, run_preset
+from ..services.sqlgen import generate_sql, provider_stats
+from ..services.presets import list_presets, bind_preset, build_preset_sql, by_period
+from ..services.result_formats import (
+    encode_stream,
+    stream_format,
+    stream_media_type,
+    result_format,
+    arrow_available,
+    columnar_body,
+    arrow_body,
+    RESULT_COLUMNAR,
+    RESULT_ARROW,
+    COLUMNAR_MEDIA_TYPE,
+    ARROW_MEDIA_TYPE,
+)
 from ..services.intent import interpret, interpret_chat
-from ..services.validators import validate_sql
-from ..infra.db import list_schemas, execute_sql
-from ..services.providers.openai import OpenAIProvider
+from ..services.hedge import hedge_stats
+from ..services.validators import validate_sql, check_sql, validator_stats
+from ..services.optimizer import optimize_for_execution
+from ..services.rollup import refresh_rollup, rollup_stats
+from ..services.cost_guard import Admission, CostQueueTimeout, CostRejected, admit, cost_guard_stats
+from ..services.result_cache import cached_result, execute_cached, get_result_cache, ttl_for
+from ..infra.db import stream_sql, pool_stats, QueryTimeout
+from ..infra.schema_catalog import get_catalog, catalog_stats
+from ..infra.llm_cache import get_llm_cache
+from ..services.providers import get_provider, model_label, registry_stats
+from ..services.providers.router import get_router
 
 router = APIRouter()
 
+# Intervalo de verificação de desconexão do cliente durante queries longas
+_DISCONNECT_POLL_S = float(os.getenv("SQLAGENT_DISCONNECT_POLL_S", "0.5") or 0.5)
+
+
+async def _run_unless_disconnected(request: Request, coro):
+    """
+    Executa `coro` (query no banco) e a cancela se o cliente HTTP desconectar.
+    O cancelamento da task dispara o cancel da query no servidor (ver infra.db).
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+                raise HTTPException(status_code=499, detail="client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def _result_format(request: Request, fmt: str | None) -> str:
+    out = result_format(fmt, request.headers.get("accept"))
+    if out == RESULT_ARROW and not arrow_available():
+        raise HTTPException(status_code=406, detail="Formato Arrow indisponível (pyarrow não instalado)")
+    return out
+
+
+def _render(payload: dict, out_fmt: str, headers: dict | None = None):
+    """Serializa o resultado no formato pedido (rows = JSON padrão do FastAPI)."""
+    if out_fmt == RESULT_COLUMNAR:
+        return Response(content=columnar_body(payload), media_type=COLUMNAR_MEDIA_TYPE, headers=headers)
+    if out_fmt == RESULT_ARROW:
+        return Response(content=arrow_body(payload), media_type=ARROW_MEDIA_TYPE, headers=headers)
+    return JSONResponse(content=jsonable_encoder(payload), headers=headers)
+
+
+def _cache_bypass(request: Request) -> bool:
+    """`Cache-Control: no-cache` força nova consulta (e atualiza a entrada do cache)."""
+    return "no-cache" in (request.headers.get("cache-control") or "").lower()
+
+
+async def _stream_result(
+    sql: str, fmt: str, account_id: str | None, endpoint: str,
+    timeout_ms: int | None = None, on_close: Callable[[], None] | None = None,
+    params: dict | None = None,
+) -> StreamingResponse:
+    """
+    Resposta em streaming (cursor server-side). O primeiro lote é buscado antes
+    de enviar o status HTTP, para que timeouts e erros de execução ainda virem 504/500.
+    `on_close` roda quando o stream termina ou falha (ex.: libera vaga do guard de custo),
+    inclusive se o corpo nunca for iterado: a limpeza também vai como BackgroundTask
+    da resposta, que o Starlette executa mesmo com o cliente desconectado.
+    """
+    batches = stream_sql(sql, account_id=account_id, endpoint=endpoint, timeout_ms=timeout_ms, params=params)
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException as e:
+        if on_close:
+            on_close()
+        if isinstance(e, QueryTimeout):
+            raise HTTPException(status_code=504, detail={"message": str(e), "fingerprint": e.fingerprint, "sql": sql})
+        if isinstance(e, Exception):
+            raise HTTPException(status_code=500, detail=f"Erro ao executar SQL: {e}")
+        raise
+
+    async def _cleanup():
+        # idempotente: roda no fim da iteração e de novo como BackgroundTask
+        await batches.aclose()
+        if on_close:
+            on_close()
+
+    async def _chained():
+        try:
+            if first is not None:
+                yield first
+                async for b in batches:
+                    yield b
+        finally:
+            await _cleanup()
+
+    return StreamingResponse(
+        encode_stream(_chained(), fmt, executed_sql=sql),
+        media_type=stream_media_type(fmt),
+        background=BackgroundTask(_cleanup),
+    )
+
+
+async def _admit_or_raise(sql: str, account_id: str | None, plan: Dict[str, Any] | None = None) -> Admission:
+    """Guard de custo: recusa vira 422 e fila esgotada vira 503 com Retry-After, ambos com o resumo do plano."""
+    try:
+        return await admit(sql, account_id, plan=plan)
+    except CostRejected as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "plan": e.summary, "sql": sql})
+    except CostQueueTimeout as e:
+        retry_after = os.getenv("SQLAGENT_COST_RETRY_AFTER_S", "5")
+        raise HTTPException(status_code=503, detail={"message": str(e), "plan": e.summary, "sql": sql}, headers={"Retry-After": retry_after})
+
+
+def _require_admin(request: Request) -> None:
+    """Endpoints administrativos: exigem `x-admin-token` igual a ADMIN_TOKEN (quando definido)."""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token and request.headers.get("x-admin-token") != admin_token:
+        raise HTTPException(status_code=403, detail="forbidden")
+
+
+async def _warm_catalog() -> None:
+    """Garante o catálogo de schema em memória para os prompts (falha não bloqueia)."""
+    try:
+        await get_catalog()
+    except Exception as e:
+        print(f"[WARN] SQLAgent: catálogo de schema indisponível: {repr(e)}")
+
 
 @router.get("/v1/sql/schemas")
-async def get_schemas(request: Request):
-    account_id = request.headers.get("x-account-id")
-    return {"schemas": list_schemas(account_id)}
+async def get_schemas(request: Request, refresh: bool = Query(False)):
+    """
+    Catálogo de tabelas/colunas permitidas, servido da memória (TTL + LISTEN/NOTIFY).
+    Responde 304 quando `If-None-Match` bate com o ETag (versão do catálogo).
+    """
+    cat = await get_catalog(force=refresh)
+    etag = f'"{cat.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=cat.to_json(), headers=headers)
+
+
+@router.get("/v1/sql/schemas/stats")
+async def get_schema_stats():
+    return catalog_stats()
+
+
+@router.get("/v1/sql/cache")
+async def get_cache_stats():
+    """Estatísticas do cache de resultados (hits, misses, evictions, bytes)."""
+    return get_result_cache().snapshot()
+
+
+@router.delete("/v1/sql/cache")
+async def delete_cache(request: Request, all_tenants: bool = Query(False)):
+    """Invalida o cache do tenant (`x-account-id`) ou de todos com `all_tenants=true`. Exige o token de admin."""
+    _require_admin(request)
+    account_id = None if all_tenants else request.headers.get("x-account-id")
+    return {"ok": True, "removed": get_result_cache().clear(account_id)}
+
+
+@router.get("/v1/sql/pool")
+async def get_pool_stats():
+    """Métricas do pool de conexões READONLY (espera, checkouts, conexões)."""
+    return pool_stats()
 
 
 class GenerateBody(BaseModel):
@@ -26,19 +207,88 @@ class GenerateBody(BaseModel):
 @router.post("/v1/sql/generate")
 async def post_generate(body: GenerateBody, request: Request):
     account_id = request.headers.get("x-account-id")
-    sql, rationale, model = generate_sql(question=body.question, account_id=account_id, hint_tables=body.hint_tables)
+    await _warm_catalog()
+    sql, rationale, model, rewrites = await generate_sql(question=body.question, account_id=account_id, hint_tables=body.hint_tables)
     ok, issues = validate_sql(sql)
-    return {"sql": sql, "valid": ok, "issues": issues, "rationale": rationale, "model": model}
+    return {"sql": sql, "valid": ok, "issues": issues, "rationale": rationale, "model": model, "rewrites": rewrites}
 
 
 class ValidateBody(BaseModel):
     sql: str
 
 
+@router.get("/v1/sql/generate/stats")
+async def get_generate_stats():
+    """Taxa de SQL inválido e erros por provider LLM."""
+    return provider_stats()
+
+
+@router.get("/v1/sql/hedge/stats")
+async def get_hedge_stats():
+    """Vitórias por provider nas corridas com hedge (SQL e intenção) e últimas decisões."""
+    return {**hedge_stats(), "registry": registry_stats()}
+
+
+@router.get("/v1/sql/providers/routing")
+async def get_provider_routing():
+    """Saúde por provider/modelo (EWMA de latência, erros, inválidos, cool-down) e últimas decisões."""
+    return get_router().snapshot()
+
+
+@router.delete("/v1/sql/providers/routing")
+async def reset_provider_routing(request: Request):
+    """Zera a saúde acumulada por provider/modelo. Exige o token de admin."""
+    _require_admin(request)
+    get_router().reset()
+    return {"ok": True}
+
+
+@router.get("/v1/sql/llm-cache")
+async def get_llm_cache_stats():
+    cache = get_llm_cache()
+    return cache.snapshot() if cache else {"enabled": False}
+
+
+@router.delete("/v1/sql/llm-cache")
+async def delete_llm_cache(request: Request):
+    """Apaga o cache local de respostas do LLM. Exige o token de admin."""
+    _require_admin(request)
+    cache = get_llm_cache()
+    return {"ok": True, "removed": cache.clear() if cache else 0}
+
+
 @router.post("/v1/sql/validate")
 async def post_validate(body: ValidateBody):
-    ok, issues = validate_sql(body.sql)
-    return {"valid": ok, "issues": issues}
+    result = check_sql(body.sql)
+    return {"valid": result.ok, "issues": result.issues, "tables": result.tables, "limit": result.limit}
+
+
+@router.get("/v1/sql/validate/stats")
+async def get_validate_stats():
+    """Acertos do cache de validação (AST por hash do SQL)."""
+    return validator_stats()
+
+
+@router.get("/v1/sql/rollup")
+async def get_rollup():
+    """Estado do rollup diário dos presets (refreshes, último resultado, leituras via rollup x ledger)."""
+    return rollup_stats()
+
+
+@router.post("/v1/sql/rollup/refresh")
+async def post_rollup_refresh(request: Request, full: bool = Query(False, description="refaz o histórico inteiro")):
+    """Refresh incremental imediato do rollup (o job periódico faz o mesmo). Exige o token de admin."""
+    _require_admin(request)
+    try:
+        return await refresh_rollup(full=full)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao atualizar rollup: {e}")
+
+
+@router.get("/v1/sql/cost/stats")
+async def get_cost_stats():
+    """Decisões do guard de custo (admitidas, recusadas, rebaixadas, enfileiradas) e limites padrão."""
+    return cost_guard_stats()
 
 
 class AskBody(BaseModel):
@@ -50,7 +300,8 @@ class AskBody(BaseModel):
 
 @router.post("/qa/interpret")
 async def post_interpret(body: AskBody):
-    data, model = interpret(body.question)
+    await _warm_catalog()
+    data, model = await interpret(body.question)
     return {"ok": True, "model": model, "interpretation": data}
 
 
@@ -65,8 +316,9 @@ class InterpretChatBody(BaseModel):
 
 @router.post("/qa/interpret_chat")
 async def post_interpret_chat(body: InterpretChatBody):
+    await _warm_catalog()
     hist = [m.model_dump() for m in body.history]
-    data, model = interpret_chat(hist)
+    data, model = await interpret_chat(hist)
     return {"ok": True, "model": model, "interpretation": data}
 
 
@@ -74,20 +326,92 @@ class ChatEchoBody(BaseModel):
     history: list[ChatMsg]
 
 
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+async def _chat_echo_stream(hist: list[dict], req_id: str):
+    """
+    Resposta do /chat/echo em Server-Sent Events: `start`, um `token` por pedaço
+    recebido da OpenAI e `done` com TTFT/tempo total (ou `error`).
+
+    O primeiro pedaço é buscado antes de responder, para que falhas ao abrir o
+    stream continuem saindo como o JSON `{"ok": false}` do /chat/echo. Se o
+    cliente desconectar, o Starlette cancela o gerador e o stream upstream é fechado.
+    """
+    t0 = time.perf_counter()
+    model = model_label("openai")
+    try:
+        chunks = get_provider("openai").stream_text(hist)
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        return JSONResponse({"ok": False, "request_id": req_id, "detail": f"openai_err: {e}"})
+    ttft_ms = int((time.perf_counter() - t0) * 1000)
+
+    async def _events():
+        n_chunks = 0
+        n_chars = 0
+        try:
+            yield _sse("start", {"request_id": req_id, "model": model})
+            if first is not None:
+                yield _sse("token", {"delta": first, "ttft_ms": ttft_ms})
+                n_chunks, n_chars = 1, len(first)
+                async for delta in chunks:
+                    n_chunks += 1
+                    n_chars += len(delta)
+                    yield _sse("token", {"delta": delta})
+            yield _sse("done", {
+                "ok": True,
+                "request_id": req_id,
+                "model": model,
+                "ttft_ms": ttft_ms,
+                "total_ms": int((time.perf_counter() - t0) * 1000),
+                "chunks": n_chunks,
+                "chars": n_chars,
+            })
+        except asyncio.CancelledError:
+            print(f"[DEBUG] chat/echo/stream {req_id}: cliente desconectou após {n_chunks} pedaços")
+            raise
+        except Exception as e:
+            yield _sse("error", {"ok": False, "request_id": req_id, "detail": f"openai_err: {e}", "chunks": n_chunks})
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Request-Id": req_id},
+    )
+
+
+@router.post("/chat/echo/stream")
+async def post_chat_echo_stream(body: ChatEchoBody):
+    """Variante em streaming (SSE) do /chat/echo."""
+    import uuid
+    return await _chat_echo_stream([m.model_dump() for m in body.history], str(uuid.uuid4()))
+
+
 @router.post("/chat/echo")
-async def post_chat_echo(body: ChatEchoBody):
-    """Minimal chat endpoint: returns a text reply using OpenAI only, with request_id."""
+async def post_chat_echo(body: ChatEchoBody, request: Request):
+    """Minimal chat endpoint: returns a text reply using OpenAI only, with request_id.
+
+    Com `Accept: text/event-stream` responde em SSE (igual a /chat/echo/stream).
+    """
     hist = [m.model_dump() for m in body.history]
 
     # request id for tracing
     import uuid
     req_id = str(uuid.uuid4())
+    if "text/event-stream" in (request.headers.get("accept") or "").lower():
+        return await _chat_echo_stream(hist, req_id)
     try:
-        reply = OpenAIProvider().generate_text(hist)
+        reply = await get_provider("openai").generate_text(hist)
         return {
             "ok": True,
             "request_id": req_id,
-            "model": os.getenv("OPENAI_MODEL", "openai"),
+            "model": model_label("openai"),
             "reply": reply,
         }
     except Exception as e:
@@ -99,62 +423,140 @@ async def post_chat_echo(body: ChatEchoBody):
 
 
 @router.post("/qa/ask")
-async def post_ask(body: AskBody, request: Request):
+async def post_ask(
+    body: AskBody,
+    request: Request,
+    stream: str | None = Query(None, description="ndjson|json: resultado em streaming"),
+    format: str | None = Query(None, description="rows (padrão) | columnar | arrow"),
+):
     """Recebe pergunta NL, gera SQL (Gemini/Llama), valida, executa e retorna dados.
+
+    Com `?stream=ndjson|json` (ou `Accept: application/x-ndjson`) o resultado é
+    transmitido a partir de um cursor server-side, com limites de linhas/bytes.
+    Com `?format=columnar|arrow` (ou Accept correspondente) a resposta sai em
+    JSON column-major ou Arrow IPC.
     """
     t0 = time.time()
     account_id = request.headers.get("x-account-id")
+    fmt = stream_format(stream, request.headers.get("accept"))
+    out_fmt = _result_format(request, format)
+
+    await _warm_catalog()
 
     # 1) Interpretar pergunta para extrair parâmetros
-    interp, interp_model = interpret(body.question)
+    interp, interp_model = await interpret(body.question)
 
     # 2) Se houver preset_candidate e last_n, tentar executar preset determinístico
     preset = (interp.get("preset_candidate") or "").strip() or None
-    if preset and preset in {"totais_ultimos_dias", "diario_ultimos_dias", "status_ultimos_dias"}:
+    if preset and preset in {"totais_ultimos_dias", "diario_ultimos_dias", "status_ultimos_dias", "totais_por_periodo"}:
         params = {}
-        if interp.get("last_n") and (interp.get("last_unit") in (None, "days")):
+        if preset == "totais_por_periodo":
+            params["periods"] = interp.get("suggested_periods") or [7, 14, 30, 90]
+        elif interp.get("last_n") and (interp.get("last_unit") in (None, "days")):
             params["days"] = int(interp["last_n"]) if str(interp["last_n"]).isdigit() else 7
+        elif preset == "totais_ultimos_dias" and not interp.get("last_n") and interp.get("suggested_periods"):
+            # sem período definido: compara os períodos sugeridos numa só query
+            preset, params = "totais_por_periodo", {"periods": interp["suggested_periods"]}
         # Executa preset se conseguiu montar params
         if params:
+            if fmt:
+                try:
+                    psql, pvalues = bind_preset(preset, params, account_id)
+                except Exception:
+                    psql = None  # se preset falhar, cai para o fluxo LLM->SQL
+                if psql:
+                    return await _stream_result(psql, fmt, account_id, "qa.ask", params=pvalues)
             try:
                 t0 = time.time()
-                cols, rows, psql = run_preset(preset, params)
+                psql, pvalues = bind_preset(preset, params, account_id)
+                cols, rows, cache_headers = await _run_unless_disconnected(request, execute_cached(
+                    psql, account_id=account_id, endpoint="qa.ask", ttl_s=ttl_for(preset), bypass=_cache_bypass(request),
+                    params=pvalues, prepare=True,
+                ))
                 timing_ms = int((time.time() - t0) * 1000)
-                return {
+                payload = {
                     "ok": True,
                     "model": interp_model,
                     "executed_sql": psql,
+                    "params": pvalues,
                     "columns": cols,
                     "rows": rows,
                     "interpretation": interp,
                     "timing_ms": timing_ms,
                 }
+                if preset == "totais_por_periodo":
+                    payload["by_period"] = by_period(cols, rows)
+                return _render(payload, out_fmt, cache_headers)
+            except HTTPException:
+                raise
             except Exception:
                 pass  # se preset falhar, cai para o fluxo LLM->SQL
 
     # 3) Caso contrário, gera SQL via LLM (fluxo anterior)
-    sql, rationale, model = generate_sql(question=body.question, account_id=account_id)
+    sql, rationale, model, rewrites = await generate_sql(question=body.question, account_id=account_id)
     ok, issues = validate_sql(sql)
     if not ok:
         raise HTTPException(status_code=400, detail={"message": "Query inválida", "issues": issues, "sql": sql})
+    # Cache primeiro (chave = SQL validado): num HIT não há otimizador nem EXPLAIN
+    bypass = _cache_bypass(request)
+    if not fmt:
+        hit = cached_result(sql, account_id=account_id, bypass=bypass)
+        if hit is not None:
+            cols, rows, cache_headers = hit
+            return _render({
+                "ok": True,
+                "model": model,
+                "executed_sql": sql,
+                "columns": cols,
+                "rows": rows,
+                "explanation": rationale,
+                "rewrites": rewrites,
+                "optimization": None,
+                "cost_guard": None,
+                "interpretation": interp,
+                "timing_ms": int((time.time() - t0) * 1000),
+            }, out_fmt, cache_headers)
+    key_sql = sql
+    # Passe de otimização (sargabilidade em fact_date etc.) com diferença de custo do EXPLAIN
+    sql, optimization, plan = await optimize_for_execution(sql)
+    # Guard de custo: EXPLAIN (reaproveita o plano do otimizador) vs limites do tenant -> admite, recusa, rebaixa ou enfileira
+    admission = await _admit_or_raise(sql, account_id, plan)
+    sql = admission.sql
+
+    if fmt:
+        return await _stream_result(sql, fmt, account_id, "qa.ask", timeout_ms=admission.timeout_ms, on_close=admission.release)
 
     # Execução
     try:
-        cols, rows = execute_sql(sql)
+        # resultado rebaixado (LIMIT menor) não pode ocupar a chave do SQL original
+        downgraded = "downgrade" in (admission.summary or {})
+        cols, rows, cache_headers = await _run_unless_disconnected(request, execute_cached(
+            sql, account_id=account_id, endpoint="qa.ask", bypass=bypass, timeout_ms=admission.timeout_ms,
+            key_sql=None if downgraded else key_sql, lookup=downgraded,
+        ))
+    except HTTPException:
+        raise
+    except QueryTimeout as e:
+        raise HTTPException(status_code=504, detail={"message": str(e), "fingerprint": e.fingerprint, "sql": sql})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao executar SQL: {e}")
+    finally:
+        admission.release()
 
     timing_ms = int((time.time() - t0) * 1000)
-    return {
+    return _render({
         "ok": True,
         "model": model,
         "executed_sql": sql,
         "columns": cols,
         "rows": rows,
         "explanation": rationale,
+        "rewrites": rewrites,
+        "optimization": optimization,
+        "cost_guard": admission.summary,
         "interpretation": interp,
         "timing_ms": timing_ms,
-    }
+    }, out_fmt, cache_headers)
 
 
 class PresetExecBody(BaseModel):
@@ -168,31 +570,53 @@ async def get_presets():
 
 
 @router.post("/qa/presets/build")
-async def post_build_preset(body: PresetExecBody):
+async def post_build_preset(body: PresetExecBody, request: Request):
     """Somente constroi o SQL do preset sem executar (debug/inspecao)."""
     from ..services.presets import PRESETS  # lazy import for introspection
     if body.preset_id not in PRESETS:
         raise HTTPException(status_code=404, detail="Preset inexistente")
     params = body.params or {}
     try:
-        sql = PRESETS[body.preset_id]["sql"](params)
-        return {"ok": True, "sql": sql}
+        account_id = request.headers.get("x-account-id")
+        template, values = bind_preset(body.preset_id, params, account_id)
+        return {"ok": True, "sql": build_preset_sql(body.preset_id, params, account_id), "template": template, "params": values}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/qa/presets/run")
-async def post_run_preset(body: PresetExecBody):
+async def post_run_preset(
+    body: PresetExecBody,
+    request: Request,
+    stream: str | None = Query(None, description="ndjson|json: resultado em streaming"),
+    format: str | None = Query(None, description="rows (padrão) | columnar | arrow"),
+):
+    out_fmt = _result_format(request, format)
     try:
-        cols, rows, sql = run_preset(body.preset_id, body.params or {})
-        return {"ok": True, "columns": cols, "rows": rows, "executed_sql": sql}
+        account_id = request.headers.get("x-account-id")
+        fmt = stream_format(stream, request.headers.get("accept"))
+        sql, values = bind_preset(body.preset_id, body.params or {}, account_id)
+        if fmt:
+            return await _stream_result(sql, fmt, account_id, "qa.presets", params=values)
+        cols, rows, cache_headers = await _run_unless_disconnected(request, execute_cached(
+            sql, account_id=account_id, endpoint="qa.presets", ttl_s=ttl_for(body.preset_id), bypass=_cache_bypass(request),
+            params=values, prepare=True,
+        ))
+        payload = {"ok": True, "columns": cols, "rows": rows, "executed_sql": sql, "params": values}
+        if body.preset_id == "totais_por_periodo":
+            payload["by_period"] = by_period(cols, rows)
+        return _render(payload, out_fmt, cache_headers)
+    except HTTPException:
+        raise
+    except QueryTimeout as e:
+        raise HTTPException(status_code=504, detail={"message": str(e), "fingerprint": e.fingerprint})
     except Exception as e:
         # inclui o SQL gerado (se conseguir gerar) para facilitar o debug do cliente
         from ..services.presets import PRESETS  # local import
         sql_dbg = None
         try:
             if body.preset_id in PRESETS:
-                sql_dbg = PRESETS[body.preset_id]["sql"](body.params or {})
+                sql_dbg = build_preset_sql(body.preset_id, body.params or {}, request.headers.get("x-account-id"))
         except Exception:
             pass
         raise HTTPException(status_code=400, detail={"message": str(e), "sql": sql_dbg})
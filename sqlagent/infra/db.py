@@ -1,64 +1,341 @@
+import asyncio
+import hashlib
+import json
 import os
-from typing import List, Dict, Tuple, Any
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Tuple, Any, AsyncIterator, Sequence
+import uuid
 import psycopg
-from psycopg.rows import dict_row
+from psycopg import errors as pg_errors
+from psycopg.conninfo import conninfo_to_dict
+from psycopg_pool import AsyncConnectionPool
 
-_CONN = None
+_POOL: AsyncConnectionPool | None = None
+_POOL_LOCK = asyncio.Lock()
 
+# Métricas de checkout (espera pela conexão e tempo em uso)
+_METRICS_LOCK = threading.Lock()
+_METRICS: Dict[str, float] = {
+    "checkouts": 0,
+    "checkout_errors": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+    "hold_ms_total": 0.0,
+    "hold_ms_max": 0.0,
+    "reconnect_failures": 0,
+}
 
-def _get_conn():
-    global _CONN
-    if _CONN is None or _CONN.closed:
-        dsn = os.getenv("READONLY_DB_URL")
-        if not dsn:
-            raise RuntimeError("READONLY_DB_URL não definido para o SQL Agent.")
-        _CONN = psycopg.connect(dsn, autocommit=True)
-    return _CONN
 
+def _on_reconnect_failed(pool: AsyncConnectionPool) -> None:
+    with _METRICS_LOCK:
+        _METRICS["reconnect_failures"] += 1
+    print(f"[ERROR] SQLAgent pool: falha ao reconectar após {pool.reconnect_timeout}s; tentando novamente na próxima requisição.")
 
-def list_schemas(account_id: str | None) -> List[Dict[str, str]]:
+
+def _behind_pooler(dsn: str) -> bool:
+    """DSN aponta para um pooler em transaction mode (porta 6543 ou host com pooler/pgbouncer)?"""
+    try:
+        info = conninfo_to_dict(dsn)
+    except Exception:
+        return False
+    host = str(info.get("host") or "").lower()
+    return str(info.get("port") or "") == "6543" or "pooler" in host or "pgbouncer" in host
+
+
+def prepare_enabled() -> bool:
+    """
+    Prepared statements no servidor (SQLAGENT_PREPARE=1|0). Sem a variável, ficam
+    desligados quando READONLY_DB_URL passa por um pooler: em PgBouncer/Supavisor
+    no modo transaction cada transação pode cair em outro backend, onde o
+    statement preparado não existe.
+    """
+    raw = os.getenv("SQLAGENT_PREPARE")
+    if raw is not None and raw.strip():
+        return raw.strip() in ("1", "true", "True")
+    return not _behind_pooler(os.getenv("READONLY_DB_URL") or "")
+
+
+async def _get_pool() -> AsyncConnectionPool:
+    """
+    Pool assíncrono de conexões READONLY compartilhado pelo processo.
+
+    Configuração (env):
+    - SQLAGENT_POOL_MIN / SQLAGENT_POOL_MAX: tamanho do pool (padrão 1 / 10)
+    - SQLAGENT_POOL_TIMEOUT_S: espera máxima por uma conexão livre (padrão 10)
+    - SQLAGENT_POOL_MAX_IDLE_S: fecha conexões ociosas acima do mínimo (padrão 300)
+    - SQLAGENT_POOL_RECONNECT_TIMEOUT_S: janela de reconexão com backoff exponencial (padrão 60)
+
+    Conexões são verificadas (`check_connection`) antes de cada checkout; conexões
+    quebradas são descartadas e repostas pelo pool, sem derrubar as demais requisições.
+    Sem prepared statements (`prepare_enabled()`), o preparo automático do psycopg também é desligado.
     """
-    Retorna lista de tabelas e colunas disponíveis (públicas) para ajudar o LLM/cliente.
-    Em produção, restrinja por views específicas da conta ou policies RLS.
+    global _POOL
+    if _POOL is None:
+        async with _POOL_LOCK:
+            if _POOL is None:
+                dsn = os.getenv("READONLY_DB_URL")
+                if not dsn:
+                    raise RuntimeError("READONLY_DB_URL não definido para o SQL Agent.")
+                pool = AsyncConnectionPool(
+                    dsn,
+                    min_size=int(os.getenv("SQLAGENT_POOL_MIN", "1") or 1),
+                    max_size=int(os.getenv("SQLAGENT_POOL_MAX", "10") or 10),
+                    timeout=float(os.getenv("SQLAGENT_POOL_TIMEOUT_S", "10") or 10),
+                    max_idle=float(os.getenv("SQLAGENT_POOL_MAX_IDLE_S", "300") or 300),
+                    reconnect_timeout=float(os.getenv("SQLAGENT_POOL_RECONNECT_TIMEOUT_S", "60") or 60),
+                    reconnect_failed=_on_reconnect_failed,
+                    check=AsyncConnectionPool.check_connection,
+                    kwargs={"autocommit": True} if prepare_enabled() else {"autocommit": True, "prepare_threshold": None},
+                    name="sqlagent",
+                    open=False,
+                )
+                await pool.open()
+                _POOL = pool
+    return _POOL
+
+
+@asynccontextmanager
+async def _connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """Checkout de uma conexão do pool, registrando tempo de espera e de uso."""
+    pool = await _get_pool()
+    t0 = time.perf_counter()
+    acquired: float | None = None
+    try:
+        async with pool.connection() as conn:
+            acquired = time.perf_counter()
+            yield conn
+    except Exception:
+        if acquired is None:
+            with _METRICS_LOCK:
+                _METRICS["checkout_errors"] += 1
+        raise
+    finally:
+        if acquired is not None:
+            wait_ms = (acquired - t0) * 1000.0
+            hold_ms = (time.perf_counter() - acquired) * 1000.0
+            with _METRICS_LOCK:
+                _METRICS["checkouts"] += 1
+                _METRICS["wait_ms_total"] += wait_ms
+                _METRICS["wait_ms_max"] = max(_METRICS["wait_ms_max"], wait_ms)
+                _METRICS["hold_ms_total"] += hold_ms
+                _METRICS["hold_ms_max"] = max(_METRICS["hold_ms_max"], hold_ms)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Métricas do pool (psycopg_pool) e de checkout, para diagnóstico."""
+    with _METRICS_LOCK:
+        m = dict(_METRICS)
+    n = m["checkouts"] or 0
+    out: Dict[str, Any] = {
+        "checkouts": int(n),
+        "checkout_errors": int(m["checkout_errors"]),
+        "reconnect_failures": int(m["reconnect_failures"]),
+        "wait_ms_avg": round(m["wait_ms_total"] / n, 2) if n else None,
+        "wait_ms_max": round(m["wait_ms_max"], 2),
+        "hold_ms_avg": round(m["hold_ms_total"] / n, 2) if n else None,
+        "hold_ms_max": round(m["hold_ms_max"], 2),
+    }
+    if _POOL is not None:
+        out["pool"] = _POOL.get_stats()
+    return out
+
+
+async def close_pool() -> None:
+    global _POOL
+    async with _POOL_LOCK:
+        if _POOL is not None:
+            await _POOL.close()
+            _POOL = None
+
+
+async def _cancel_on_server(conn: psycopg.AsyncConnection) -> None:
+    """Envia o cancel ao backend quando a task que aguarda a query é cancelada."""
+    try:
+        await conn.cancel_safe(timeout=5.0)
+        print("[WARN] SQLAgent: query cancelada no servidor (task cancelada/cliente desconectou).")
+    except Exception as e:
+        print(f"[WARN] SQLAgent: falha ao cancelar query no servidor: {repr(e)}")
+
+
+class QueryTimeout(RuntimeError):
+    """Query cancelada por exceder o statement_timeout configurado."""
+
+    def __init__(self, timeout_ms: int, fingerprint: str):
+        super().__init__(f"Query excedeu o tempo limite de {timeout_ms} ms (fingerprint {fingerprint})")
+        self.timeout_ms = timeout_ms
+        self.fingerprint = fingerprint
+
+
+_FP_STRING = re.compile(r"'(?:[^']|'')*'")
+_FP_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_FP_SPACES = re.compile(r"\s+")
+
+
+def sql_fingerprint(sql: str) -> str:
+    """Hash curto do SQL com literais removidos: agrupa variações da mesma query."""
+    norm = _FP_STRING.sub("?", sql or "")
+    norm = _FP_NUMBER.sub("?", norm)
+    norm = _FP_SPACES.sub(" ", norm).strip().rstrip(";").lower()
+    return hashlib.sha1(norm.encode()).hexdigest()[:12]
+
+
+def _timeout_overrides(env_name: str) -> Dict[str, int]:
+    raw = os.getenv(env_name) or ""
+    if not raw.strip():
+        return {}
+    try:
+        return {str(k): int(v) for k, v in json.loads(raw).items()}
+    except Exception as e:
+        print(f"[WARN] {env_name} inválido (esperado JSON {{chave: ms}}): {repr(e)}")
+        return {}
+
+
+def resolve_timeout_ms(account_id: str | None = None, endpoint: str | None = None) -> int:
     """
-    conn = _get_conn()
-    q = """
-    select table_schema, table_name, column_name, data_type
-    from information_schema.columns
-    where table_schema not in ('pg_catalog','information_schema')
-    order by table_schema, table_name, ordinal_position
-    limit 2000
+    statement_timeout efetivo (ms): override do tenant > override do endpoint > padrão.
+
+    - SQLAGENT_TIMEOUT_MS: padrão (15000)
+    - SQLAGENT_TIMEOUT_MS_BY_ENDPOINT: JSON, ex. {"qa.ask": 10000, "qa.presets": 30000}
+    - SQLAGENT_TIMEOUT_MS_BY_TENANT: JSON, ex. {"<account_id>": 60000}
     """
-    with conn.cursor() as cur:
-        cur.execute(q)
-        rows = cur.fetchall()
-    result = [
-        {
-            "schema": r[0],
-            "table": r[1],
-            "column": r[2],
-            "type": r[3],
-        }
-        for r in rows
-    ]
-    return result
-
-
-def execute_sql(sql: str) -> Tuple[List[str], List[List[Any]]]:
+    by_tenant = _timeout_overrides("SQLAGENT_TIMEOUT_MS_BY_TENANT")
+    if account_id and account_id in by_tenant:
+        return by_tenant[account_id]
+    by_endpoint = _timeout_overrides("SQLAGENT_TIMEOUT_MS_BY_ENDPOINT")
+    if endpoint and endpoint in by_endpoint:
+        return by_endpoint[endpoint]
+    return int(os.getenv("SQLAGENT_TIMEOUT_MS", "15000") or 15000)
+
+
+async def execute_sql(
+    sql: str,
+    *,
+    account_id: str | None = None,
+    endpoint: str | None = None,
+    timeout_ms: int | None = None,
+    params: Dict[str, Any] | None = None,
+    prepare: bool | None = None,
+) -> Tuple[List[str], List[List[Any]]]:
     """
     Executa a query SQL (somente SELECT) usando a conexão READONLY com timeout.
     Retorna (columns, rows) no formato amigável para JSON.
+
+    O statement_timeout é aplicado com `set_config(..., true)` dentro da transação
+    da própria query (vale só para ela e não vaza para a conexão do pool). Se o
+    servidor não responder até o prazo + margem, a query é cancelada pelo cliente.
+    Timeouts geram `QueryTimeout` e são logados com o fingerprint do SQL.
+
+    Se a task for cancelada (ex.: cliente HTTP desconectou), a query é cancelada
+    também no servidor; a conexão é descartada pelo pool ao ser devolvida.
+
+    `timeout_ms` sobrepõe o timeout resolvido (ex.: query rebaixada pelo guard de custo).
+    `params` são enviados como bind (`%(nome)s`); com `prepare=True` a query vira
+    prepared statement na conexão do pool e o plano é reaproveitado nas próximas execuções
+    (ignorado quando `prepare_enabled()` é falso).
+    """
+    timeout_ms = timeout_ms or resolve_timeout_ms(account_id, endpoint)
+    grace_s = float(os.getenv("SQLAGENT_TIMEOUT_GRACE_S", "2") or 2)
+
+    async def _run() -> Tuple[List[str], List[List[Any]]]:
+        async with _connection() as conn:
+            try:
+                async with conn.transaction():
+                    async with conn.cursor() as cur:
+                        await cur.execute("select set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+                        await cur.execute(sql, params, prepare=prepare if prepare_enabled() else False)
+                        columns = [d.name for d in (cur.description or [])]
+                        return columns, [list(r) for r in await cur.fetchall()]
+            except asyncio.CancelledError:
+                await _cancel_on_server(conn)
+                raise
+
+    t0 = time.perf_counter()
+    try:
+        columns, rows = await asyncio.wait_for(_run(), timeout=timeout_ms / 1000.0 + grace_s)
+    except (pg_errors.QueryCanceled, asyncio.TimeoutError):
+        raise _timeout_error(sql, timeout_ms, t0, account_id, endpoint)
+    if not rows:
+        return [], []
+    return columns, rows
+
+
+def _timeout_error(sql: str, timeout_ms: int, t0: float, account_id: str | None, endpoint: str | None) -> QueryTimeout:
+    fp = sql_fingerprint(sql)
+    elapsed_ms = int((time.perf_counter() - t0) * 1000)
+    print(
+        f"[WARN] SQLAgent: query cancelada por timeout fingerprint={fp} timeout_ms={timeout_ms} "
+        f"elapsed_ms={elapsed_ms} account_id={account_id} endpoint={endpoint} sql={sql[:500]!r}"
+    )
+    return QueryTimeout(timeout_ms, fp)
+
+
+async def stream_sql(
+    sql: str,
+    *,
+    account_id: str | None = None,
+    endpoint: str | None = None,
+    chunk_rows: int | None = None,
+    timeout_ms: int | None = None,
+    params: Dict[str, Any] | None = None,
+) -> AsyncIterator[Tuple[List[str], Sequence[Sequence[Any]]]]:
+    """
+    Executa a query em um cursor nomeado (server-side) e produz lotes de linhas
+    `(columns, rows)` com até `chunk_rows` linhas cada, sem materializar o
+    resultado inteiro. A conexão fica reservada enquanto o consumidor itera.
+
+    O statement_timeout vale para cada FETCH. Fechar o iterador antes do fim
+    (limite atingido ou cliente desconectado) encerra o cursor e a transação.
+    """
+    timeout_ms = timeout_ms or resolve_timeout_ms(account_id, endpoint)
+    size = int(chunk_rows or os.getenv("SQLAGENT_STREAM_CHUNK_ROWS", "1000") or 1000)
+    # DECLARE ... CURSOR FOR <query> não aceita ';' no final
+    query = sql.strip().rstrip(";").strip()
+    t0 = time.perf_counter()
+    async with _connection() as conn:
+        try:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute("select set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+                async with conn.cursor(name=f"sqlagent_{uuid.uuid4().hex[:12]}") as cur:
+                    await cur.execute(query, params)
+                    columns = [d.name for d in (cur.description or [])]
+                    first = True
+                    while True:
+                        batch = await cur.fetchmany(size)
+                        if batch or first:
+                            # o primeiro lote sai mesmo vazio, para o consumidor conhecer as colunas
+                            yield columns, batch
+                        first = False
+                        if len(batch) < size:
+                            break
+        except pg_errors.QueryCanceled:
+            raise _timeout_error(sql, timeout_ms, t0, account_id, endpoint)
+        except asyncio.CancelledError:
+            await _cancel_on_server(conn)
+            raise
+
+
+async def explain_plan(sql: str) -> Dict[str, Any]:
+    """
+    Plano estimado (`EXPLAIN (FORMAT JSON)`, sem executar a query) do nó raiz:
+    dict com "Total Cost", "Plan Rows" etc. Usa SQLAGENT_EXPLAIN_TIMEOUT_MS (padrão 2000).
     """
-    timeout_ms = int(os.getenv("SQLAGENT_TIMEOUT_MS", "15000") or 15000)
-    conn = _get_conn()
-    # aplica statement_timeout por sessão
-    with conn.cursor() as cur:
-        cur.execute(f"SET LOCAL statement_timeout = {timeout_ms}")
-    with conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(sql)
-        records = cur.fetchall()
-        if not records:
-            return [], []
-        columns = list(records[0].keys())
-        rows = [[r.get(c) for c in columns] for r in records]
-        return columns, rows
+    timeout_ms = int(os.getenv("SQLAGENT_EXPLAIN_TIMEOUT_MS", "2000") or 2000)
+    query = sql.strip().rstrip(";").strip()
+    async with _connection() as conn:
+        try:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute("select set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+                    await cur.execute("EXPLAIN (FORMAT JSON) " + query)
+                    row = await cur.fetchone()
+        except asyncio.CancelledError:
+            await _cancel_on_server(conn)
+            raise
+    doc = row[0] if row else []
+    if isinstance(doc, str):
+        doc = json.loads(doc)
+    return doc[0]["Plan"] if doc else {}
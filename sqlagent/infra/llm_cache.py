@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_BR_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+_SPACES = re.compile(r"\s+")
+_DATE_SLOT = "__D{}__"
+
+
+def normalize_question(question: str) -> Tuple[str, List[str]]:
+    """
+    Forma normalizada da pergunta para a chave do cache: minúsculas, sem acentos,
+    espaços colapsados, sem pontuação final, e datas trocadas por marcadores
+    (`__D0__`, `__D1__`, ...). Retorna (texto normalizado, datas ISO na ordem).
+    """
+    text = unicodedata.normalize("NFKD", question or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    dates: List[str] = []
+
+    def _slot(iso: str) -> str:
+        if iso not in dates:
+            dates.append(iso)
+        return _DATE_SLOT.format(dates.index(iso))
+
+    text = _BR_DATE.sub(lambda m: _slot(f"{m.group(3)}-{int(m.group(2)):02d}-{int(m.group(1)):02d}"), text)
+    text = _ISO_DATE.sub(lambda m: _slot(m.group(0)), text)
+    text = _SPACES.sub(" ", text).strip().rstrip("?!.;: ")
+    return text, dates
+
+
+def templatize(text: str, dates: List[str]) -> str:
+    """Troca as datas da pergunta que aparecem na resposta pelos marcadores."""
+    for i, d in enumerate(dates):
+        text = text.replace(d, _DATE_SLOT.format(i))
+    return text
+
+
+def render(text: str, dates: List[str]) -> str:
+    for i, d in enumerate(dates):
+        text = text.replace(_DATE_SLOT.format(i), d)
+    return text
+
+
+class LLMCache:
+    """
+    Cache persistente (SQLite em disco local) de respostas de LLM já validadas:
+    SQL gerado (`kind='sql'`) e JSON de intenção (`kind='intent'`).
+
+    Chave: kind + assinatura de providers/modelos + versão do prompt + pergunta
+    normalizada (+ contexto extra, ex. hint_tables).
+    """
+
+    def __init__(self, path: str, ttl_s: float):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.execute(
+            "create table if not exists llm_cache ("
+            " key text primary key, kind text not null, question text not null,"
+            " value text not null, provider text, model text,"
+            " created_at real not null, hits integer not null default 0)"
+        )
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(kind: str, models: str, prompt_version: str, normalized: str, extra: str = "") -> str:
+        raw = "\x00".join([kind, models, prompt_version, normalized, extra])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str, dates: List[str]) -> Optional[Dict[str, Any]]:
+        """Retorna {"value", "provider", "model"} com as datas da pergunta atual, ou None."""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "select value, provider, model, created_at from llm_cache where key = ?", (key,)
+                ).fetchone()
+                if row is None or (self.ttl_s > 0 and time.time() - row[3] > self.ttl_s):
+                    self.stats["misses"] += 1
+                    return None
+                self._conn.execute("update llm_cache set hits = hits + 1 where key = ?", (key,))
+                self.stats["hits"] += 1
+            return {"value": render(row[0], dates), "provider": row[1], "model": row[2]}
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[WARN] SQLAgent: falha ao ler cache de LLM: {repr(e)}")
+            return None
+
+    def put(self, key: str, kind: str, normalized: str, value: str, dates: List[str], provider: str, model: str) -> None:
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "insert or replace into llm_cache (key, kind, question, value, provider, model, created_at, hits)"
+                    " values (?, ?, ?, ?, ?, ?, ?, 0)",
+                    (key, kind, normalized, templatize(value, dates), provider, model, time.time()),
+                )
+                self.stats["stores"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[WARN] SQLAgent: falha ao gravar cache de LLM: {repr(e)}")
+
+    def clear(self) -> int:
+        with self._lock:
+            return self._conn.execute("delete from llm_cache").rowcount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            by_kind = dict(self._conn.execute("select kind, count(*) from llm_cache group by kind").fetchall())
+        return {**self.stats, "path": self.path, "ttl_s": self.ttl_s, "entries": by_kind}
+
+
+@lru_cache()
+def get_llm_cache() -> Optional[LLMCache]:
+    """Cache do processo; None se desabilitado (SQLAGENT_LLM_CACHE=0) ou indisponível."""
+    if os.getenv("SQLAGENT_LLM_CACHE", "1") in ("0", "false", "False"):
+        return None
+    path = os.getenv("SQLAGENT_LLM_CACHE_PATH", os.path.join(".sqlagent_cache", "llm_cache.sqlite3"))
+    ttl = float(os.getenv("SQLAGENT_LLM_CACHE_TTL_S", str(7 * 24 * 3600)) or 0)
+    try:
+        return LLMCache(path, ttl)
+    except Exception as e:
+        print(f"[WARN] SQLAgent: cache de LLM desabilitado ({path}): {repr(e)}")
+        return None
+
+
+def models_signature(*pairs: Tuple[str, Optional[str]]) -> str:
+    """Assinatura `provider:modelo|...` dos providers habilitados (muda a chave ao trocar modelo)."""
+    return "|".join(f"{p}:{m or ''}" for p, m in pairs)
+
+
+def dumps_intent(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, sort_keys=True)
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg
+from psycopg import sql as pg_sql
+
+from .db import _connection
+
+# Canal usado pelo event trigger de DDL (ver sqlagent/sql/schema_change_notify.sql)
+SCHEMA_CHANNEL = os.getenv("SQLAGENT_SCHEMA_CHANNEL", "sqlagent_schema") or "sqlagent_schema"
+
+_COLUMNS_SQL = """
+select table_schema, table_name, column_name, data_type
+from information_schema.columns
+where table_schema not in ('pg_catalog','information_schema')
+  and (%(all)s or table_name = any(%(names)s) or (table_schema || '.' || table_name) = any(%(names)s))
+order by table_schema, table_name, ordinal_position
+limit 5000
+"""
+
+
+def _allowed_tables() -> List[str]:
+    env = os.getenv("SQLAGENT_ALLOWED_TABLES", "")
+    return [p.strip() for p in env.split(",") if p.strip()]
+
+
+class SchemaCatalog:
+    """
+    Catálogo de tabelas -> [(coluna, tipo)] já filtrado pela allowlist.
+
+    `version` é um hash do conteúdo (usado como ETag) e `digest` é a forma
+    compacta `tabela(col tipo, ...)` usada nos prompts.
+    """
+
+    def __init__(self, tables: Dict[str, List[Tuple[str, str]]]):
+        self.tables = tables
+        self.loaded_at = time.time()
+        # índice pelo nome sem schema, para buscas vindas de prompts/hints
+        self.by_name: Dict[str, str] = {}
+        for qualified in tables:
+            self.by_name.setdefault(qualified.split(".", 1)[-1], qualified)
+        raw = json.dumps(tables, sort_keys=True, separators=(",", ":"))
+        self.version = hashlib.sha1(raw.encode()).hexdigest()[:16]
+        self.digest = "\n".join(self.table_digest(t) for t in tables)
+
+    def columns(self, table: str) -> List[Tuple[str, str]]:
+        qualified = table if table in self.tables else self.by_name.get(table.split(".", 1)[-1], "")
+        return self.tables.get(qualified, [])
+
+    def table_digest(self, table: str, columns: Optional[List[Tuple[str, str]]] = None) -> str:
+        cols = columns if columns is not None else self.columns(table)
+        name = table.split(".", 1)[-1] if table.startswith("public.") else table
+        return f"{name}(" + ", ".join(f"{c} {t}" for c, t in cols) + ")"
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": int(self.loaded_at),
+            "tables": {t: {c: ty for c, ty in cols} for t, cols in self.tables.items()},
+        }
+
+
+_CATALOG: Optional[SchemaCatalog] = None
+_DIRTY = False
+_LOAD_LOCK = asyncio.Lock()
+_LISTENER: Optional[asyncio.Task] = None
+_STATS = {"loads": 0, "load_errors": 0, "notifications": 0}
+
+
+async def _load() -> SchemaCatalog:
+    names = _allowed_tables()
+    async with _connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_COLUMNS_SQL, {"all": not names, "names": names})
+            rows = await cur.fetchall()
+    tables: Dict[str, List[Tuple[str, str]]] = {}
+    for schema, table, column, dtype in rows:
+        tables.setdefault(f"{schema}.{table}", []).append((column, dtype))
+    return SchemaCatalog(tables)
+
+
+async def get_catalog(force: bool = False) -> SchemaCatalog:
+    """
+    Retorna o catálogo em memória, recarregando quando expirou
+    (SQLAGENT_SCHEMA_TTL_S, padrão 300), quando chegou um NOTIFY de DDL ou com `force`.
+    """
+    global _CATALOG, _DIRTY
+    _ensure_listener()
+    ttl = float(os.getenv("SQLAGENT_SCHEMA_TTL_S", "300") or 300)
+    cat = _CATALOG
+    if not force and cat is not None and not _DIRTY and time.time() - cat.loaded_at < ttl:
+        return cat
+    async with _LOAD_LOCK:
+        cat = _CATALOG
+        if not force and cat is not None and not _DIRTY and time.time() - cat.loaded_at < ttl:
+            return cat
+        _DIRTY = False
+        try:
+            _CATALOG = await _load()
+            _STATS["loads"] += 1
+        except Exception as e:
+            _STATS["load_errors"] += 1
+            if _CATALOG is None:
+                raise
+            # mantém o catálogo anterior se o banco estiver indisponível
+            print(f"[WARN] SQLAgent: falha ao recarregar catálogo de schema: {repr(e)}")
+        return _CATALOG
+
+
+def cached_catalog() -> Optional[SchemaCatalog]:
+    """Catálogo já carregado (sem I/O), para os construtores de prompt síncronos."""
+    return _CATALOG
+
+
+def catalog_digest() -> str:
+    cat = _CATALOG
+    return cat.digest if cat is not None else ""
+
+
+def catalog_stats() -> Dict[str, Any]:
+    cat = _CATALOG
+    return {
+        **_STATS,
+        "version": cat.version if cat else None,
+        "tables": len(cat.tables) if cat else 0,
+        "age_s": int(time.time() - cat.loaded_at) if cat else None,
+        "listening": _LISTENER is not None and not _LISTENER.done(),
+    }
+
+
+def _ensure_listener() -> None:
+    global _LISTENER
+    if os.getenv("SQLAGENT_SCHEMA_LISTEN", "1") in ("0", "false", "False") or not os.getenv("READONLY_DB_URL"):
+        return
+    if _LISTENER is None or _LISTENER.done():
+        try:
+            _LISTENER = asyncio.get_running_loop().create_task(_listen())
+        except RuntimeError:
+            pass
+
+
+async def _listen() -> None:
+    """LISTEN no canal de DDL com reconexão (backoff exponencial até 60s)."""
+    global _DIRTY
+    dsn = os.getenv("READONLY_DB_URL")
+    if not dsn:
+        return
+    backoff = 1.0
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+                await conn.execute(pg_sql.SQL("LISTEN {}").format(pg_sql.Identifier(SCHEMA_CHANNEL)))
+                backoff = 1.0
+                async for _n in conn.notifies():
+                    _STATS["notifications"] += 1
+                    _DIRTY = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARN] SQLAgent: LISTEN {SCHEMA_CHANNEL} falhou: {repr(e)}; nova tentativa em {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+
+async def close_catalog() -> None:
+    global _LISTENER
+    if _LISTENER is not None and not _LISTENER.done():
+        _LISTENER.cancel()
+        try:
+            await _LISTENER
+        except (asyncio.CancelledError, Exception):
+            pass
+    _LISTENER = None
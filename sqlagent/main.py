@@ -2,6 +2,10 @@ import os
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.responses import JSONResponse
 from .api.routes import router as api_router
+from .infra.db import close_pool
+from .infra.schema_catalog import close_catalog
+from .services.providers import close_providers
+from .services.rollup import start_rollup_job, stop_rollup_job
 
 app = FastAPI(title="Dex SQL Agent", version="0.1.0")
 
@@ -11,6 +15,19 @@ async def health():
     return {"status": "ok"}
 
 
+@app.on_event("startup")
+async def _start_jobs():
+    start_rollup_job()
+
+
+@app.on_event("shutdown")
+async def _close_db_pool():
+    await stop_rollup_job()
+    await close_catalog()
+    await close_pool()
+    await close_providers()
+
+
 @app.middleware("http")
 async def auth_middleware(request: Request, call_next):
     # Only protect /v1/* endpoints
@@ -0,0 +1,205 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import os
+import threading
+import time
+
+from sqlglot import exp
+
+from ..infra.db import explain_plan
+from .validators import check_sql
+
+ACTION_ADMIT = "admit"
+ACTION_REJECT = "reject"
+ACTION_DOWNGRADE = "downgrade"
+ACTION_QUEUE = "queue"
+_ACTIONS = (ACTION_REJECT, ACTION_DOWNGRADE, ACTION_QUEUE)
+
+_HEAVY_SEM: Optional[asyncio.Semaphore] = None
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, int] = {"checked": 0, ACTION_ADMIT: 0, ACTION_REJECT: 0, ACTION_DOWNGRADE: 0, ACTION_QUEUE: 0, "queue_timeouts": 0, "explain_errors": 0}
+
+
+class CostRejected(RuntimeError):
+    """Query recusada pelo guard de custo (estimativa acima do limite do tenant)."""
+
+    def __init__(self, reason: str, summary: Dict[str, Any]):
+        super().__init__(reason)
+        self.summary = summary
+
+
+class CostQueueTimeout(RuntimeError):
+    """A fila de queries pesadas não liberou vaga a tempo."""
+
+    def __init__(self, waited_s: float, summary: Dict[str, Any]):
+        super().__init__(f"fila de queries pesadas cheia (aguardou {waited_s:.1f}s)")
+        self.summary = summary
+
+
+def _tenant_overrides() -> Dict[str, Dict[str, Any]]:
+    raw = os.getenv("SQLAGENT_COST_LIMITS_BY_TENANT") or ""
+    if not raw.strip():
+        return {}
+    try:
+        return {str(k): dict(v) for k, v in json.loads(raw).items()}
+    except Exception as e:
+        print(f"[WARN] SQLAGENT_COST_LIMITS_BY_TENANT inválido (esperado JSON {{tenant: {{max_cost, max_rows, action}}}}): {repr(e)}")
+        return {}
+
+
+def resolve_cost_limits(account_id: str | None = None) -> Dict[str, Any]:
+    """
+    Limites efetivos do tenant: override (SQLAGENT_COST_LIMITS_BY_TENANT) > padrão.
+
+    - SQLAGENT_COST_MAX: custo total estimado máximo (padrão 100000)
+    - SQLAGENT_COST_MAX_ROWS: linhas estimadas máximas no nó raiz (padrão 1000000)
+    - SQLAGENT_COST_ACTION: reject | downgrade | queue (padrão queue)
+    - SQLAGENT_COST_REJECT_FACTOR: acima de max_cost × fator, sempre recusa (padrão 10)
+    """
+    limits: Dict[str, Any] = {
+        "max_cost": float(os.getenv("SQLAGENT_COST_MAX", "100000") or 100000),
+        "max_rows": float(os.getenv("SQLAGENT_COST_MAX_ROWS", "1000000") or 1000000),
+        "action": (os.getenv("SQLAGENT_COST_ACTION", ACTION_QUEUE) or ACTION_QUEUE).lower(),
+        "reject_factor": float(os.getenv("SQLAGENT_COST_REJECT_FACTOR", "10") or 10),
+    }
+    if account_id:
+        limits.update(_tenant_overrides().get(account_id, {}))
+    if limits["action"] not in _ACTIONS:
+        limits["action"] = ACTION_QUEUE
+    return limits
+
+
+def summarize_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumo do plano para o cliente: custo, linhas, nó raiz, seq scans e sorts."""
+    seq_scans: List[str] = []
+    sorts = 0
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        kind = node.get("Node Type", "")
+        if kind == "Seq Scan":
+            seq_scans.append(node.get("Relation Name", "?"))
+        elif "Sort" in kind:
+            sorts += 1
+        stack.extend(node.get("Plans") or [])
+    return {
+        "total_cost": plan.get("Total Cost"),
+        "plan_rows": plan.get("Plan Rows"),
+        "node_type": plan.get("Node Type"),
+        "seq_scans": seq_scans,
+        "sorts": sorts,
+    }
+
+
+def _heavy_semaphore() -> asyncio.Semaphore:
+    global _HEAVY_SEM
+    if _HEAVY_SEM is None:
+        _HEAVY_SEM = asyncio.Semaphore(max(1, int(os.getenv("SQLAGENT_COST_HEAVY_CONCURRENCY", "1") or 1)))
+    return _HEAVY_SEM
+
+
+def _downgrade_sql(sql: str) -> str:
+    """Mesma query com LIMIT reduzido (SQLAGENT_COST_DOWNGRADE_LIMIT, padrão 50)."""
+    limit = int(os.getenv("SQLAGENT_COST_DOWNGRADE_LIMIT", "50") or 50)
+    check = check_sql(sql)
+    if check.tree is None or (check.limit is not None and check.limit <= limit):
+        return sql
+    tree = check.tree.copy()
+    tree.set("limit", exp.Limit(expression=exp.Literal.number(limit)))
+    return tree.sql(dialect="postgres")
+
+
+def _count(key: str) -> None:
+    with _STATS_LOCK:
+        _STATS[key] += 1
+
+
+class Admission:
+    """
+    Decisão do guard para uma query: `sql` a executar (pode ter sido rebaixada),
+    `timeout_ms` (None = padrão do tenant/endpoint) e `summary` do plano.
+    Em `queue`, segura uma vaga de query pesada até `release()`.
+    """
+
+    def __init__(self, sql: str, summary: Dict[str, Any], timeout_ms: Optional[int] = None, slot: bool = False):
+        self.sql = sql
+        self.summary = summary
+        self.timeout_ms = timeout_ms
+        self._slot = slot
+
+    def release(self) -> None:
+        if self._slot:
+            self._slot = False
+            _heavy_semaphore().release()
+
+
+async def admit(sql: str, account_id: str | None = None, plan: Optional[Dict[str, Any]] = None) -> Admission:
+    """
+    Estágio de admissão: roda `EXPLAIN (FORMAT JSON)` no SQL validado (ou usa
+    `plan`, o nó raiz já obtido pelo otimizador para esse mesmo SQL) e compara
+    custo total e linhas estimadas com os limites do tenant.
+
+    Dentro do limite: admite. Acima: conforme a ação do tenant, recusa
+    (`CostRejected`), rebaixa (LIMIT menor e statement_timeout de
+    SQLAGENT_COST_DOWNGRADE_TIMEOUT_MS) ou enfileira (no máximo
+    SQLAGENT_COST_HEAVY_CONCURRENCY queries pesadas ao mesmo tempo; espera até
+    SQLAGENT_COST_QUEUE_TIMEOUT_S, senão `CostQueueTimeout`). Acima de
+    max_cost × reject_factor sempre recusa. Falha no EXPLAIN não bloqueia.
+    """
+    limits = resolve_cost_limits(account_id)
+    _count("checked")
+    try:
+        if plan is None:
+            plan = await explain_plan(sql)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _count("explain_errors")
+        print(f"[WARN] SQLAgent: EXPLAIN falhou no guard de custo (query admitida): {repr(e)}")
+        _count(ACTION_ADMIT)
+        return Admission(sql, {"action": ACTION_ADMIT, "explain_error": str(e)})
+
+    summary = summarize_plan(plan)
+    cost = float(summary["total_cost"] or 0)
+    rows = float(summary["plan_rows"] or 0)
+    summary["limits"] = {"max_cost": limits["max_cost"], "max_rows": limits["max_rows"]}
+    over = [r for r, bad in (("cost", cost > limits["max_cost"]), ("rows", rows > limits["max_rows"])) if bad]
+    if not over:
+        summary["action"] = ACTION_ADMIT
+        _count(ACTION_ADMIT)
+        return Admission(sql, summary)
+
+    summary["exceeded"] = over
+    action = limits["action"]
+    if cost > limits["max_cost"] * limits["reject_factor"]:
+        action = ACTION_REJECT
+    summary["action"] = action
+    _count(action)
+    print(f"[WARN] SQLAgent: guard de custo {action} account_id={account_id} cost={cost:.0f} rows={rows:.0f} sql={sql[:300]!r}")
+
+    if action == ACTION_REJECT:
+        raise CostRejected(f"custo estimado acima do limite ({', '.join(over)})", summary)
+
+    if action == ACTION_DOWNGRADE:
+        downgraded = _downgrade_sql(sql)
+        timeout_ms = int(os.getenv("SQLAGENT_COST_DOWNGRADE_TIMEOUT_MS", "5000") or 5000)
+        summary["downgrade"] = {"sql": downgraded, "timeout_ms": timeout_ms}
+        return Admission(downgraded, summary, timeout_ms=timeout_ms)
+
+    wait_s = float(os.getenv("SQLAGENT_COST_QUEUE_TIMEOUT_S", "30") or 30)
+    t0 = time.perf_counter()
+    try:
+        await asyncio.wait_for(_heavy_semaphore().acquire(), timeout=wait_s)
+    except asyncio.TimeoutError:
+        _count("queue_timeouts")
+        summary["queued_ms"] = int((time.perf_counter() - t0) * 1000)
+        raise CostQueueTimeout(time.perf_counter() - t0, summary)
+    summary["queued_ms"] = int((time.perf_counter() - t0) * 1000)
+    return Admission(sql, summary, slot=True)
+
+
+def cost_guard_stats() -> Dict[str, Any]:
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    return {**stats, "defaults": resolve_cost_limits(None)}
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .providers.router import OUTCOME_ERROR, OUTCOME_INVALID, OUTCOME_OK, get_router, route
+
+# Uma chamada candidata: (nome do provider, função que cria a corrotina que retorna o texto)
+Candidate = Tuple[str, Callable[[], Awaitable[str]]]
+# Aceita/rejeita a saída de um provider: (provider, texto) -> (ok, valor convertido, motivo se inválido)
+Acceptor = Callable[[str, str], Tuple[bool, Any, str]]
+
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, Dict[str, Any]] = {}
+_LAST_RACES: List[Dict[str, Any]] = []
+
+
+def hedge_settings() -> Tuple[float, int]:
+    """(atraso em s antes de acionar o próximo provider, máximo de chamadas simultâneas)."""
+    delay_ms = float(os.getenv("SQLAGENT_HEDGE_DELAY_MS", "1500") or 1500)
+    max_parallel = int(os.getenv("SQLAGENT_HEDGE_MAX_PARALLEL", "2") or 2)
+    return max(0.0, delay_ms / 1000.0), max(1, max_parallel)
+
+
+def _record(kind: str, race: Dict[str, Any]) -> None:
+    with _STATS_LOCK:
+        st = _STATS.setdefault(kind, {"races": 0, "no_winner": 0, "hedge_wins": 0, "wins": {}, "win_ms_total": {}})
+        st["races"] += 1
+        winner = race.get("winner")
+        if winner is None:
+            st["no_winner"] += 1
+        else:
+            st["wins"][winner] = st["wins"].get(winner, 0) + 1
+            st["win_ms_total"][winner] = st["win_ms_total"].get(winner, 0) + race["elapsed_ms"]
+            if race.get("hedged"):
+                st["hedge_wins"] += 1
+        _LAST_RACES.append({"kind": kind, **race})
+        del _LAST_RACES[:-50]
+
+
+def hedge_stats() -> Dict[str, Any]:
+    """Vitórias por provider, vitórias de backup (hedge) e as últimas corridas."""
+    with _STATS_LOCK:
+        out: Dict[str, Any] = {}
+        for kind, st in _STATS.items():
+            out[kind] = {
+                "races": st["races"],
+                "no_winner": st["no_winner"],
+                "hedge_wins": st["hedge_wins"],
+                "wins": dict(st["wins"]),
+                "avg_win_ms": {p: round(st["win_ms_total"][p] / n) for p, n in st["wins"].items()},
+            }
+        return {"settings": dict(zip(("delay_s", "max_parallel"), hedge_settings())), "kinds": out, "recent": list(_LAST_RACES[-10:])}
+
+
+def _consume(fut: asyncio.Future) -> None:
+    # evita "exception was never retrieved" de perdedoras que falharam antes do cancelamento
+    if not fut.cancelled():
+        fut.exception()
+
+
+async def race(kind: str, candidates: List[Candidate], accept: Acceptor) -> Tuple[Optional[str], Any, List[str]]:
+    """
+    Executa os providers em corrida com hedge, na ordem escolhida pelo roteador
+    de saúde (latência/erros/inválidos): o primeiro começa logo; cada
+    próximo entra após `SQLAGENT_HEDGE_DELAY_MS` (ou imediatamente quando uma
+    chamada falha), respeitando `SQLAGENT_HEDGE_MAX_PARALLEL`. A primeira saída
+    aceita vence e as demais são canceladas.
+
+    Com MAX_PARALLEL=1 o comportamento é o fallback sequencial anterior.
+    Retorna (provider vencedor ou None, valor, erros).
+    """
+    delay_s, max_parallel = hedge_settings()
+    router = get_router()
+    t0 = time.perf_counter()
+    candidates = route(kind, candidates)
+    pending = list(candidates)
+    running: Dict[asyncio.Future, Tuple[str, float]] = {}
+    errors: List[str] = []
+    last_launch = 0.0
+
+    def _launch() -> None:
+        nonlocal last_launch
+        name, fn = pending.pop(0)
+        fut = asyncio.ensure_future(fn())
+        running[fut] = (name, time.perf_counter())
+        last_launch = time.perf_counter()
+
+    winner: Optional[str] = None
+    value: Any = None
+    win_ms: Optional[int] = None
+    try:
+        if pending:
+            _launch()
+        while running:
+            timeout = None
+            if pending and len(running) < max_parallel:
+                timeout = max(0.0, delay_s - (time.perf_counter() - last_launch))
+            done, _ = await asyncio.wait(set(running), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                _launch()  # hedge: o atual demorou mais que o atraso configurado
+                continue
+            failed = 0
+            for fut in done:
+                name, started = running.pop(fut)
+                call_ms = (time.perf_counter() - started) * 1000
+                try:
+                    text = fut.result()
+                except Exception as e:
+                    ok, converted, issue = False, None, f"err: {e}"
+                    router.observe(name, OUTCOME_ERROR, call_ms)
+                else:
+                    try:
+                        ok, converted, issue = accept(name, text)
+                    except Exception as e:
+                        ok, converted, issue = False, None, f"invalid: {e}"
+                    router.observe(name, OUTCOME_OK if ok else OUTCOME_INVALID, call_ms)
+                if ok and winner is None:
+                    winner, value = name, converted
+                    win_ms = int((time.perf_counter() - started) * 1000)
+                elif not ok:
+                    failed += 1
+                    errors.append(f"{name}_{issue}")
+            if winner is not None:
+                break
+            # cada falha libera uma vaga: aciona o próximo sem esperar o atraso
+            for _ in range(failed):
+                if pending and len(running) < max_parallel:
+                    _launch()
+    finally:
+        now = time.perf_counter()
+        cancelled = {name: int((now - started) * 1000) for name, started in running.values()}
+        for fut, (name, started) in running.items():
+            router.observe_cancelled(name, (now - started) * 1000)
+            fut.cancel()
+            fut.add_done_callback(_consume)
+
+    order = [c[0] for c in candidates]
+    _record(kind, {
+        "winner": winner,
+        "order": order,
+        "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+        "winner_call_ms": win_ms,
+        "hedged": bool(winner) and order.index(winner) > 0,
+        "cancelled_after_ms": cancelled,
+        "errors": errors,
+    })
+    return winner, value, errors
@@ -1,23 +1,13 @@
+import hashlib
 import json
-import os
 import re
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 
-# Providers
-try:
-    from .providers.openai import OpenAIProvider
-except Exception:
-    OpenAIProvider = None  # type: ignore
+from ..infra.schema_catalog import catalog_digest, cached_catalog
+from ..infra.llm_cache import get_llm_cache, normalize_question, models_signature, dumps_intent
+from .hedge import race
 
-try:
-    from .providers.gemini import GeminiProvider
-except Exception:
-    GeminiProvider = None  # type: ignore
-
-try:
-    from .providers.groq import GroqLlamaProvider
-except Exception:
-    GroqLlamaProvider = None  # type: ignore
+from .providers import enabled_providers, model_label
 
 
 INTENT_SCHEMA = {
@@ -31,7 +21,7 @@ INTENT_SCHEMA = {
     "dimensions": ["day"],
     "filters": [],  # [{"field":"channel","op":"=","value":"ifood"}]
     "table_hint": "v_ifood_order_ledger",
-    "preset_candidate": None,  # totais_ultimos_dias|diario_ultimos_dias|status_ultimos_dias
+    "preset_candidate": None,  # totais_ultimos_dias|diario_ultimos_dias|status_ultimos_dias|totais_por_periodo
     "limit": 100,
     # extras
     "channel": "ifood",
@@ -51,15 +41,25 @@ PROMPT = (
     "- metrics e dimensions são listas de termos simples (ex.: ['orders','revenue']).\n"
     "- filters é uma lista de objetos {{field, op, value}}.\n"
     "- table_hint é uma vista ou tabela de leitura (ex.: v_ifood_order_ledger ou v_ifood_financial_conciliation).\n"
+    "{schema}"
     "- Canal padrão é 'ifood' (preencha em channel).\n"
     "- Respeite tenant: preencha tenant.group_id/store_id se mencionado.\n"
     "- Reconheça e privilegie os campos canônicos: transaction_description, gross_value, payment_impact, event_date, expected_payment_date.\n"
     "  Aceite sinônimos, mas normalize para estes nomes em known_fields e em filters[].field.\n"
-    "- preset_candidate pode ser: totais_ultimos_dias | diario_ultimos_dias | status_ultimos_dias.\n"
+    "- preset_candidate pode ser: totais_ultimos_dias | diario_ultimos_dias | status_ultimos_dias | totais_por_periodo.\n"
+    "- Para comparar totais entre períodos, use preset_candidate=totais_por_periodo com os dias em suggested_periods.\n"
     "- Se algo não se aplicar, use null ou lista vazia.\n"
     "Pergunta: {question}\n"
 )
 
+def _schema_hint() -> str:
+    """Tabelas/colunas disponíveis (catálogo em memória) para orientar table_hint e filters."""
+    digest = catalog_digest()
+    if not digest:
+        return ""
+    return "- Tabelas e colunas disponíveis:\n" + digest + "\n"
+
+
 _JSON_RE = re.compile(r"\{[\s\S]*\}\s*$")
 
 
@@ -131,42 +131,68 @@ def _normalize(data: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
-def interpret(question: str) -> Tuple[Dict[str, Any], str]:
-    """Returns (intent_dict, model_used)."""
-    prompt = PROMPT.format(schema_keys=list(INTENT_SCHEMA.keys()), question=question)
+def _cache_key(normalized: str) -> str:
+    cat = cached_catalog()
+    models = models_signature(*((name, p.model_name) for name, p in enabled_providers()))
+    version = hashlib.sha1((PROMPT + (cat.version if cat else "")).encode()).hexdigest()[:12]
+    return get_llm_cache().make_key("intent", models, version, normalized)
 
-    errors = []
 
-    if OpenAIProvider is not None and os.getenv("OPENAI_API_KEY"):
-        try:
-            txt = OpenAIProvider(model=os.getenv("OPENAI_MODEL")).generate_sql(prompt)
-            data = _normalize(_extract_json(txt))
-            return data, os.getenv("OPENAI_MODEL", "openai")
-        except Exception as e:
-            errors.append(f"openai_err: {e}")
+async def interpret(question: str) -> Tuple[Dict[str, Any], str]:
+    """Returns (intent_dict, model_used).
 
-    if GeminiProvider is not None and os.getenv("GEMINI_API_KEY"):
-        try:
-            from .providers.gemini import GeminiProvider as _G
-            txt = _G(model=os.getenv("GEMINI_MODEL")).generate_sql(prompt)
-            data = _normalize(_extract_json(txt))
-            return data, "gemini"
-        except Exception as e:
-            errors.append(f"gemini_err: {e}")
-
-    if GroqLlamaProvider is not None and os.getenv("GROQ_API_KEY"):
+    Intenções extraídas por LLM ficam no cache persistente (pergunta normalizada,
+    datas como marcadores).
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return await _interpret_llm(question)
+    normalized, dates = normalize_question(question)
+    key = _cache_key(normalized)
+    hit = cache.get(key, dates)
+    if hit is not None:
         try:
-            txt = GroqLlamaProvider().generate_sql(prompt)
-            data = _normalize(_extract_json(txt))
-            return data, "llama"
-        except Exception as e:
-            errors.append(f"llama_err: {e}")
+            data = _normalize(json.loads(hit["value"]))
+            data["user_query"] = question
+            return data, hit["model"]
+        except Exception:
+            pass
+    data, model = await _interpret_llm(question)
+    if model != "fallback":
+        cache.put(key, "intent", normalized, dumps_intent(data), dates, provider=model, model=model)
+    return data, model
+
+
+def _intent_candidates(prompt: str) -> List[Tuple[str, Any]]:
+    return [(name, lambda p=p: p.generate_json(prompt)) for name, p in enabled_providers()]
+
+
+def _accept_json(name: str, text: str) -> Tuple[bool, Any, str]:
+    try:
+        return True, _normalize(_extract_json(text)), ""
+    except Exception as e:
+        return False, None, f"err: {e}"
+
+
+async def _race_intent(prompt: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Corrida com hedge entre os providers; (intent, modelo) ou (None, "fallback")."""
+    winner, data, _errors = await race("intent", _intent_candidates(prompt), _accept_json)
+    if winner is None:
+        return None, "fallback"
+    return data, model_label(winner)
+
+
+async def _interpret_llm(question: str) -> Tuple[Dict[str, Any], str]:
+    prompt = PROMPT.format(schema_keys=list(INTENT_SCHEMA.keys()), question=question, schema=_schema_hint())
+    data, model = await _race_intent(prompt)
+    if data is not None:
+        return data, model
 
     # fallback mínimo
     return _normalize({"user_query": question, "preset_candidate": "totais_ultimos_dias"}), "fallback"
 
 
-def interpret_chat(history: list[dict]) -> Tuple[Dict[str, Any], str]:
+async def interpret_chat(history: list[dict]) -> Tuple[Dict[str, Any], str]:
     """Multi-turn interpretation. history is a list of {role: user|assistant, content: str}.
     Returns (intent_dict, model_used).
     """
@@ -177,33 +203,10 @@ def interpret_chat(history: list[dict]) -> Tuple[Dict[str, Any], str]:
         "\nHistórico de conversa (apenas contexto, extraia parâmetros do diálogo como um todo):\n" +
         conv +
         "\nObservação: Responda SOMENTE com JSON válido conforme schema.\n"
-    ).format(schema_keys=list(INTENT_SCHEMA.keys()), question=q_last)
+    ).format(schema_keys=list(INTENT_SCHEMA.keys()), question=q_last, schema=_schema_hint())
 
-    errors = []
-
-    if OpenAIProvider is not None and os.getenv("OPENAI_API_KEY"):
-        try:
-            txt = OpenAIProvider(model=os.getenv("OPENAI_MODEL")).generate_sql(prompt)
-            data = _normalize(_extract_json(txt))
-            return data, os.getenv("OPENAI_MODEL", "openai")
-        except Exception as e:
-            errors.append(f"openai_err: {e}")
-
-    if GeminiProvider is not None and os.getenv("GEMINI_API_KEY"):
-        try:
-            from .providers.gemini import GeminiProvider as _G
-            txt = _G(model=os.getenv("GEMINI_MODEL")).generate_sql(prompt)
-            data = _normalize(_extract_json(txt))
-            return data, "gemini"
-        except Exception as e:
-            errors.append(f"gemini_err: {e}")
-
-    if GroqLlamaProvider is not None and os.getenv("GROQ_API_KEY"):
-        try:
-            txt = GroqLlamaProvider().generate_sql(prompt)
-            data = _normalize(_extract_json(txt))
-            return data, "llama"
-        except Exception as e:
-            errors.append(f"llama_err: {e}")
+    data, model = await _race_intent(prompt)
+    if data is not None:
+        return data, model
 
     return _normalize({"user_query": q_last or (history[-1]["content"] if history else ""), "preset_candidate": "totais_ultimos_dias"}), "fallback"
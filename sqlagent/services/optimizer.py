@@ -0,0 +1,328 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import datetime as _dt
+import os
+import re
+
+from sqlglot import exp
+
+from ..infra.db import explain_plan
+from ..infra.schema_catalog import cached_catalog
+from .validators import check_sql, is_read_only
+
+# Otimizações registradas na resposta
+OPT_SARGABLE = "sargable"
+OPT_DROP_CAST = "drop_cast"
+OPT_FOLD = "fold"
+
+_UNITS = ("DAY", "WEEK", "MONTH", "YEAR")
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_INTERVAL_DAYS = re.compile(r"^\s*\d+\s*(day|days|week|weeks)?\s*$", re.IGNORECASE)
+
+# tipo do sqlglot -> data_type do information_schema (para remover casts redundantes)
+_CATALOG_TYPES = {
+    exp.DataType.Type.DATE: "date",
+    exp.DataType.Type.BIGINT: "bigint",
+    exp.DataType.Type.INT: "integer",
+    exp.DataType.Type.SMALLINT: "smallint",
+    exp.DataType.Type.TEXT: "text",
+    exp.DataType.Type.DECIMAL: "numeric",
+    exp.DataType.Type.TIMESTAMP: "timestamp without time zone",
+    exp.DataType.Type.TIMESTAMPTZ: "timestamp with time zone",
+    exp.DataType.Type.BOOLEAN: "boolean",
+}
+
+
+def _sargable_columns() -> Set[str]:
+    env = os.getenv("SQLAGENT_SARGABLE_COLUMNS", "fact_date") or "fact_date"
+    return {c.strip().lower() for c in env.split(",") if c.strip()}
+
+
+def _unit(node: exp.Expression) -> Optional[str]:
+    unit = node.args.get("unit")
+    name = (unit.name if unit is not None else "").upper().strip("'")
+    return name if name in _UNITS else None
+
+
+def _wrapped_column(node: exp.Expression, columns: Set[str]) -> Optional[Tuple[exp.Column, str]]:
+    """`col::date` ou `date_trunc(unidade, col)` sobre coluna alvo -> (coluna, unidade)."""
+    if isinstance(node, exp.Cast) and node.to.this == exp.DataType.Type.DATE:
+        inner = node.this
+        if isinstance(inner, exp.Column) and inner.name.lower() in columns:
+            return inner, "DAY"
+    if isinstance(node, (exp.TimestampTrunc, exp.DateTrunc)):
+        inner = node.this
+        unit = _unit(node)
+        if unit and isinstance(inner, exp.Column) and inner.name.lower() in columns:
+            return inner, unit
+    return None
+
+
+def _literal_aligned(value: str, unit: str) -> bool:
+    if not _ISO_DATE.match(value):
+        return False
+    try:
+        d = _dt.date.fromisoformat(value)
+    except ValueError:
+        return False
+    if unit == "DAY":
+        return True
+    if unit == "WEEK":
+        return d.weekday() == 0
+    if unit == "MONTH":
+        return d.day == 1
+    return d.month == 1 and d.day == 1
+
+
+def _aligned(node: exp.Expression, unit: str) -> bool:
+    """O valor cai exatamente no início de uma `unit` (logo a comparação com o truncamento é exata)."""
+    if isinstance(node, exp.Paren):
+        return _aligned(node.this, unit)
+    if isinstance(node, exp.Literal) and node.is_string:
+        return _literal_aligned(node.this, unit)
+    if isinstance(node, (exp.TimestampTrunc, exp.DateTrunc)):
+        u = _unit(node)
+        return u is not None and (u == unit or unit == "DAY" or (unit == "MONTH" and u == "YEAR"))
+    if unit != "DAY":
+        return False
+    if isinstance(node, exp.CurrentDate):
+        return True
+    if isinstance(node, exp.Cast) and node.to.this == exp.DataType.Type.DATE:
+        return True
+    if isinstance(node, (exp.Add, exp.Sub)) and _aligned(node.this, "DAY"):
+        step = node.expression
+        if isinstance(step, exp.Literal) and not step.is_string:
+            return step.this.isdigit()
+        if isinstance(step, exp.Interval):
+            amount = step.this.name if step.this is not None else ""
+            unit_name = step.args.get("unit").name if step.args.get("unit") is not None else ""
+            return bool(_INTERVAL_DAYS.match(f"{amount} {unit_name}".strip()))
+    return False
+
+
+def _as_bound(node: exp.Expression) -> exp.Expression:
+    if isinstance(node, exp.Literal) and node.is_string:
+        return exp.Cast(this=node.copy(), to=exp.DataType.build("date"))
+    if isinstance(node, exp.Binary):
+        return exp.Paren(this=node.copy())
+    return node.copy()
+
+
+def _plus_one(bound: exp.Expression, unit: str) -> exp.Expression:
+    return exp.Add(this=bound.copy(), expression=exp.Interval(this=exp.Literal.string("1"), unit=exp.Var(this=unit)))
+
+
+_FLIP = {exp.GT: exp.LT, exp.GTE: exp.LTE, exp.LT: exp.GT, exp.LTE: exp.GTE, exp.EQ: exp.EQ}
+
+
+def _sargable(node: exp.Expression, columns: Set[str]) -> Optional[exp.Expression]:
+    if isinstance(node, exp.Between):
+        hit = _wrapped_column(node.this, columns)
+        low, high = node.args.get("low"), node.args.get("high")
+        if hit and low is not None and high is not None and _aligned(low, hit[1]) and _aligned(high, hit[1]):
+            col, unit = hit
+            return exp.and_(
+                exp.GTE(this=col.copy(), expression=_as_bound(low)),
+                exp.LT(this=col.copy(), expression=_plus_one(_as_bound(high), unit)),
+            )
+        return None
+    if type(node) not in _FLIP:
+        return None
+    left, right, op = node.this, node.expression, type(node)
+    hit = _wrapped_column(left, columns)
+    if hit is None:
+        hit = _wrapped_column(right, columns)
+        if hit is None:
+            return None
+        left, right, op = right, left, _FLIP[op]
+    col, unit = hit
+    if not _aligned(right, unit):
+        return None
+    bound = _as_bound(right)
+    if op is exp.EQ:
+        return exp.Paren(this=exp.and_(
+            exp.GTE(this=col.copy(), expression=bound),
+            exp.LT(this=col.copy(), expression=_plus_one(bound, unit)),
+        ))
+    if op is exp.GTE:
+        return exp.GTE(this=col.copy(), expression=bound)
+    if op is exp.GT:
+        return exp.GTE(this=col.copy(), expression=_plus_one(bound, unit))
+    if op is exp.LT:
+        return exp.LT(this=col.copy(), expression=bound)
+    return exp.LT(this=col.copy(), expression=_plus_one(bound, unit))
+
+
+def _column_types(tree: exp.Expression) -> Dict[str, str]:
+    """coluna -> tipo, só para colunas com tipo único entre as tabelas da query."""
+    cat = cached_catalog()
+    if cat is None:
+        return {}
+    seen: Dict[str, Set[str]] = {}
+    for t in tree.find_all(exp.Table):
+        for col, dtype in cat.columns(f"{t.db}.{t.name}" if t.db else t.name):
+            seen.setdefault(col.lower(), set()).add(dtype)
+    return {c: next(iter(ts)) for c, ts in seen.items() if len(ts) == 1}
+
+
+def _drop_cast(node: exp.Expression, types: Dict[str, str]) -> Optional[exp.Expression]:
+    if not isinstance(node, exp.Cast) or node.to.expressions:
+        return None
+    inner = node.this
+    # CAST(CAST(x AS T) AS T)
+    if isinstance(inner, exp.Cast) and inner.to.this == node.to.this and not inner.to.expressions:
+        return inner.copy()
+    # coluna já é do tipo do cast
+    if isinstance(inner, exp.Column) and types.get(inner.name.lower()) == _CATALOG_TYPES.get(node.to.this):
+        return inner.copy()
+    return None
+
+
+def _number(node: exp.Expression) -> Optional[float]:
+    if isinstance(node, exp.Literal) and not node.is_string:
+        try:
+            return float(node.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _fold(node: exp.Expression) -> Optional[Tuple[exp.Expression, str]]:
+    """(expressão dobrada, trecho removido/avaliado) ou None."""
+    # aritmética entre literais numéricos inteiros
+    if isinstance(node, (exp.Add, exp.Sub, exp.Mul)):
+        a, b = _number(node.this), _number(node.expression)
+        if a is not None and b is not None and a.is_integer() and b.is_integer():
+            value = {exp.Add: a + b, exp.Sub: a - b, exp.Mul: a * b}[type(node)]
+            return exp.Literal.number(int(value)), node.sql(dialect="postgres")
+    # `1 = 1` / `TRUE` em conjunções (comum em SQL gerado)
+    if isinstance(node, exp.And):
+        for side, other in ((node.this, node.expression), (node.expression, node.this)):
+            if _always_true(side):
+                return other.copy(), side.sql(dialect="postgres")
+    return None
+
+
+def _always_true(node: exp.Expression) -> bool:
+    if isinstance(node, exp.Boolean) and node.this is True:
+        return True
+    if isinstance(node, exp.EQ):
+        a, b = _number(node.this), _number(node.expression)
+        return a is not None and a == b
+    return False
+
+
+def _predicates(tree: exp.Expression) -> List[exp.Expression]:
+    """Condições de WHERE e de JOIN ... ON (onde as reescritas são seguras)."""
+    out: List[exp.Expression] = [w for w in tree.find_all(exp.Where)]
+    out.extend(j.args["on"] for j in tree.find_all(exp.Join) if j.args.get("on") is not None)
+    return out
+
+
+def optimize_sql(sql: str) -> Tuple[str, List[str]]:
+    """
+    Passe de otimização sobre a AST (sqlglot), restrito a WHERE/JOIN ON:
+
+    - sargabilidade: `col::date` / `date_trunc(u, col)` comparados a valores
+      alinhados viram faixas semiabertas na coluna crua (`col >= X and col < X + 1 u`),
+      para as colunas de SQLAGENT_SARGABLE_COLUMNS (padrão fact_date);
+    - remoção de casts redundantes (cast duplo ou para o próprio tipo da coluna no catálogo);
+    - dobra de constantes (aritmética de inteiros literais, `1 = 1`/`TRUE` em AND).
+
+    Retorna (sql, otimizações aplicadas); sem mudanças o texto volta intacto.
+    """
+    check = check_sql(sql)
+    if check.tree is None or not is_read_only(check.tree):
+        return sql, []
+    tree = check.tree.copy()
+    columns = _sargable_columns()
+    types = _column_types(tree)
+    applied: List[str] = []
+
+    for pred in _predicates(tree):
+        for node in list(pred.find_all(exp.Cast)):
+            if node.root() is not tree:
+                continue
+            new = _drop_cast(node, types)
+            if new is not None:
+                node.replace(new)
+                applied.append(f"{OPT_DROP_CAST}:{node.sql(dialect='postgres')}")
+        # dobra antes da sargabilidade: `current_date - 3*2` só é reconhecido
+        # como limite alinhado depois de virar `current_date - 6`.
+        # De baixo para cima, para que a dobra se propague.
+        for node in reversed(list(pred.find_all(exp.Add, exp.Sub, exp.Mul, exp.And))):
+            if node.root() is not tree:
+                continue
+            folded = _fold(node)
+            if folded is not None:
+                applied.append(f"{OPT_FOLD}:{folded[1]}")
+                node.replace(folded[0])
+                if node is pred:  # ON inteiro dobrado (`1 = 1 and ...`)
+                    pred = folded[0]
+        for node in list(pred.find_all(exp.Between, exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
+            if node.root() is not tree:
+                continue
+            new = _sargable(node, columns)
+            if new is not None:
+                applied.append(f"{OPT_SARGABLE}:{node.sql(dialect='postgres')}")
+                node.replace(new)
+
+    for where in list(tree.find_all(exp.Where)):
+        if _always_true(where.this):
+            applied.append(f"{OPT_FOLD}:{where.this.sql(dialect='postgres')}")
+            where.pop()
+
+    if not applied:
+        return sql, []
+    return tree.sql(dialect="postgres"), applied
+
+
+async def _explain(sql: str) -> Optional[Dict[str, Any]]:
+    try:
+        return await explain_plan(sql)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"[WARN] SQLAgent: EXPLAIN falhou no otimizador: {repr(e)}")
+        return None
+
+
+async def optimize_for_execution(sql: str) -> Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Aplica `optimize_sql` e compara o custo estimado (EXPLAIN) antes/depois.
+    Retorna (SQL a executar, relatório ou None quando nada mudou, plano do SQL
+    retornado ou None). O plano é repassado ao guard de custo, que assim não
+    roda outro EXPLAIN. Mantém o original se o otimizado não validar ou se o
+    EXPLAIN indicar custo maior.
+
+    SQLAGENT_OPTIMIZER=0 desliga o passe; SQLAGENT_OPTIMIZER_EXPLAIN=0 pula o EXPLAIN.
+    """
+    if os.getenv("SQLAGENT_OPTIMIZER", "1") in ("0", "false", "False"):
+        return sql, None, None
+    optimized, applied = optimize_sql(sql)
+    if not applied:
+        return sql, None, None
+    report: Dict[str, Any] = {"original_sql": sql, "optimized_sql": optimized, "rewrites": applied, "explain": None}
+    check = check_sql(optimized)
+    if not check.ok:
+        report["used"] = "original"
+        report["reason"] = "; ".join(check.issues)
+        return sql, report, None
+    plan_after = None
+    if os.getenv("SQLAGENT_OPTIMIZER_EXPLAIN", "1") not in ("0", "false", "False"):
+        plan_before, plan_after = await asyncio.gather(_explain(sql), _explain(optimized))
+        if plan_before is not None and plan_after is not None:
+            before = float(plan_before.get("Total Cost"))
+            after = float(plan_after.get("Total Cost"))
+            report["explain"] = {
+                "cost_before": before,
+                "cost_after": after,
+                "cost_delta": round(after - before, 2),
+                "cost_delta_pct": round((after - before) / before * 100, 1) if before else None,
+            }
+            if after > before:
+                report["used"] = "original"
+                report["reason"] = "higher estimated cost"
+                return sql, report, plan_before
+    report["used"] = "optimized"
+    return optimized, report, plan_after
@@ -1,13 +1,32 @@
 from typing import Dict, Any, Tuple, List
 import os
+import re
+import uuid
+from psycopg.types.numeric import Int4
 from ..infra.db import execute_sql
+from .rollup import ROLLUP_NAME, ROLLUP_TABLE, STATE_TABLE, TENANT_COLUMN, TENANT_TYPE, note_served, rollup_enabled, rollup_min_days
 from .validators import validate_sql
 
 ALLOWED_TABLE = os.getenv("SQLAGENT_ALLOWED_TABLES", "v_ifood_order_ledger") or "v_ifood_order_ledger"
 
+# Variante via rollup diário (services/rollup.py): dias completos e já consolidados
+# vêm do rollup; o ledger só é lido nas bordas (primeiro dia parcial da janela e
+# dias a partir de `complete_until`, inclusive hoje). Resultado igual ao da query direta.
+_WINDOW_START = "now() - make_interval(days => %(days)s)"
+_FRESH_UNTIL = f"coalesce((select complete_until from {STATE_TABLE} where name = '{ROLLUP_NAME}'), '-infinity'::date)"
+_ROLLUP_WHERE = f"where account_id = %(tenant)s and day > ({_WINDOW_START})::date and day < {_FRESH_UNTIL} "
+# Com SQLAGENT_TENANT_COLUMN, todas as variantes (direta e via rollup) filtram pelo tenant da requisição.
+# A coluna fica sem cast (o índice do tenant continua utilizável); o bind é que recebe o tipo da coluna.
+_TENANT_FILTER = f"and {TENANT_COLUMN} = %(tenant)s::{TENANT_TYPE} " if TENANT_COLUMN else ""
+# bordas em dois ranges sargáveis (um OR no mesmo predicado faria o índice varrer a janela inteira)
+_HEAD_WHERE = f"where fact_date >= {_WINDOW_START} and fact_date < ({_WINDOW_START})::date + 1 {_TENANT_FILTER}"
+_TAIL_WHERE = f"where fact_date >= greatest(({_WINDOW_START})::date + 1, {_FRESH_UNTIL}) {_TENANT_FILTER}"
+
 # Presets de perguntas determinísticas (sem LLM)
 # Obs.: usamos somente a view/tabela permitida em SQLAGENT_ALLOWED_TABLES.
 # Todas as queries incluem LIMIT para satisfazer o validador e evitar scans pesados.
+# O SQL é fixo por preset, com parâmetros `%(nome)s` enviados como bind tipado
+# (mesmo texto para qualquer valor -> prepared statement reaproveitado na conexão).
 
 PRESETS: Dict[str, Dict[str, Any]] = {
     "totais_ultimos_dias": {
@@ -15,11 +34,20 @@ PRESETS: Dict[str, Dict[str, Any]] = {
         "params": {
             "days": {"type": "int", "default": 7, "min": 1, "max": 365},
         },
-        "sql": lambda p: (
+        "sql": (
             f"select count(*)::bigint as orders, coalesce(sum(final_amount),0)::numeric as revenue "
             f"from {ALLOWED_TABLE} "
-            f"where fact_date >= now() - interval '{int(p.get('days', 7))} days' "
-            f"limit 1;"
+            f"where fact_date >= now() - make_interval(days => %(days)s) {_TENANT_FILTER}"
+            f"limit 1"
+        ),
+        "rollup_sql": (
+            f"select coalesce(sum(orders),0)::bigint as orders, coalesce(sum(revenue),0)::numeric as revenue "
+            f"from (select orders, revenue from {ROLLUP_TABLE} {_ROLLUP_WHERE}"
+            f"      union all "
+            f"      select count(*), coalesce(sum(final_amount),0) from {ALLOWED_TABLE} {_HEAD_WHERE}"
+            f"      union all "
+            f"      select count(*), coalesce(sum(final_amount),0) from {ALLOWED_TABLE} {_TAIL_WHERE}) x "
+            f"limit 1"
         ),
     },
     "diario_ultimos_dias": {
@@ -27,13 +55,25 @@ PRESETS: Dict[str, Dict[str, Any]] = {
         "params": {
             "days": {"type": "int", "default": 7, "min": 1, "max": 365},
         },
-        "sql": lambda p: (
+        "sql": (
             f"select date_trunc('day', fact_date)::date as dia, "
             f"       count(*)::bigint as orders, coalesce(sum(final_amount),0)::numeric as revenue "
             f"from {ALLOWED_TABLE} "
-            f"where fact_date >= now() - interval '{int(p.get('days', 7))} days' "
+            f"where fact_date >= now() - make_interval(days => %(days)s) {_TENANT_FILTER}"
+            f"group by 1 order by 1 "
+            f"limit 500"
+        ),
+        "rollup_sql": (
+            f"select dia, sum(orders)::bigint as orders, sum(revenue)::numeric as revenue "
+            f"from (select day as dia, orders, revenue from {ROLLUP_TABLE} {_ROLLUP_WHERE}"
+            f"      union all "
+            f"      select date_trunc('day', fact_date)::date, count(*), coalesce(sum(final_amount),0) "
+            f"      from {ALLOWED_TABLE} {_HEAD_WHERE}group by 1"
+            f"      union all "
+            f"      select date_trunc('day', fact_date)::date, count(*), coalesce(sum(final_amount),0) "
+            f"      from {ALLOWED_TABLE} {_TAIL_WHERE}group by 1) x "
             f"group by 1 order by 1 "
-            f"limit 500;"
+            f"limit 500"
         ),
     },
     "status_ultimos_dias": {
@@ -41,18 +81,147 @@ PRESETS: Dict[str, Dict[str, Any]] = {
         "params": {
             "days": {"type": "int", "default": 7, "min": 1, "max": 365},
         },
-        "sql": lambda p: (
+        "sql": (
             f"select coalesce(status,'unknown') as status, "
             f"       count(*)::bigint as orders, coalesce(sum(final_amount),0)::numeric as revenue "
             f"from {ALLOWED_TABLE} "
-            f"where fact_date >= now() - interval '{int(p.get('days', 7))} days' "
+            f"where fact_date >= now() - make_interval(days => %(days)s) {_TENANT_FILTER}"
+            f"group by 1 order by orders desc "
+            f"limit 100"
+        ),
+        "rollup_sql": (
+            f"select status, sum(orders)::bigint as orders, sum(revenue)::numeric as revenue "
+            f"from (select status, orders, revenue from {ROLLUP_TABLE} {_ROLLUP_WHERE}"
+            f"      union all "
+            f"      select coalesce(status,'unknown'), count(*), coalesce(sum(final_amount),0) "
+            f"      from {ALLOWED_TABLE} {_HEAD_WHERE}group by 1"
+            f"      union all "
+            f"      select coalesce(status,'unknown'), count(*), coalesce(sum(final_amount),0) "
+            f"      from {ALLOWED_TABLE} {_TAIL_WHERE}group by 1) x "
             f"group by 1 order by orders desc "
-            f"limit 100;"
+            f"limit 100"
         ),
     },
+    # Vários períodos numa só passada: cada linha entra no menor período que a
+    # contém e os totais de cada período são a soma acumulada dos buckets.
+    # Uma leitura da janela maior (range em fact_date) e o mesmo SQL para qualquer lista.
+    "totais_por_periodo": {
+        "title": "Totais de pedidos e receita em vários períodos (ex.: 7, 14, 30 e 90 dias)",
+        "params": {
+            "periods": {"type": "int_list", "default": [7, 14, 30, 90], "min": 1, "max": 365, "max_items": 8},
+        },
+        "sql": (
+            f"with periods as (select distinct unnest(%(periods)s::int[]) as days), "
+            f"buckets as ("
+            f"  select (select min(p.days) from periods p where l.fact_date >= now() - make_interval(days => p.days)) as days, "
+            f"         count(*) as orders, coalesce(sum(l.final_amount),0) as revenue "
+            f"  from {ALLOWED_TABLE} l "
+            f"  where l.fact_date >= now() - make_interval(days => (select max(days) from periods)) {_TENANT_FILTER}"
+            f"  group by 1) "
+            f"select p.days as period_days, "
+            f"       coalesce(sum(b.orders),0)::bigint as orders, coalesce(sum(b.revenue),0)::numeric as revenue "
+            f"from periods p left join buckets b on b.days <= p.days "
+            f"group by 1 order by 1 "
+            f"limit 8"
+        ),
+    },
+}
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+
+def _clamp(v: int, p: Dict[str, Any]) -> int:
+    return max(p.get("min", v), min(p.get("max", v), v))
+
+
+def _to_int(value: Any, p: Dict[str, Any]) -> Int4:
+    return Int4(_clamp(int(value), p))
+
+
+def _to_int_list(value: Any, p: Dict[str, Any]) -> List[Int4]:
+    """Lista de inteiros (aceita "7,30" ou [7, 30]), sem repetidos, ordenada e com até max_items."""
+    items = value.split(",") if isinstance(value, str) else list(value)
+    out = sorted({_clamp(int(v), p) for v in items})
+    if not out:
+        raise ValueError("lista vazia")
+    return [Int4(v) for v in out[: p.get("max_items", len(out))]]
+
+
+# tipo declarado -> conversão (valor recebido, spec) -> valor do bind com OID fixo (int4 / int4[])
+_PARAM_TYPES = {
+    "int": _to_int,
+    "int_list": _to_int_list,
 }
 
 
+def _coerce(preset_id: str, params: Dict[str, Any] | None) -> Dict[str, Any]:
+    """Valores dos parâmetros convertidos ao tipo declarado, com default e clamp min/max."""
+    spec = PRESETS[preset_id]["params"]
+    raw = dict(params or {})
+    out: Dict[str, Any] = {}
+    for name, p in spec.items():
+        convert = _PARAM_TYPES[p["type"]]
+        try:
+            out[name] = convert(raw.get(name, p["default"]), p)
+        except Exception:
+            out[name] = convert(p["default"], p)
+    return out
+
+
+def _literal(v: Any) -> str:
+    if isinstance(v, list):
+        return "array[" + ",".join(_literal(x) for x in v) + "]"
+    if isinstance(v, int):
+        return str(int(v))
+    return "'" + str(v).replace("'", "''") + "'"
+
+
+def _render(sql: str, values: Dict[str, Any]) -> str:
+    """SQL com os valores inline (só para validação e debug; a execução usa bind)."""
+    return _PLACEHOLDER.sub(lambda m: _literal(values[m.group(1)]), sql)
+
+
+def _check_preset(preset_id: str, preset: Dict[str, Any]) -> None:
+    """
+    Valida um preset: placeholders declarados em `params`, tipos conhecidos e SQL
+    aceito pelo validador com os defaults. Na variante via rollup, as tabelas do
+    rollup não precisam estar na allowlist. Levanta ValueError no primeiro problema.
+    """
+    internal = {f"Table not allowed: {t.split('.')[-1]}" for t in (ROLLUP_TABLE, STATE_TABLE)}
+    declared = set(preset["params"])
+    unknown = [p["type"] for p in preset["params"].values() if p["type"] not in _PARAM_TYPES]
+    if unknown:
+        raise ValueError(f"tipo de parâmetro não suportado: {unknown}")
+    defaults = _coerce(preset_id, {})
+    tenant = {"tenant"} if TENANT_COLUMN else set()
+    for key, extra, ignore in (("sql", tenant, set()), ("rollup_sql", {"tenant"}, internal)):
+        if key not in preset:
+            continue
+        used = set(_PLACEHOLDER.findall(preset[key]))
+        if used != declared | extra:
+            raise ValueError(f"parâmetros do SQL ({key}) {sorted(used)} != declarados {sorted(declared | extra)}")
+        ok, issues = validate_sql(_render(preset[key], {**defaults, "tenant": ""}))
+        issues = [i for i in issues if i not in ignore]
+        if issues:
+            raise ValueError(f"SQL inválido ({key}): " + "; ".join(issues))
+
+
+def _validate_presets() -> None:
+    """
+    Valida cada preset uma vez, no carregamento do módulo. Um preset inválido é
+    logado e removido de PRESETS; os demais (e o router) continuam disponíveis.
+    """
+    for preset_id in list(PRESETS):
+        try:
+            _check_preset(preset_id, PRESETS[preset_id])
+        except Exception as e:
+            print(f"[ERROR] SQLAgent: preset {preset_id} desativado: {e}")
+            PRESETS.pop(preset_id, None)
+
+
+_validate_presets()
+
+
 def list_presets() -> Dict[str, Any]:
     return {
         "allowed_table": ALLOWED_TABLE,
@@ -63,25 +232,74 @@ def list_presets() -> Dict[str, Any]:
     }
 
 
-def run_preset(preset_id: str, params: Dict[str, Any]) -> Tuple[List[str], List[List[Any]], str]:
+def _tenant_value(account_id: str) -> str:
+    """
+    x-account-id na forma textual canônica do tipo da coluna (a mesma de `col::text`
+    gravada no rollup), para que as variantes direta e via rollup casem o mesmo tenant.
+    """
+    raw = account_id.strip()
+    try:
+        if TENANT_TYPE == "uuid":
+            return str(uuid.UUID(raw))
+        if TENANT_TYPE in ("int", "int2", "int4", "int8", "integer", "smallint", "bigint"):
+            return str(int(raw))
+    except ValueError:
+        raise ValueError(f"x-account-id inválido para SQLAGENT_TENANT_TYPE={TENANT_TYPE}: {account_id!r}")
+    return raw
+
+
+def _choose(preset_id: str, params: Dict[str, Any], account_id: str | None) -> Tuple[str, Dict[str, Any], bool]:
     if preset_id not in PRESETS:
         raise ValueError(f"Preset inválido: {preset_id}")
+    preset = PRESETS[preset_id]
+    values = _coerce(preset_id, params)
+    if TENANT_COLUMN:
+        if not account_id:
+            raise ValueError("x-account-id obrigatório: presets filtrados por tenant (SQLAGENT_TENANT_COLUMN)")
+        values["tenant"] = _tenant_value(account_id)
+    if (
+        "rollup_sql" in preset
+        and rollup_enabled()
+        and int(values.get("days", 0)) >= rollup_min_days()
+    ):
+        return preset["rollup_sql"], values, True
+    return preset["sql"], values, False
 
-    # Sanitização simples de 'days'
-    p = dict(params or {})
-    if "days" in PRESETS[preset_id]["params"]:
-        try:
-            d = int(p.get("days", PRESETS[preset_id]["params"]["days"]["default"]))
-        except Exception:
-            d = PRESETS[preset_id]["params"]["days"]["default"]
-        min_d = PRESETS[preset_id]["params"]["days"].get("min", 1)
-        max_d = PRESETS[preset_id]["params"]["days"].get("max", 365)
-        p["days"] = max(min_d, min(max_d, d))
 
-    sql = PRESETS[preset_id]["sql"](p)
-    ok, issues = validate_sql(sql)
-    if not ok:
-        raise ValueError("SQL inválido para o preset: " + "; ".join(issues))
+def bind_preset(preset_id: str, params: Dict[str, Any], account_id: str | None = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    (SQL parametrizado, valores tipados) do preset. O SQL já foi validado no
+    carregamento do módulo, então aqui não há nova validação. Com o rollup
+    habilitado e janela de pelo menos SQLAGENT_ROLLUP_MIN_DAYS dias, usa a variante via rollup.
+    """
+    sql, values, from_rollup = _choose(preset_id, params, account_id)
+    note_served(from_rollup)
+    return sql, values
+
+
+def build_preset_sql(preset_id: str, params: Dict[str, Any], account_id: str | None = None) -> str:
+    """Monta o SQL do preset com os valores inline (debug/inspeção; sem executar)."""
+    sql, values, _ = _choose(preset_id, params, account_id)
+    return _render(sql, values)
+
+
+def by_period(columns: List[str], rows: List[List[Any]]) -> Dict[str, Dict[str, Any]]:
+    """Resultado de `totais_por_periodo` indexado pelo período: {"7": {"orders": ..., "revenue": ...}, ...}."""
+    idx = {c: i for i, c in enumerate(columns)}
+    if "period_days" not in idx:
+        return {}
+    return {
+        str(r[idx["period_days"]]): {c: r[i] for c, i in idx.items() if c != "period_days"}
+        for r in rows
+    }
+
 
-    cols, rows = execute_sql(sql)
+async def run_preset(
+    preset_id: str,
+    params: Dict[str, Any],
+    account_id: str | None = None,
+    endpoint: str = "qa.presets",
+) -> Tuple[List[str], List[List[Any]], str]:
+    sql, values = bind_preset(preset_id, params, account_id)
+    cols, rows = await execute_sql(sql, account_id=account_id, endpoint=endpoint, params=values, prepare=True)
     return cols, rows, sql
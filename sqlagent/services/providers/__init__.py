@@ -1 +1,93 @@
 # providers package
+import os
+import threading
+from typing import Any, Dict, List, Tuple
+
+from .base import BaseProvider, call_timeout, shutdown_executor
+
+# Ordem de preferência nas corridas (hedge)
+PROVIDER_ORDER = ("openai", "gemini", "llama")
+
+_KEY_ENV = {"openai": "OPENAI_API_KEY", "gemini": "GEMINI_API_KEY", "llama": "GROQ_API_KEY"}
+_LOCK = threading.Lock()
+# nome -> (chave de API usada, instância)
+_INSTANCES: Dict[str, Tuple[str, BaseProvider]] = {}
+_BUILDS: Dict[str, int] = {}
+_WARNED: set = set()
+
+
+def _build(name: str) -> BaseProvider:
+    if name == "openai":
+        from .openai import OpenAIProvider
+        return OpenAIProvider()
+    if name == "gemini":
+        from .gemini import GeminiProvider
+        return GeminiProvider()
+    if name == "llama":
+        from .groq import GroqLlamaProvider
+        return GroqLlamaProvider()
+    raise ValueError(f"provider desconhecido: {name}")
+
+
+def get_provider(name: str) -> BaseProvider:
+    """
+    Provider já aquecido (cliente criado uma vez por processo; recriado só se a
+    chave de API mudar). Levanta RuntimeError se o SDK ou a chave faltarem.
+    """
+    api_key = os.getenv(_KEY_ENV.get(name, ""), "")
+    item = _INSTANCES.get(name)
+    if item is not None and item[0] == api_key:
+        return item[1]
+    with _LOCK:
+        item = _INSTANCES.get(name)
+        if item is not None and item[0] == api_key:
+            return item[1]
+        provider = _build(name)
+        _INSTANCES[name] = (api_key, provider)
+        _BUILDS[name] = _BUILDS.get(name, 0) + 1
+        return provider
+
+
+def enabled_providers() -> List[Tuple[str, BaseProvider]]:
+    """Providers com chave configurada e SDK disponível, na ordem de preferência."""
+    out: List[Tuple[str, BaseProvider]] = []
+    for name in PROVIDER_ORDER:
+        if not os.getenv(_KEY_ENV[name]):
+            continue
+        try:
+            out.append((name, get_provider(name)))
+        except Exception as e:
+            if name not in _WARNED:
+                _WARNED.add(name)
+                print(f"[WARN] SQLAgent: provider {name} indisponível: {repr(e)}")
+    return out
+
+
+def model_label(name: str) -> str:
+    """Rótulo do campo `model` nas respostas da API (mantido como antes do registry)."""
+    if name == "openai":
+        return os.getenv("OPENAI_MODEL", "openai")
+    return name
+
+
+def registry_stats() -> Dict[str, Any]:
+    return {
+        "timeout_s": call_timeout(),
+        "providers": {
+            name: {"model": inst.model_name, "builds": _BUILDS.get(name, 0)}
+            for name, (_key, inst) in _INSTANCES.items()
+        },
+    }
+
+
+async def close_providers() -> None:
+    """Fecha os clientes HTTP dos providers e o pool de threads."""
+    with _LOCK:
+        items = list(_INSTANCES.values())
+        _INSTANCES.clear()
+    for _key, provider in items:
+        try:
+            await provider.aclose()
+        except Exception as e:
+            print(f"[WARN] SQLAgent: falha ao fechar provider {provider.name}: {repr(e)}")
+    shutdown_executor()
@@ -0,0 +1,94 @@
+import abc
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+SQL_SYSTEM = (
+    "Você é um assistente que gera exclusivamente SQL PostgreSQL válido. "
+    "Responda APENAS com o SQL bruto, sem comentários, explicações nem markdown."
+)
+JSON_SYSTEM = (
+    "Você extrai parâmetros estruturados. "
+    "Responda APENAS com um objeto JSON válido, sem comentários nem markdown."
+)
+
+
+def call_timeout(timeout: Optional[float] = None) -> float:
+    """Timeout (s) de uma chamada ao LLM: o informado ou SQLAGENT_LLM_TIMEOUT_S (padrão 30)."""
+    if timeout is not None and timeout > 0:
+        return float(timeout)
+    return float(os.getenv("SQLAGENT_LLM_TIMEOUT_S", "30") or 30)
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        workers = int(os.getenv("SQLAGENT_LLM_THREADS", "8") or 8)
+        _EXECUTOR = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sqlagent-llm")
+    return _EXECUTOR
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Executa uma chamada de SDK síncrono no pool limitado (SQLAGENT_LLM_THREADS)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        _EXECUTOR = None
+
+
+def strip_fences(text: str) -> str:
+    """Remove cercas de código (```sql ... ```, ```json ... ```) que alguns modelos devolvem."""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`\n ")
+        for tag in ("sql", "json"):
+            if text.lower().startswith(tag):
+                text = text[len(tag):].lstrip("\n")
+                break
+    return text.strip()
+
+
+class BaseProvider(abc.ABC):
+    """
+    Interface assíncrona comum dos providers: `generate_sql`, `generate_json` e
+    `generate_text`, todas com timeout por chamada. As subclasses implementam
+    `_complete(messages, json_mode, timeout)`; o cliente é criado uma vez (ver registry).
+    """
+
+    name = ""
+    model_name = ""
+
+    @abc.abstractmethod
+    async def _complete(self, messages: list[dict], json_mode: bool, timeout: float) -> str:
+        """Uma chamada ao modelo com as mensagens prontas; devolve o texto da resposta."""
+
+    async def _run(self, messages: list[dict], json_mode: bool, timeout: Optional[float]) -> str:
+        t = call_timeout(timeout)
+        try:
+            return await asyncio.wait_for(self._complete(messages, json_mode, t), t)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{self.name}: sem resposta em {t:.1f}s")
+
+    async def generate_sql(self, prompt: str, timeout: Optional[float] = None) -> str:
+        messages = [{"role": "system", "content": SQL_SYSTEM}, {"role": "user", "content": prompt}]
+        return strip_fences(await self._run(messages, False, timeout))
+
+    async def generate_json(self, prompt: str, timeout: Optional[float] = None) -> str:
+        messages = [{"role": "system", "content": JSON_SYSTEM}, {"role": "user", "content": prompt}]
+        return strip_fences(await self._run(messages, True, timeout))
+
+    async def generate_text(self, history: list[dict], timeout: Optional[float] = None) -> str:
+        """history: list of {role, content}. Returns assistant text."""
+        return (await self._run(list(history), False, timeout)).strip()
+
+    async def aclose(self) -> None:
+        pass
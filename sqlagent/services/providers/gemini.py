@@ -1,29 +1,55 @@
 import os
 from typing import Optional
 
+from .base import BaseProvider, run_blocking
+
 try:
     import google.generativeai as genai
 except Exception as e:
     genai = None
 
+_CONFIGURED_KEY: Optional[str] = None
+
+
+class GeminiProvider(BaseProvider):
+    """
+    `genai.configure` é global: roda só quando a chave muda. Usa
+    `generate_content_async` quando o SDK oferece; senão, o pool de threads limitado.
+    """
+
+    name = "gemini"
 
-class GeminiProvider:
     def __init__(self, model: Optional[str] = None):
+        global _CONFIGURED_KEY
         if genai is None:
             raise RuntimeError("google-generativeai não instalado")
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise RuntimeError("GEMINI_API_KEY não definido")
-        genai.configure(api_key=api_key)
+        if _CONFIGURED_KEY != api_key:
+            genai.configure(api_key=api_key)
+            _CONFIGURED_KEY = api_key
         self.model_name = model or os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
         self.model = genai.GenerativeModel(self.model_name)
 
-    def generate_sql(self, prompt: str) -> str:
-        resp = self.model.generate_content(prompt)
-        text = resp.text.strip()
-        # Alguns modelos retornam ```sql ...```
-        if text.startswith("```"):
-            text = text.strip("`\n ")
-            if text.lower().startswith("sql"):
-                text = text[3:].lstrip("\n")
-        return text.strip()
+    @staticmethod
+    def _contents(messages: list[dict]):
+        # Pergunta única (SQL/JSON): só o texto do usuário, como antes
+        turns = [m for m in messages if m.get("role") != "system"]
+        if len(turns) == 1:
+            return turns[0].get("content", "")
+        return [
+            {"role": "model" if m.get("role") == "assistant" else "user", "parts": [m.get("content", "")]}
+            for m in turns
+        ]
+
+    async def _complete(self, messages: list[dict], json_mode: bool, timeout: float) -> str:
+        contents = self._contents(messages)
+        kwargs = {"request_options": {"timeout": timeout}}
+        if json_mode:
+            kwargs["generation_config"] = {"response_mime_type": "application/json"}
+        if hasattr(self.model, "generate_content_async"):
+            resp = await self.model.generate_content_async(contents, **kwargs)
+        else:
+            resp = await run_blocking(self.model.generate_content, contents, **kwargs)
+        return resp.text
@@ -1,32 +1,37 @@
 import os
 from typing import Optional
 
+from .base import BaseProvider
+
 try:
-    from groq import Groq
+    from groq import AsyncGroq
 except Exception:
-    Groq = None
+    AsyncGroq = None
+
 
+class GroqLlamaProvider(BaseProvider):
+    name = "llama"
 
-class GroqLlamaProvider:
     def __init__(self, model: Optional[str] = None):
-        if Groq is None:
+        if AsyncGroq is None:
             raise RuntimeError("groq SDK não instalado")
         api_key = os.getenv("GROQ_API_KEY")
         if not api_key:
             raise RuntimeError("GROQ_API_KEY não definido")
-        self.client = Groq(api_key=api_key)
-        self.model = model or os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
+        self.client = AsyncGroq(api_key=api_key, max_retries=0)
+        self.model_name = model or os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
 
-    def generate_sql(self, prompt: str) -> str:
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role":"user","content": prompt}],
+    async def _complete(self, messages: list[dict], json_mode: bool, timeout: float) -> str:
+        kwargs = {"response_format": {"type": "json_object"}} if json_mode else {}
+        resp = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
             temperature=0.1,
             max_tokens=512,
+            timeout=timeout,
+            **kwargs,
         )
-        text = resp.choices[0].message.content.strip()
-        if text.startswith("```"):
-            text = text.strip("`\n ")
-            if text.lower().startswith("sql"):
-                text = text[3:].lstrip("\n")
-        return text.strip()
+        return resp.choices[0].message.content or ""
+
+    async def aclose(self) -> None:
+        await self.client.close()
@@ -0,0 +1,175 @@
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import PROVIDER_ORDER, get_provider
+
+OUTCOME_OK = "ok"
+OUTCOME_INVALID = "invalid"
+OUTCOME_ERROR = "error"
+
+
+def _settings() -> Dict[str, float]:
+    return {
+        "alpha": float(os.getenv("SQLAGENT_ROUTER_ALPHA", "0.3") or 0.3),
+        "prior_ms": float(os.getenv("SQLAGENT_ROUTER_PRIOR_MS", "2000") or 2000),
+        "error_weight": float(os.getenv("SQLAGENT_ROUTER_ERROR_WEIGHT", "4") or 4),
+        "invalid_weight": float(os.getenv("SQLAGENT_ROUTER_INVALID_WEIGHT", "2") or 2),
+        "fail_threshold": int(os.getenv("SQLAGENT_ROUTER_FAIL_THRESHOLD", "3") or 3),
+        "cooldown_s": float(os.getenv("SQLAGENT_ROUTER_COOLDOWN_S", "30") or 30),
+        "explore": float(os.getenv("SQLAGENT_ROUTER_EXPLORE", "0.05") or 0),
+    }
+
+
+class ProviderHealth:
+    """
+    Saúde de um provider/modelo: EWMA da latência (só chamadas concluídas) e
+    EWMA das taxas de erro e de saída inválida; falhas consecutivas abrem um
+    cool-down em que o provider vai para o fim da fila.
+    """
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.invalid_rate = 0.0
+        self.calls = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.cooldowns = 0
+
+    def observe(self, outcome: str, elapsed_ms: float, cfg: Dict[str, float]) -> None:
+        a = cfg["alpha"]
+        self.calls += 1
+        self.error_rate += a * ((outcome == OUTCOME_ERROR) - self.error_rate)
+        self.invalid_rate += a * ((outcome == OUTCOME_INVALID) - self.invalid_rate)
+        if outcome != OUTCOME_ERROR:
+            self.latency_ms = elapsed_ms if self.latency_ms is None else self.latency_ms + a * (elapsed_ms - self.latency_ms)
+        if outcome == OUTCOME_OK:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= cfg["fail_threshold"]:
+            self.cooldown_until = time.time() + cfg["cooldown_s"]
+            self.cooldowns += 1
+            self.consecutive_failures = 0
+            print(f"[WARN] SQLAgent: provider {self.provider}:{self.model} em cool-down por {cfg['cooldown_s']:.0f}s")
+
+    def observe_cancelled(self, elapsed_ms: float, cfg: Dict[str, float]) -> None:
+        # perdeu a corrida: a latência real é no mínimo o tempo até o cancelamento
+        if self.latency_ms is None or elapsed_ms > self.latency_ms:
+            self.latency_ms = elapsed_ms if self.latency_ms is None else self.latency_ms + cfg["alpha"] * (elapsed_ms - self.latency_ms)
+
+    def cooling(self, now: float) -> bool:
+        return now < self.cooldown_until
+
+    def score(self, cfg: Dict[str, float]) -> float:
+        """Latência esperada penalizada pelas taxas de erro/inválido (menor é melhor)."""
+        latency = self.latency_ms if self.latency_ms is not None else cfg["prior_ms"]
+        return latency * (1 + cfg["error_weight"] * self.error_rate + cfg["invalid_weight"] * self.invalid_rate)
+
+    def to_json(self, cfg: Dict[str, float], now: float) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "latency_ewma_ms": round(self.latency_ms) if self.latency_ms is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "invalid_rate": round(self.invalid_rate, 4),
+            "score": round(self.score(cfg)),
+            "calls": self.calls,
+            "cooldown_remaining_s": max(0, round(self.cooldown_until - now)),
+            "cooldowns": self.cooldowns,
+        }
+
+
+class ProviderRouter:
+    """Ordena os providers pela saúde atual (melhor primeiro; em cool-down por último)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._health: Dict[str, ProviderHealth] = {}
+        self._decisions: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def _model(name: str) -> str:
+        try:
+            return get_provider(name).model_name
+        except Exception:
+            return ""
+
+    def _get(self, name: str) -> ProviderHealth:
+        model = self._model(name)
+        key = f"{name}:{model}"
+        h = self._health.get(key)
+        if h is None:
+            h = self._health[key] = ProviderHealth(name, model)
+        return h
+
+    def order(self, kind: str, names: Sequence[str]) -> List[str]:
+        cfg = _settings()
+        now = time.time()
+        with self._lock:
+            ranked = []
+            for name in names:
+                h = self._get(name)
+                static = PROVIDER_ORDER.index(name) if name in PROVIDER_ORDER else len(PROVIDER_ORDER)
+                ranked.append((h.cooling(now), h.score(cfg), static, name))
+            ranked.sort()
+            order = [r[3] for r in ranked]
+            # exploração: de vez em quando o 2º colocado vai à frente, para que um
+            # provider rebaixado volte a ser medido (o hedge limita o custo)
+            healthy = sum(1 for r in ranked if not r[0])
+            explore = healthy >= 2 and random.random() < cfg["explore"]
+            if explore:
+                order[0], order[1] = order[1], order[0]
+            self._decisions.append({
+                "at": int(now),
+                "kind": kind,
+                "order": order,
+                "explore": explore,
+                "scores": {r[3]: round(r[1]) for r in ranked},
+                "cooling": [r[3] for r in ranked if r[0]],
+            })
+            del self._decisions[:-50]
+        return order
+
+    def observe(self, name: str, outcome: str, elapsed_ms: float) -> None:
+        cfg = _settings()
+        with self._lock:
+            self._get(name).observe(outcome, elapsed_ms, cfg)
+
+    def observe_cancelled(self, name: str, elapsed_ms: float) -> None:
+        cfg = _settings()
+        with self._lock:
+            self._get(name).observe_cancelled(elapsed_ms, cfg)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._health.clear()
+            self._decisions.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        cfg = _settings()
+        now = time.time()
+        with self._lock:
+            health = sorted(
+                (h.to_json(cfg, now) for h in self._health.values()),
+                key=lambda x: (x["cooldown_remaining_s"] > 0, x["score"]),
+            )
+            return {"settings": cfg, "providers": health, "recent_decisions": list(self._decisions[-20:])}
+
+
+@lru_cache()
+def get_router() -> ProviderRouter:
+    """Roteador único do processo."""
+    return ProviderRouter()
+
+
+def route(kind: str, candidates: Sequence[Tuple[str, Any]]) -> List[Tuple[str, Any]]:
+    """Reordena `(nome, ...)` pela saúde dos providers."""
+    by_name = {c[0]: c for c in candidates}
+    return [by_name[n] for n in get_router().order(kind, list(by_name))]
@@ -0,0 +1,221 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import sqlglot
+
+from ..infra.db import execute_sql
+
+CACHE_HIT = "HIT"
+CACHE_MISS = "MISS"
+CACHE_BYPASS = "BYPASS"
+
+
+# literal entre aspas simples (preservado) ou sequência de espaços (vira um espaço)
+_WS_OUTSIDE_LITERALS = re.compile(r"('(?:[^']|'')*')|\s+")
+
+
+def canonical_sql(sql: str) -> str:
+    """
+    Forma canônica da query via AST do sqlglot (dialeto postgres): queries que
+    diferem só em espaços, caixa de palavras-chave ou `;` final geram o mesmo texto.
+    Se o parse falhar, usa o SQL cru só com os espaços normalizados (fora de
+    literais), sem mexer em caixa: literais diferentes nunca dividem a chave.
+    """
+    normalized = (sql or "").strip().rstrip(";").strip()
+    try:
+        return sqlglot.parse_one(normalized, read="postgres").sql(dialect="postgres")
+    except Exception:
+        return _WS_OUTSIDE_LITERALS.sub(lambda m: m.group(1) or " ", normalized)
+
+
+def _ttl_overrides() -> Dict[str, float]:
+    raw = os.getenv("SQLAGENT_CACHE_TTL_BY_PRESET") or ""
+    if not raw.strip():
+        return {}
+    try:
+        return {str(k): float(v) for k, v in json.loads(raw).items()}
+    except Exception as e:
+        print(f"[WARN] SQLAGENT_CACHE_TTL_BY_PRESET inválido (esperado JSON {{preset: segundos}}): {repr(e)}")
+        return {}
+
+
+def ttl_for(preset_id: str | None = None) -> float:
+    """TTL (s) do preset (SQLAGENT_CACHE_TTL_BY_PRESET) ou o padrão SQLAGENT_CACHE_TTL_S."""
+    if preset_id:
+        by_preset = _ttl_overrides()
+        if preset_id in by_preset:
+            return by_preset[preset_id]
+    return float(os.getenv("SQLAGENT_CACHE_TTL_S", "60") or 60)
+
+
+class ResultCache:
+    """
+    Cache LRU de resultados por (tenant, SQL canônico), com TTL por entrada e
+    limites de quantidade de entradas e de bytes (tamanho aproximado em JSON).
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_entries = int(max_entries or os.getenv("SQLAGENT_CACHE_MAX_ENTRIES", "500") or 500)
+        self.max_bytes = int(max_bytes or os.getenv("SQLAGENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)) or 64 * 1024 * 1024)
+        self._lock = threading.Lock()
+        # key -> (expires_at, stored_at, size, columns, rows)
+        self._data: "OrderedDict[Tuple[str, str], Tuple[float, float, int, List[str], List[List[Any]]]]" = OrderedDict()
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "bypass": 0, "stores": 0, "evictions": 0, "expired": 0, "too_large": 0}
+
+    @staticmethod
+    def key(account_id: str | None, sql: str, params: Dict[str, Any] | None = None) -> Tuple[str, str]:
+        canonical = canonical_sql(sql)
+        if params:
+            canonical += "\x00" + json.dumps(params, sort_keys=True, default=str)
+        return (account_id or "", canonical)
+
+    @staticmethod
+    def key_id(key: Tuple[str, str]) -> str:
+        return hashlib.sha1("\x00".join(key).encode()).hexdigest()[:12]
+
+    def get(self, key: Tuple[str, str]) -> Optional[Tuple[List[str], List[List[Any]], float]]:
+        """Retorna (columns, rows, idade em s) ou None; renova a posição LRU."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            expires_at, stored_at, size, columns, rows = item
+            if expires_at <= now:
+                del self._data[key]
+                self._bytes -= size
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return columns, rows, now - stored_at
+
+    def put(self, key: Tuple[str, str], columns: List[str], rows: List[List[Any]], ttl_s: float) -> None:
+        if ttl_s <= 0:
+            return
+        size = len(json.dumps(rows, default=str)) + sum(len(k) for k in key)
+        if size > self.max_bytes:
+            with self._lock:
+                self.stats["too_large"] += 1
+            return
+        now = time.monotonic()
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (now + ttl_s, now, size, columns, rows)
+            self._bytes += size
+            self.stats["stores"] += 1
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.stats["evictions"] += 1
+
+    def note_bypass(self) -> None:
+        with self._lock:
+            self.stats["bypass"] += 1
+
+    def clear(self, account_id: str | None = None) -> int:
+        """Remove todas as entradas (ou só as do tenant). Retorna quantas saíram."""
+        with self._lock:
+            if account_id is None:
+                n = len(self._data)
+                self._data.clear()
+                self._bytes = 0
+                return n
+            keys = [k for k in self._data if k[0] == account_id]
+            for k in keys:
+                self._bytes -= self._data.pop(k)[2]
+            return len(keys)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            }
+
+
+@lru_cache()
+def get_result_cache() -> ResultCache:
+    """Instância única do cache de resultados do processo."""
+    return ResultCache()
+
+
+def cached_result(
+    sql: str,
+    *,
+    account_id: str | None = None,
+    ttl_s: float | None = None,
+    bypass: bool = False,
+    params: Dict[str, Any] | None = None,
+) -> Optional[Tuple[List[str], List[List[Any]], Dict[str, str]]]:
+    """
+    Só a consulta ao cache, sem executar: (columns, rows, headers) num HIT, senão None.
+    Permite pular etapas caras (otimizador, EXPLAIN) quando o resultado já está em cache;
+    no MISS, execute com `execute_cached(..., lookup=False)` para não contar a busca duas vezes.
+    """
+    cache = get_result_cache()
+    ttl = ttl_for() if ttl_s is None else ttl_s
+    if ttl <= 0 or bypass:
+        return None
+    key = cache.key(account_id, sql, params)
+    hit = cache.get(key)
+    if hit is None:
+        return None
+    cols, rows, age = hit
+    return cols, rows, {"X-Cache-Key": cache.key_id(key), "X-Cache": CACHE_HIT, "Age": str(int(age))}
+
+
+async def execute_cached(
+    sql: str,
+    *,
+    account_id: str | None = None,
+    endpoint: str | None = None,
+    ttl_s: float | None = None,
+    bypass: bool = False,
+    timeout_ms: int | None = None,
+    params: Dict[str, Any] | None = None,
+    prepare: bool | None = None,
+    key_sql: str | None = None,
+    lookup: bool = True,
+) -> Tuple[List[str], List[List[Any]], Dict[str, str]]:
+    """
+    `execute_sql` com cache por tenant + SQL canônico (+ valores de bind, se houver).
+    Retorna (columns, rows, headers) com X-Cache (HIT/MISS/BYPASS), X-Cache-Key e Age.
+
+    `key_sql` é o SQL da chave quando difere do executado (ex.: SQL validado antes
+    da reescrita do otimizador); `lookup=False` quando o chamador já consultou via `cached_result`.
+    """
+    cache = get_result_cache()
+    ttl = ttl_for() if ttl_s is None else ttl_s
+    key = cache.key(account_id, key_sql or sql, params)
+    headers = {"X-Cache-Key": cache.key_id(key)}
+    if ttl <= 0 or bypass:
+        cache.note_bypass()
+        cols, rows = await execute_sql(sql, account_id=account_id, endpoint=endpoint, timeout_ms=timeout_ms, params=params, prepare=prepare)
+        if bypass and ttl > 0:
+            cache.put(key, cols, rows, ttl)  # no-cache: refaz a consulta e atualiza a entrada
+        return cols, rows, {**headers, "X-Cache": CACHE_BYPASS}
+    hit = cache.get(key) if lookup else None
+    if hit is not None:
+        cols, rows, age = hit
+        return cols, rows, {**headers, "X-Cache": CACHE_HIT, "Age": str(int(age))}
+    cols, rows = await execute_sql(sql, account_id=account_id, endpoint=endpoint, timeout_ms=timeout_ms, params=params, prepare=prepare)
+    cache.put(key, cols, rows, ttl)
+    return cols, rows, {**headers, "X-Cache": CACHE_MISS}
@@ -0,0 +1,230 @@
+from typing import Any, AsyncIterator, List, Sequence, Tuple
+import datetime as _dt
+import decimal
+import json
+import os
+import uuid
+
+try:
+    import pyarrow as pa  # opcional: saída Arrow IPC
+except Exception:
+    pa = None  # type: ignore
+
+# Formatos de resposta (não-streaming): `?format=` ou header Accept
+RESULT_ROWS = "rows"
+RESULT_COLUMNAR = "columnar"
+RESULT_ARROW = "arrow"
+COLUMNAR_MEDIA_TYPE = "application/vnd.sqlagent.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Formatos de streaming aceitos em `?stream=` ou pelo header Accept
+STREAM_NDJSON = "ndjson"
+STREAM_JSON = "json"
+_STREAM_MEDIA_TYPES = {
+    STREAM_NDJSON: "application/x-ndjson",
+    STREAM_JSON: "application/json",
+}
+
+
+def _json_default(v: Any) -> Any:
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    if isinstance(v, (_dt.date, _dt.datetime, _dt.time)):
+        return v.isoformat()
+    if isinstance(v, _dt.timedelta):
+        return v.total_seconds()
+    if isinstance(v, uuid.UUID):
+        return str(v)
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return bytes(v).hex()
+    return str(v)
+
+
+def _dumps(v: Any) -> str:
+    return json.dumps(v, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def stream_format(stream: str | None, accept: str | None) -> str | None:
+    """Resolve o formato de streaming pedido (query `stream` tem prioridade sobre Accept)."""
+    s = (stream or "").strip().lower()
+    if s in _STREAM_MEDIA_TYPES:
+        return s
+    if "application/x-ndjson" in (accept or "").lower():
+        return STREAM_NDJSON
+    return None
+
+
+def stream_media_type(fmt: str) -> str:
+    return _STREAM_MEDIA_TYPES[fmt]
+
+
+def stream_limits() -> Tuple[int, int]:
+    """(máx. de linhas, máx. de bytes) de uma resposta em streaming."""
+    max_rows = int(os.getenv("SQLAGENT_STREAM_MAX_ROWS", "100000") or 100000)
+    max_bytes = int(os.getenv("SQLAGENT_STREAM_MAX_BYTES", str(50 * 1024 * 1024)) or 50 * 1024 * 1024)
+    return max_rows, max_bytes
+
+
+async def encode_stream(
+    batches: AsyncIterator[Tuple[List[str], Sequence[Sequence[Any]]]],
+    fmt: str,
+    executed_sql: str | None = None,
+    max_rows: int | None = None,
+    max_bytes: int | None = None,
+) -> AsyncIterator[bytes]:
+    """
+    Serializa lotes `(columns, rows)` conforme chegam do cursor, aplicando os
+    limites de linhas e bytes durante o envio.
+
+    - ndjson: 1ª linha `{"columns": [...]}`, depois uma linha por registro (lista)
+      e por fim `{"done": true, "row_count": N, "truncated": bool}`.
+    - json: um único objeto `{"columns": [...], "rows": [...], "row_count": N,
+      "truncated": bool}` enviado em pedaços.
+    """
+    env_rows, env_bytes = stream_limits()
+    max_rows = max_rows or env_rows
+    max_bytes = max_bytes or env_bytes
+    sent_rows = 0
+    sent_bytes = 0
+    truncated: str | None = None
+    error: str | None = None
+    header_sent = False
+    try:
+        async for columns, rows in batches:
+            if not header_sent:
+                head = {"columns": columns}
+                if executed_sql is not None:
+                    head["executed_sql"] = executed_sql
+                if fmt == STREAM_NDJSON:
+                    chunk = _dumps(head) + "\n"
+                else:
+                    chunk = _dumps(head)[:-1] + ',"rows":['
+                header_sent = True
+                data = chunk.encode()
+                sent_bytes += len(data)
+                yield data
+            parts: List[str] = []
+            for r in rows:
+                if sent_rows >= max_rows:
+                    truncated = "max_rows"
+                    break
+                line = _dumps(list(r))
+                if fmt == STREAM_NDJSON:
+                    line += "\n"
+                elif sent_rows:
+                    line = "," + line
+                size = len(line.encode())
+                if sent_bytes + size > max_bytes:
+                    truncated = "max_bytes"
+                    break
+                parts.append(line)
+                sent_rows += 1
+                sent_bytes += size
+            if parts:
+                yield "".join(parts).encode()
+            if truncated:
+                break
+    except Exception as e:
+        # Status HTTP já foi enviado: reporta o erro no trailer
+        print(f"[WARN] SQLAgent: erro durante streaming após {sent_rows} linhas: {repr(e)}")
+        error = str(e)
+    finally:
+        # Fecha o cursor/conexão mesmo quando paramos antes do fim
+        aclose = getattr(batches, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    trailer = {"row_count": sent_rows, "truncated": bool(truncated)}
+    if truncated:
+        trailer["truncated_reason"] = truncated
+    if error:
+        trailer["error"] = error
+    if fmt == STREAM_NDJSON:
+        if not header_sent:
+            yield (_dumps({"columns": []}) + "\n").encode()
+        yield (_dumps({"done": True, **trailer}) + "\n").encode()
+    else:
+        if not header_sent:
+            yield b'{"columns":[],"rows":['
+        yield ("]," + _dumps(trailer)[1:]).encode()
+
+
+def result_format(fmt: str | None, accept: str | None) -> str:
+    """Resolve o formato da resposta (query `format` tem prioridade sobre Accept)."""
+    f = (fmt or "").strip().lower()
+    if f in (RESULT_ROWS, RESULT_COLUMNAR, RESULT_ARROW):
+        return f
+    a = (accept or "").lower()
+    if ARROW_MEDIA_TYPE in a:
+        return RESULT_ARROW
+    if COLUMNAR_MEDIA_TYPE in a:
+        return RESULT_COLUMNAR
+    return RESULT_ROWS
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+def _column_converter(values: Sequence[Any]):
+    """Escolhe um conversor para a coluna inteira a partir do 1º valor não nulo."""
+    sample = next((v for v in values if v is not None), None)
+    if sample is None or isinstance(sample, (bool, int, float, str)):
+        return None
+    if isinstance(sample, decimal.Decimal):
+        return float
+    if isinstance(sample, (_dt.date, _dt.datetime, _dt.time)):
+        return lambda v: v.isoformat()
+    return _json_default
+
+
+def to_columns(columns: List[str], rows: Sequence[Sequence[Any]]) -> List[List[Any]]:
+    """Transpõe linhas em colunas e converte cada coluna de uma vez para tipos JSON."""
+    if not rows:
+        return [[] for _ in columns]
+    out: List[List[Any]] = []
+    for values in zip(*rows):
+        conv = _column_converter(values)
+        if conv is None:
+            out.append(list(values))
+        else:
+            out.append([None if v is None else conv(v) for v in values])
+    return out
+
+
+def columnar_body(payload: dict) -> bytes:
+    """
+    Corpo JSON column-major: `rows` vira `values` (uma lista por coluna) e
+    `row_count`; os demais campos do payload são mantidos.
+    """
+    columns = payload.get("columns") or []
+    rows = payload.get("rows") or []
+    body = {k: v for k, v in payload.items() if k != "rows"}
+    body["values"] = to_columns(columns, rows)
+    body["row_count"] = len(rows)
+    return _dumps(body).encode()
+
+
+def arrow_body(payload: dict) -> bytes:
+    """
+    Resultado como Arrow IPC (stream). Os campos além de columns/rows vão nos
+    metadados do schema (valores JSON).
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow não instalado")
+    columns = payload.get("columns") or []
+    rows = payload.get("rows") or []
+    arrays = []
+    for values in (zip(*rows) if rows else [[] for _ in columns]):
+        try:
+            arrays.append(pa.array(values))
+        except Exception:
+            # tipos mistos/não suportados: converte a coluna para JSON-compatível
+            conv = _column_converter(values) or _json_default
+            arrays.append(pa.array([None if v is None else conv(v) for v in values]))
+    meta = {k: _dumps(v) for k, v in payload.items() if k not in ("columns", "rows")}
+    table = pa.Table.from_arrays(arrays, names=list(columns), metadata=meta or None)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,69 @@
+from typing import List, Tuple
+import os
+
+from sqlglot import exp
+
+from ..infra.schema_catalog import cached_catalog
+from .validators import check_sql, is_read_only
+
+# Nomes das reescritas registradas (estatística e resposta da API)
+REWRITE_STRIP_SEMICOLON = "strip_semicolon"
+REWRITE_LIMIT_INJECTED = "limit_injected"
+REWRITE_LIMIT_CLAMPED = "limit_clamped"
+REWRITE_QUALIFY_TABLE = "qualify_table"
+
+
+def _max_limit() -> int:
+    return int(os.getenv("SQLAGENT_MAX_LIMIT", "500") or 500)
+
+
+def rewrite_sql(sql: str) -> Tuple[str, List[str]]:
+    """
+    Corrige SQL quase válido antes da validação, via AST do sqlglot:
+    remove `;` finais, injeta LIMIT quando falta, reduz LIMIT/FETCH acima de
+    SQLAGENT_MAX_LIMIT e qualifica tabelas com o schema do catálogo.
+
+    Só reescreve consultas de leitura (o resto segue para o validador rejeitar).
+    Retorna (sql, reescritas aplicadas); sem reescritas o texto volta intacto.
+    """
+    applied: List[str] = []
+    stripped = (sql or "").strip()
+    if stripped.endswith(";"):
+        stripped = stripped.rstrip(";").strip()
+        applied.append(REWRITE_STRIP_SEMICOLON)
+
+    check = check_sql(stripped)
+    tree = check.tree
+    if tree is None or not is_read_only(tree):
+        return stripped, applied
+    if any("Multiple SQL statements" in i for i in check.issues):
+        return stripped, applied
+
+    tree = tree.copy()
+    changed = False
+
+    max_limit = _max_limit()
+    if tree.args.get("limit") is None:
+        tree.set("limit", exp.Limit(expression=exp.Literal.number(max_limit)))
+        applied.append(f"{REWRITE_LIMIT_INJECTED}:{max_limit}")
+        changed = True
+    elif check.limit is None or check.limit > max_limit:
+        tree.set("limit", exp.Limit(expression=exp.Literal.number(max_limit)))
+        applied.append(f"{REWRITE_LIMIT_CLAMPED}:{check.limit if check.limit is not None else 'expr'}->{max_limit}")
+        changed = True
+
+    cat = cached_catalog()
+    if cat is not None:
+        ctes = {c.alias_or_name for c in tree.find_all(exp.CTE)}
+        for table in tree.find_all(exp.Table):
+            if table.db or not table.name or table.name in ctes:
+                continue
+            qualified = cat.by_name.get(table.name)
+            if qualified and "." in qualified:
+                table.set("db", exp.to_identifier(qualified.split(".", 1)[0]))
+                applied.append(f"{REWRITE_QUALIFY_TABLE}:{qualified}")
+                changed = True
+
+    if not changed:
+        return stripped, applied
+    return tree.sql(dialect="postgres"), applied
@@ -0,0 +1,240 @@
+"""
+Rollup diário do ledger (sqlagent/sql/ledger_daily_rollup.sql), mantido de forma incremental.
+
+Cada refresh recalcula só os dias necessários:
+- dias novos: de `complete_until` (ou do primeiro dia do ledger) até ontem;
+- dias alterados: com SQLAGENT_ROLLUP_CHANGE_COLUMN (ex. updated_at), os dias de
+  linhas com a coluna acima da marca d'água; sem ela, os últimos
+  SQLAGENT_ROLLUP_LOOKBACK_DAYS dias (padrão 3) a cada execução.
+Hoje nunca entra no rollup: os presets leem o dia corrente direto do ledger.
+
+Uso avulso (cron): `python -m sqlagent.services.rollup [--full]`.
+"""
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import re
+import threading
+import time
+
+import psycopg
+from psycopg import sql as pg_sql
+
+ROLLUP_NAME = "ledger_daily"
+ROLLUP_TABLE = os.getenv("SQLAGENT_ROLLUP_TABLE", "sqlagent_ledger_daily") or "sqlagent_ledger_daily"
+STATE_TABLE = os.getenv("SQLAGENT_ROLLUP_STATE_TABLE", "sqlagent_rollup_state") or "sqlagent_rollup_state"
+# Coluna de tenant do ledger (obrigatória para o rollup; também filtra os presets diretos)
+TENANT_COLUMN = os.getenv("SQLAGENT_TENANT_COLUMN", "") or ""
+# Tipo da coluna de tenant: o x-account-id é comparado com bind desse tipo, sem cast na coluna (usa o índice)
+TENANT_TYPE = (os.getenv("SQLAGENT_TENANT_TYPE", "uuid") or "uuid").strip().lower()
+if not re.fullmatch(r"[a-z_][a-z0-9_ ]*", TENANT_TYPE):
+    print(f"[WARN] SQLAGENT_TENANT_TYPE inválido ({TENANT_TYPE!r}); usando text.")
+    TENANT_TYPE = "text"
+
+_JOB: Optional[asyncio.Task] = None
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, Any] = {"refreshes": 0, "refresh_errors": 0, "skipped_locked": 0, "served_rollup": 0, "served_raw": 0, "last": None}
+
+
+def rollup_enabled() -> bool:
+    """
+    Presets leem do rollup (SQLAGENT_ROLLUP=1; exige a tabela criada, o job rodando
+    e SQLAGENT_TENANT_COLUMN, pois o rollup é por tenant).
+    """
+    return os.getenv("SQLAGENT_ROLLUP", "0") in ("1", "true", "True") and bool(TENANT_COLUMN)
+
+
+def rollup_min_days() -> int:
+    """Janelas menores que isso (SQLAGENT_ROLLUP_MIN_DAYS, padrão 3) vão direto ao ledger."""
+    return int(os.getenv("SQLAGENT_ROLLUP_MIN_DAYS", "3") or 3)
+
+
+def note_served(from_rollup: bool) -> None:
+    with _STATS_LOCK:
+        _STATS["served_rollup" if from_rollup else "served_raw"] += 1
+
+
+def _source_table() -> str:
+    from .presets import ALLOWED_TABLE  # lazy: presets importa este módulo
+    return ALLOWED_TABLE
+
+
+def _ident(name: str) -> pg_sql.Composable:
+    """Identificador possivelmente qualificado (schema.tabela)."""
+    return pg_sql.Identifier(*name.split("."))
+
+
+def _days_to_refresh_query(full: bool) -> pg_sql.Composable:
+    """
+    Dias (date[]) a recalcular: novos desde `complete_until` + alterados (marca
+    d'água) ou janela de lookback. Parâmetros: %(complete_until)s, %(watermark)s, %(lookback)s.
+    """
+    src = _ident(_source_table())
+    new_from = (
+        pg_sql.SQL("(select min(fact_date)::date from {src})").format(src=src)
+        if full
+        else pg_sql.SQL("coalesce(%(complete_until)s::date, (select min(fact_date)::date from {src}))").format(src=src)
+    )
+    change_col = os.getenv("SQLAGENT_ROLLUP_CHANGE_COLUMN", "") or ""
+    if change_col and not full:
+        change_type = os.getenv("SQLAGENT_ROLLUP_CHANGE_TYPE", "timestamptz") or "timestamptz"
+        changed = pg_sql.SQL(
+            "select distinct date_trunc('day', fact_date)::date from {src} "
+            "where %(watermark)s::text is not null and {col} > %(watermark)s::text::{typ} and fact_date < current_date"
+        ).format(src=src, col=pg_sql.Identifier(change_col), typ=pg_sql.SQL(change_type))
+    else:
+        changed = pg_sql.SQL(
+            "select d::date from generate_series(current_date - %(lookback)s::int, current_date - 1, interval '1 day') d"
+        )
+    return pg_sql.SQL(
+        "select coalesce(array_agg(day order by day), '{{}}') from ("
+        " select d::date as day from generate_series({new_from}, current_date - 1, interval '1 day') d"
+        " union {changed}"
+        ") x(day) where day < current_date"
+    ).format(new_from=new_from, changed=changed)
+
+
+async def refresh_rollup(full: bool = False) -> Dict[str, Any]:
+    """
+    Recalcula os dias necessários numa transação (delete + insert por dia) e
+    avança `complete_until` para hoje. Um advisory lock evita refreshes simultâneos
+    entre processos. `full=True` refaz o histórico inteiro.
+    """
+    dsn = os.getenv("SQLAGENT_ROLLUP_DB_URL")
+    if not dsn:
+        raise RuntimeError("SQLAGENT_ROLLUP_DB_URL não definido para o rollup do SQL Agent.")
+    if not TENANT_COLUMN:
+        raise RuntimeError("SQLAGENT_TENANT_COLUMN não definido: o rollup do SQL Agent é por tenant.")
+    t0 = time.perf_counter()
+    tenant_expr = pg_sql.SQL("coalesce({}::text, '')").format(pg_sql.Identifier(TENANT_COLUMN))
+    change_col = os.getenv("SQLAGENT_ROLLUP_CHANGE_COLUMN", "") or ""
+    lookback = int(os.getenv("SQLAGENT_ROLLUP_LOOKBACK_DAYS", "3") or 3)
+    try:
+        async with await psycopg.AsyncConnection.connect(dsn) as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute("select pg_try_advisory_xact_lock(hashtext(%s))", (f"sqlagent_rollup:{ROLLUP_NAME}",))
+                    if not (await cur.fetchone())[0]:
+                        with _STATS_LOCK:
+                            _STATS["skipped_locked"] += 1
+                        return {"ok": True, "skipped": "locked"}
+                    await cur.execute(
+                        pg_sql.SQL("select complete_until, watermark from {} where name = %s").format(_ident(STATE_TABLE)),
+                        (ROLLUP_NAME,),
+                    )
+                    state = await cur.fetchone()
+                    complete_until, watermark = state if state else (None, None)
+
+                    await cur.execute(_days_to_refresh_query(full), {
+                        "complete_until": complete_until, "watermark": watermark, "lookback": lookback,
+                    })
+                    days: List[Any] = list((await cur.fetchone())[0] or [])
+
+                    new_watermark = watermark
+                    if change_col:
+                        await cur.execute(pg_sql.SQL("select max({})::text from {}").format(
+                            pg_sql.Identifier(change_col), _ident(_source_table())
+                        ))
+                        new_watermark = (await cur.fetchone())[0] or watermark
+
+                    if full:
+                        await cur.execute(pg_sql.SQL("delete from {}").format(_ident(ROLLUP_TABLE)))
+                    elif days:
+                        await cur.execute(
+                            pg_sql.SQL("delete from {} where day = any(%s::date[])").format(_ident(ROLLUP_TABLE)), (days,)
+                        )
+                    if days:
+                        # um range sargável em fact_date por dia (usa o índice, sem scan do ledger inteiro)
+                        await cur.execute(pg_sql.SQL(
+                            "insert into {dst} (account_id, day, status, orders, revenue, refreshed_at) "
+                            "select {tenant}, d.day, coalesce(l.status, 'unknown'), count(*), coalesce(sum(l.final_amount), 0), now() "
+                            "from unnest(%s::date[]) as d(day) "
+                            "join {src} l on l.fact_date >= d.day and l.fact_date < d.day + 1 "
+                            "group by 1, 2, 3"
+                        ).format(dst=_ident(ROLLUP_TABLE), tenant=tenant_expr, src=_ident(_source_table())), (days,))
+                    rows = cur.rowcount if days else 0
+
+                    await cur.execute(pg_sql.SQL(
+                        "insert into {} (name, complete_until, watermark, refreshed_at, days_refreshed) "
+                        "values (%s, current_date, %s, now(), %s) "
+                        "on conflict (name) do update set complete_until = excluded.complete_until, "
+                        "watermark = excluded.watermark, refreshed_at = excluded.refreshed_at, "
+                        "days_refreshed = excluded.days_refreshed"
+                    ).format(_ident(STATE_TABLE)), (ROLLUP_NAME, new_watermark, len(days)))
+    except Exception as e:
+        with _STATS_LOCK:
+            _STATS["refresh_errors"] += 1
+        print(f"[ERROR] SQLAgent: refresh do rollup {ROLLUP_TABLE} falhou: {repr(e)}")
+        raise
+
+    result = {
+        "ok": True,
+        "full": full,
+        "days": len(days),
+        "first_day": str(days[0]) if days else None,
+        "last_day": str(days[-1]) if days else None,
+        "rows": rows,
+        "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+    }
+    with _STATS_LOCK:
+        _STATS["refreshes"] += 1
+        _STATS["last"] = {**result, "at": time.time()}
+    print(f"[DEBUG] SQLAgent: rollup {ROLLUP_TABLE} atualizado: {result}")
+    return result
+
+
+async def _job_loop() -> None:
+    interval = float(os.getenv("SQLAGENT_ROLLUP_REFRESH_S", "300") or 300)
+    while True:
+        try:
+            await refresh_rollup()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass  # já logado; tenta de novo no próximo ciclo
+        await asyncio.sleep(interval)
+
+
+def start_rollup_job() -> None:
+    """Inicia o refresh periódico no processo (SQLAGENT_ROLLUP_JOB=1, a cada SQLAGENT_ROLLUP_REFRESH_S)."""
+    global _JOB
+    if os.getenv("SQLAGENT_ROLLUP_JOB", "0") not in ("1", "true", "True") or not os.getenv("SQLAGENT_ROLLUP_DB_URL"):
+        return
+    if not TENANT_COLUMN:
+        print("[WARN] SQLAgent: SQLAGENT_ROLLUP_JOB=1 sem SQLAGENT_TENANT_COLUMN; job de rollup não iniciado.")
+        return
+    if _JOB is None or _JOB.done():
+        try:
+            _JOB = asyncio.get_running_loop().create_task(_job_loop())
+        except RuntimeError:
+            pass
+
+
+async def stop_rollup_job() -> None:
+    global _JOB
+    if _JOB is not None and not _JOB.done():
+        _JOB.cancel()
+        try:
+            await _JOB
+        except (asyncio.CancelledError, Exception):
+            pass
+    _JOB = None
+
+
+def rollup_stats() -> Dict[str, Any]:
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    return {
+        **stats,
+        "enabled": rollup_enabled(),
+        "table": ROLLUP_TABLE,
+        "tenant_column": TENANT_COLUMN or None,
+        "min_days": rollup_min_days(),
+        "job_running": _JOB is not None and not _JOB.done(),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(asyncio.run(refresh_rollup(full="--full" in sys.argv[1:])))
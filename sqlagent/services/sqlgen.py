@@ -1,28 +1,27 @@
+import asyncio
+import hashlib
 import os
-from typing import Tuple, Optional, List, Dict
+import re
+import threading
+import unicodedata
+from typing import Tuple, Optional, List, Dict, Any
 
 from .validators import validate_sql
+from .rewrite import rewrite_sql
+from ..infra.schema_catalog import cached_catalog
+from ..infra.llm_cache import get_llm_cache, normalize_question, models_signature
+from .hedge import race
 
-# Providers
-try:
-    from .providers.gemini import GeminiProvider
-except Exception:
-    GeminiProvider = None  # type: ignore
-
-try:
-    from .providers.groq import GroqLlamaProvider
-except Exception:
-    GroqLlamaProvider = None  # type: ignore
-
-try:
-    from .providers.openai import OpenAIProvider
-except Exception:
-    OpenAIProvider = None  # type: ignore
+from .providers import enabled_providers, model_label
 
 DEFAULT_LIMIT = int(os.getenv("SQLAGENT_DEFAULT_LIMIT", "100") or 100)
 MAX_LIMIT = int(os.getenv("SQLAGENT_MAX_LIMIT", "500") or 500)
 DATE_DEFAULT_DAYS = int(os.getenv("SQLAGENT_DATE_DEFAULT_DAYS", "30") or 30)
 ALLOWED_TABLES = os.getenv("SQLAGENT_ALLOWED_TABLES", "v_ifood_order_ledger")
+# Orçamento (tokens aproximados, ~4 caracteres/token) da seção de esquema do prompt
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SQLAGENT_PROMPT_SCHEMA_TOKENS", "300") or 300)
+# Colunas sem relação com a pergunta entram só até este mínimo por tabela (contexto)
+SCHEMA_MIN_COLUMNS = int(os.getenv("SQLAGENT_PROMPT_MIN_COLUMNS", "6") or 6)
 
 
 PROMPT_TEMPLATE = (
@@ -36,59 +35,209 @@ PROMPT_TEMPLATE = (
 )
 
 
+# Termos de negócio (pt-BR) -> fragmentos de nomes de coluna
+_TERM_HINTS: Dict[str, Tuple[str, ...]] = {
+    "venda": ("amount", "value", "total", "revenue"),
+    "vendas": ("amount", "value", "total", "revenue"),
+    "receita": ("amount", "revenue", "value", "gross"),
+    "faturamento": ("amount", "revenue", "gross", "value"),
+    "valor": ("amount", "value"),
+    "bruto": ("gross",),
+    "liquido": ("net",),
+    "ticket": ("amount", "value"),
+    "pedido": ("order",),
+    "pedidos": ("order",),
+    "dia": ("date",),
+    "data": ("date",),
+    "mes": ("date",),
+    "semana": ("date",),
+    "periodo": ("date",),
+    "status": ("status",),
+    "cancelado": ("status", "cancel"),
+    "cancelados": ("status", "cancel"),
+    "loja": ("merchant", "store"),
+    "lojas": ("merchant", "store"),
+    "pagamento": ("payment",),
+    "taxa": ("fee", "commission"),
+    "taxas": ("fee", "commission"),
+    "cliente": ("customer",),
+    "clientes": ("customer",),
+}
+_ALWAYS_COLUMNS = {"fact_date"}  # coluna de data citada nas regras do prompt
+
+
+def _tokens(text: str) -> List[str]:
+    norm = unicodedata.normalize("NFKD", (text or "").lower())
+    norm = "".join(ch for ch in norm if not unicodedata.combining(ch))
+    return [t for t in re.split(r"[^a-z0-9]+", norm) if t]
+
+
+def _column_score(column: str, q_tokens: List[str], hints: List[str]) -> float:
+    parts = _tokens(column.replace("_", " "))
+    score = 0.0
+    if column in _ALWAYS_COLUMNS:
+        score += 10.0
+    for qt in q_tokens:
+        if qt == column or qt in parts:
+            score += 5.0
+        elif len(qt) >= 4 and any(p.startswith(qt[:4]) for p in parts):
+            score += 2.0
+    for h in hints:
+        if h in column:
+            score += 3.0
+    return score
+
+
+def _rank_columns(question: str, tables: List[str], budget_tokens: int = SCHEMA_TOKEN_BUDGET) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    """
+    Seleciona as colunas mais relevantes para a pergunta dentro do orçamento de
+    tokens. Retorna [(tabela, [(coluna, tipo), ...])] preservando a ordem original
+    das colunas em cada tabela.
+    """
+    cat = cached_catalog()
+    if cat is None:
+        return []
+    # números e palavras curtas ("7", "de", "o") não identificam colunas
+    q_tokens = [t for t in _tokens(question) if len(t) >= 3 and not t.isdigit()]
+    hints = [h for t in q_tokens for h in _TERM_HINTS.get(t, ())]
+    candidates: List[Tuple[float, int, str, int, str, str]] = []
+    for ti, table in enumerate(tables):
+        for ci, (col, typ) in enumerate(cat.columns(table)):
+            candidates.append((_column_score(col, q_tokens, hints), -ti, table, ci, col, typ))
+    # maior score primeiro; empate: tabela citada antes e ordem original da coluna
+    candidates.sort(key=lambda c: (-c[0], -c[1], c[3]))
+    budget_chars = max(0, budget_tokens) * 4
+    used = 0
+    chosen: Dict[str, List[Tuple[int, str, str]]] = {}
+    for score, _ti, table, ci, col, typ in candidates:
+        cost = len(col) + len(typ) + 3
+        if table not in chosen:
+            cost += len(table) + 3
+        if used + cost > budget_chars:
+            continue
+        if score <= 0 and len(chosen.get(table, [])) >= SCHEMA_MIN_COLUMNS:
+            continue
+        used += cost
+        chosen.setdefault(table, []).append((ci, col, typ))
+    return [(t, [(c, ty) for _, c, ty in sorted(chosen[t])]) for t in tables if t in chosen]
+
+
+def _schema_section(question: str, tables: List[str]) -> str:
+    """Colunas/tipos relevantes das tabelas do prompt, a partir do catálogo em memória."""
+    cat = cached_catalog()
+    ranked = _rank_columns(question, tables)
+    if cat is None or not ranked:
+        return ""
+    lines = [cat.table_digest(t, cols) for t, cols in ranked]
+    return "Esquema (tabela(coluna tipo, ...)); use apenas estas colunas:\n" + "\n".join(lines) + "\n"
+
+
 def _build_prompt(question: str, hint_tables: Optional[List[str]] = None) -> str:
     allowed = ALLOWED_TABLES
     if hint_tables:
         allowed = ",".join(hint_tables)
+    tables = [t.strip() for t in allowed.split(",") if t.strip()]
     return PROMPT_TEMPLATE.format(
         allowed=allowed,
         date_days=DATE_DEFAULT_DAYS,
         max_limit=MAX_LIMIT,
         default_limit=DEFAULT_LIMIT,
-    ) + f"\nPergunta: {question}\nSQL:"
+    ) + _schema_section(question, tables) + f"\nPergunta: {question}\nSQL:"
+
+
+_STATS_LOCK = threading.Lock()
+_PROVIDER_STATS: Dict[str, Dict[str, int]] = {}
 
 
-def _ensemble_generate(question: str, hint_tables: Optional[List[str]] = None) -> Tuple[str, str, str]:
-    """Try OpenAI (gpt), Gemini, then Groq/Llama. Returns (sql, rationale, model)."""
+def _record(provider: str, outcome: str, rewritten: bool = False) -> None:
+    """outcome: ok | invalid | error; rewritten: a saída precisou da etapa de reescrita"""
+    with _STATS_LOCK:
+        st = _PROVIDER_STATS.setdefault(provider, {"calls": 0, "ok": 0, "invalid": 0, "error": 0, "rewritten": 0})
+        st["calls"] += 1
+        st[outcome] += 1
+        if rewritten:
+            st["rewritten"] += 1
+
+
+def provider_stats() -> Dict[str, Any]:
+    """Chamadas, SQL inválido e erros por provider, com a taxa de SQL inválido."""
+    with _STATS_LOCK:
+        out: Dict[str, Any] = {}
+        for name, st in _PROVIDER_STATS.items():
+            answered = st["ok"] + st["invalid"]
+            out[name] = {**st, "invalid_rate": round(st["invalid"] / answered, 4) if answered else None}
+        return out
+
+
+async def _ensemble_generate(question: str, hint_tables: Optional[List[str]] = None) -> Tuple[str, str, str, List[str]]:
+    """Race OpenAI (gpt), Gemini and Groq/Llama with hedging. Returns (sql, rationale, model, rewrites)."""
     prompt = _build_prompt(question, hint_tables)
 
-    errors: List[str] = []
-
-    if OpenAIProvider is not None and os.getenv("OPENAI_API_KEY"):
-        try:
-            sql = OpenAIProvider().generate_sql(prompt)
-            ok, issues = validate_sql(sql)
-            if ok:
-                return sql, "openai_ok", os.getenv("OPENAI_MODEL", "openai")
-            errors.append(f"openai_invalid: {issues}")
-        except Exception as e:
-            errors.append(f"openai_err: {e}")
-
-    if GeminiProvider is not None and os.getenv("GEMINI_API_KEY"):
-        try:
-            sql = GeminiProvider().generate_sql(prompt)
-            ok, issues = validate_sql(sql)
-            if ok:
-                return sql, "gemini_ok", "gemini"
-            errors.append(f"gemini_invalid: {issues}")
-        except Exception as e:
-            errors.append(f"gemini_err: {e}")
-
-    if GroqLlamaProvider is not None and os.getenv("GROQ_API_KEY"):
-        try:
-            sql = GroqLlamaProvider().generate_sql(prompt)
-            ok, issues = validate_sql(sql)
-            if ok:
-                return sql, "llama_ok", "llama"
-            errors.append(f"llama_invalid: {issues}")
-        except Exception as e:
-            errors.append(f"llama_err: {e}")
+    def _counted(name: str, provider):
+        async def _call() -> str:
+            try:
+                return await provider.generate_sql(prompt)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _record(name, "error")
+                raise
+        return _call
+
+    def _accept(name: str, sql: str) -> Tuple[bool, Any, str]:
+        # reescrita antes da validação: SQL quase válido (sem LIMIT, `;` final...) é aproveitado
+        sql, rewrites = rewrite_sql(sql)
+        ok, issues = validate_sql(sql)
+        _record(name, "ok" if ok else "invalid", rewritten=bool(rewrites))
+        return ok, (sql, rewrites), "" if ok else f"invalid: {issues}"
+
+    providers = dict(enabled_providers())
+    candidates = [(name, _counted(name, p)) for name, p in providers.items()]
+    winner, result, errors = await race("sql", candidates, _accept)
+    if winner is not None:
+        sql, rewrites = result
+        if rewrites:
+            print(f"[DEBUG] SQLAgent: SQL de {winner} reescrito: {', '.join(rewrites)}")
+        return sql, f"{winner}_ok", model_label(winner), rewrites
 
     # last resort: very safe fallback
     fallback = f"select now()::date as dia, 0::numeric as total limit {DEFAULT_LIMIT};"
-    return fallback, "; ".join(errors) or "fallback", "fallback"
-
-
-def generate_sql(question: str, account_id: str | None = None, hint_tables: Optional[List[str]] = None) -> Tuple[str, str, str]:
-    """Return (sql, rationale, model). account_id reserved for future tenant guards."""
-    return _ensemble_generate(question, hint_tables)
+    return fallback, "; ".join(errors) or "fallback", "fallback", []
+
+
+def _enabled_models() -> str:
+    return models_signature(*((name, p.model_name) for name, p in enabled_providers()))
+
+
+def _prompt_version() -> str:
+    """Muda quando o template, os limites ou o esquema do prompt mudam."""
+    cat = cached_catalog()
+    raw = "|".join([
+        PROMPT_TEMPLATE, ALLOWED_TABLES, str(DATE_DEFAULT_DAYS), str(MAX_LIMIT), str(DEFAULT_LIMIT),
+        str(SCHEMA_TOKEN_BUDGET), cat.version if cat else "",
+    ])
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+async def generate_sql(question: str, account_id: str | None = None, hint_tables: Optional[List[str]] = None) -> Tuple[str, str, str, List[str]]:
+    """Return (sql, rationale, model, rewrites). account_id reserved for future tenant guards.
+
+    `rewrites` lista as correções automáticas aplicadas ao SQL do provider (ver rewrite.py).
+
+    SQL válido de providers fica no cache persistente de LLM (pergunta normalizada,
+    datas como marcadores); perguntas repetidas não chamam o LLM.
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return await _ensemble_generate(question, hint_tables)
+    normalized, dates = normalize_question(question)
+    key = cache.make_key("sql", _enabled_models(), _prompt_version(), normalized, ",".join(hint_tables or []))
+    hit = cache.get(key, dates)
+    if hit is not None:
+        ok, _issues = validate_sql(hit["value"])
+        if ok:
+            return hit["value"], f"cache_hit:{hit['provider']}", hit["model"], []
+    sql, rationale, model, rewrites = await _ensemble_generate(question, hint_tables)
+    if model != "fallback":
+        cache.put(key, "sql", normalized, sql, dates, provider=rationale.replace("_ok", ""), model=model)
+    return sql, rationale, model, rewrites
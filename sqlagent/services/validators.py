@@ -1,9 +1,37 @@
-from typing import Tuple, List, Set
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+import hashlib
 import os
-import re
+import threading
+
 import sqlglot
+from sqlglot import exp
 from sqlglot.errors import ParseError
 
+# Raízes aceitas: SELECT (com ou sem CTE), UNION/INTERSECT/EXCEPT e SELECT entre parênteses
+_READ_ROOTS = (exp.Select, exp.Union, exp.Intersect, exp.Except, exp.Subquery)
+# Nós proibidos em qualquer ponto da árvore (ex.: CTE com DELETE ... RETURNING, SELECT INTO)
+_WRITE_NODES = tuple(
+    getattr(exp, name)
+    for name in ("Insert", "Update", "Delete", "Merge", "Create", "Drop", "AlterTable", "TruncateTable", "Command", "Into", "Transaction", "Commit", "Rollback")
+    if hasattr(exp, name)
+)
+
+
+def is_read_only(tree: exp.Expression) -> bool:
+    """Raiz SELECT/conjunto e nenhum nó de escrita ou DDL na árvore."""
+    return isinstance(tree, _READ_ROOTS) and not any(True for _ in tree.find_all(*_WRITE_NODES))
+
+
+# Funções aceitas como fonte de linhas no FROM/LATERAL (as demais, ex. dblink, são recusadas)
+_SAFE_TABLE_FUNCTIONS = (exp.GenerateSeries, exp.Unnest)
+
+
+def _function_name(node: Optional[exp.Expression]) -> str:
+    if isinstance(node, exp.Anonymous):
+        return str(node.this).lower()
+    return node.sql_name().lower() if isinstance(node, exp.Func) else type(node).__name__.lower()
+
 
 def _get_allowed_tables() -> Set[str]:
     env = os.getenv("SQLAGENT_ALLOWED_TABLES", "")
@@ -11,52 +39,141 @@ def _get_allowed_tables() -> Set[str]:
     return set(parts)
 
 
-def validate_sql(sql: str) -> Tuple[bool, List[str]]:
-    issues: List[str] = []
+def _max_limit() -> int:
+    return int(os.getenv("SQLAGENT_MAX_LIMIT", "500") or 500)
 
-    # Normalize: remove trailing semicolons and excessive whitespace
-    normalized = sql.strip().rstrip(";").strip()
 
-    # Single statement only (basic guard)
-    if normalized.count(";") > 0:
-        issues.append("Multiple SQL statements are not allowed.")
+class SQLCheck:
+    """
+    Resultado da validação de uma query: `ok`, `issues`, a árvore do sqlglot
+    (`tree`, None se não parseou), tabelas referenciadas e o LIMIT externo.
+
+    A árvore fica no cache e é compartilhada: etapas que reescrevem devem usar `tree.copy()`.
+    """
+
+    __slots__ = ("sql", "ok", "issues", "tree", "tables", "limit")
+
+    def __init__(self, sql: str, issues: List[str], tree: Optional[exp.Expression], tables: List[str], limit: Optional[int]):
+        self.sql = sql
+        self.ok = not issues
+        self.issues = issues
+        self.tree = tree
+        self.tables = tables
+        self.limit = limit
+
+
+def _limit_value(root: exp.Expression) -> Tuple[bool, Optional[int]]:
+    """(tem LIMIT/FETCH no nível externo, valor inteiro literal ou None)."""
+    node = root.args.get("limit")
+    if node is None:
+        return False, None
+    value = node.args.get("count") if isinstance(node, exp.Fetch) else node.args.get("expression")
+    if isinstance(value, exp.Literal) and not value.is_string:
+        try:
+            return True, int(value.this)
+        except ValueError:
+            return True, None
+    return True, None
+
 
+def _check(sql: str, allowed: FrozenSet[str], max_limit: int) -> SQLCheck:
+    # Normalize: remove trailing semicolons and excessive whitespace
+    normalized = sql.strip().rstrip(";").strip()
     try:
-        # parse_one sometimes struggles with trailing semicolons; use normalized
-        expr = sqlglot.parse_one(normalized, read="postgres")
+        statements = [s for s in sqlglot.parse(normalized, read="postgres") if s is not None]
     except ParseError as e:
-        return False, [f"parse_error: {e}"]
+        return SQLCheck(sql, [f"parse_error: {e}"], None, [], None)
+    if not statements:
+        return SQLCheck(sql, ["parse_error: empty statement"], None, [], None)
 
-    lowered = f" {normalized.lower()} "
+    issues: List[str] = []
+    # Single statement only
+    if len(statements) > 1:
+        issues.append("Multiple SQL statements are not allowed.")
+    tree = statements[0]
 
-    # Disallow dangerous statements
-    banned = [
-        " drop ", " alter ", " create ", " truncate ", " grant ", " revoke ",
-        " insert ", " update ", " delete ", " call ", " begin ", " commit ", " rollback ",
-    ]
-    if any(b in lowered for b in banned):
+    # Statement type: only SELECT, walking the whole tree
+    if not is_read_only(tree):
         issues.append("Only SELECT queries are allowed.")
 
-    # Root type check: be fully tolerant (some valid SELECTs may parse wrapped)
-    # We won't reject based on expr.key; rely on banned statements and LIMIT + allowlist.
-    # If needed for debug, uncomment the next line to record the expr key.
-    # issues.append(f"expr_key={getattr(expr, 'key', None)}")
+    # Allowlist of tables/views (CTE names are not tables)
+    ctes = {c.alias_or_name for c in tree.find_all(exp.CTE)}
+    tables: List[str] = []
+    for t in tree.find_all(exp.Table):
+        if not isinstance(t.this, exp.Identifier):
+            # função no FROM (dblink, pg_read_file...) vira Table sem nome: só as seguras passam
+            if not isinstance(t.this, _SAFE_TABLE_FUNCTIONS):
+                issues.append(f"Table function not allowed: {_function_name(t.this)}")
+            continue
+        if t.name in ctes:
+            continue
+        qualified = f"{t.db}.{t.name}" if t.db else t.name
+        if qualified not in tables:
+            tables.append(qualified)
+        if allowed and t.name not in allowed and qualified not in allowed:
+            issues.append(f"Table not allowed: {t.name}")
 
-    # Allowlist of tables/views
-    allowed = _get_allowed_tables()
-    if allowed:
-        # collect table names from the AST
-        try:
-            tables = {t.name for t in expr.find_all(sqlglot.expressions.Table)}
-        except Exception:
-            tables = set()
-        for t in tables:
-            if t not in allowed:
-                issues.append(f"Table not allowed: {t}")
-
-    # LIMIT presence
-    if " limit " not in lowered:
+    for lateral in tree.find_all(exp.Lateral):
+        source = lateral.this
+        if isinstance(source, exp.Func) and not isinstance(source, _SAFE_TABLE_FUNCTIONS):
+            issues.append(f"Table function not allowed: {_function_name(source)}")
+
+    # LIMIT presence and value (outer query)
+    has_limit, limit = _limit_value(tree)
+    if not has_limit:
         issues.append("Query should include LIMIT to avoid heavy scans.")
+    elif limit is None:
+        issues.append("LIMIT must be an integer literal.")
+    elif limit > max_limit:
+        issues.append(f"LIMIT {limit} exceeds the maximum of {max_limit}.")
+
+    return SQLCheck(sql, issues, tree, tables, limit)
+
+
+class _CheckCache:
+    """LRU de SQLCheck por hash do SQL (+ allowlist e MAX_LIMIT vigentes)."""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Tuple[str, FrozenSet[str], int], SQLCheck]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get_or_check(self, sql: str) -> SQLCheck:
+        allowed = frozenset(_get_allowed_tables())
+        max_limit = _max_limit()
+        key = (hashlib.sha1(sql.encode()).hexdigest(), allowed, max_limit)
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and hit.sql == sql:
+                self._data.move_to_end(key)
+                self.stats["hits"] += 1
+                return hit
+            self.stats["misses"] += 1
+        result = _check(sql, allowed, max_limit)
+        with self._lock:
+            self._data[key] = result
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._data), "size": self.size}
+
+
+_CACHE = _CheckCache(int(os.getenv("SQLAGENT_VALIDATOR_CACHE_SIZE", "1024") or 1024))
+
+
+def check_sql(sql: str) -> SQLCheck:
+    """Valida a query (parse único, em cache) e devolve o resultado com a árvore."""
+    return _CACHE.get_or_check(sql)
+
+
+def validate_sql(sql: str) -> Tuple[bool, List[str]]:
+    result = check_sql(sql)
+    return result.ok, list(result.issues)
+
 
-    ok = len(issues) == 0
-    return ok, issues
+def validator_stats() -> Dict[str, Any]:
+    return _CACHE.snapshot()
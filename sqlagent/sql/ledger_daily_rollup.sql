@@ -0,0 +1,33 @@
+-- Rollup diário do ledger para os presets do SQL Agent (totais/diário/status).
+-- Mantido de forma incremental por sqlagent/services/rollup.py (job periódico ou
+-- `python -m sqlagent.services.rollup`); os presets somam os dias completos daqui
+-- e leem do ledger só as bordas (primeiro dia parcial e dias ainda não consolidados).
+--
+-- O dia é date_trunc('day', fact_date) no TimeZone da sessão: o job (SQLAGENT_ROLLUP_DB_URL)
+-- e a conexão READONLY devem usar o mesmo fuso.
+-- `account_id` vem da coluna de tenant do ledger, SQLAGENT_TENANT_COLUMN (obrigatória para o rollup).
+
+create table if not exists public.sqlagent_ledger_daily (
+    account_id   text        not null default '',
+    day          date        not null,
+    status       text        not null,
+    orders       bigint      not null default 0,
+    revenue      numeric     not null default 0,
+    refreshed_at timestamptz not null default now(),
+    primary key (account_id, day, status)
+);
+
+create index if not exists sqlagent_ledger_daily_day_idx
+    on public.sqlagent_ledger_daily (day);
+
+-- Estado do refresh: até onde os dias estão consolidados e a marca d'água de mudanças
+create table if not exists public.sqlagent_rollup_state (
+    name           text        primary key,
+    complete_until date,
+    watermark      text,
+    refreshed_at   timestamptz,
+    days_refreshed integer     not null default 0
+);
+
+-- A conexão READONLY do agente precisa ler as duas tabelas, ex.:
+-- grant select on public.sqlagent_ledger_daily, public.sqlagent_rollup_state to <role_readonly>;
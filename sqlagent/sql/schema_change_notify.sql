@@ -0,0 +1,18 @@
+-- Notifica o SQL Agent sobre mudanças de DDL para invalidar o catálogo de schema
+-- em memória (sqlagent/infra/schema_catalog.py escuta o canal `sqlagent_schema`,
+-- configurável em SQLAGENT_SCHEMA_CHANNEL).
+-- Event triggers exigem superusuário; sem ele o catálogo segue apenas o TTL.
+
+create or replace function public.sqlagent_notify_schema_change()
+returns event_trigger
+language plpgsql
+as $$
+begin
+    perform pg_notify('sqlagent_schema', tg_tag);
+end;
+$$;
+
+drop event trigger if exists sqlagent_schema_change;
+create event trigger sqlagent_schema_change
+    on ddl_command_end
+    execute function public.sqlagent_notify_schema_change();
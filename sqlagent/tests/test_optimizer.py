@@ -0,0 +1,40 @@
+import pytest
+
+from sqlagent.services.optimizer import OPT_FOLD, OPT_SARGABLE, optimize_sql
+
+
+@pytest.fixture(autouse=True)
+def _env(monkeypatch):
+    monkeypatch.setenv("SQLAGENT_ALLOWED_TABLES", "v_ifood_order_ledger")
+    monkeypatch.delenv("SQLAGENT_SARGABLE_COLUMNS", raising=False)
+
+
+def _kinds(applied):
+    return {a.split(":", 1)[0] for a in applied}
+
+
+def test_folds_constants_before_sargable_rewrite():
+    sql, applied = optimize_sql(
+        "select count(*) from v_ifood_order_ledger where fact_date::date >= current_date - 3*2 limit 5"
+    )
+    assert _kinds(applied) == {OPT_FOLD, OPT_SARGABLE}
+    assert "fact_date >= (CURRENT_DATE - 6)" in sql
+    assert "CAST(fact_date AS DATE)" not in sql
+
+
+def test_folds_constants_in_join_condition_before_sargable_rewrite():
+    sql, applied = optimize_sql(
+        "select count(*) from v_ifood_order_ledger a join v_ifood_order_ledger b "
+        "on 1 = 1 and a.fact_date::date = current_date - 2*1 limit 5"
+    )
+    assert _kinds(applied) == {OPT_FOLD, OPT_SARGABLE}
+    assert "1 = 1" not in sql
+    assert "a.fact_date >= (CURRENT_DATE - 2)" in sql
+
+
+def test_plain_sargable_rewrite_unchanged():
+    sql, applied = optimize_sql(
+        "select count(*) from v_ifood_order_ledger where fact_date::date = '2024-05-01' limit 5"
+    )
+    assert _kinds(applied) == {OPT_SARGABLE}
+    assert "CAST(fact_date AS DATE)" not in sql
@@ -0,0 +1,33 @@
+import pytest
+
+from sqlagent.services.validators import check_sql
+
+
+@pytest.fixture(autouse=True)
+def _allowlist(monkeypatch):
+    monkeypatch.setenv("SQLAGENT_ALLOWED_TABLES", "v_ifood_order_ledger")
+
+
+@pytest.mark.parametrize("sql", [
+    "select * from dblink('host=x','select 1') as t(a int) limit 5",
+    "select * from pg_read_file('/etc/passwd') limit 5",
+    "select * from v_ifood_order_ledger l, lateral pg_read_file('/etc/passwd') f limit 5",
+])
+def test_rejects_table_functions(sql):
+    check = check_sql(sql)
+    assert not check.ok
+    assert any(i.startswith("Table function not allowed") for i in check.issues)
+
+
+def test_rejects_table_functions_without_allowlist(monkeypatch):
+    monkeypatch.delenv("SQLAGENT_ALLOWED_TABLES")
+    assert not check_sql("select * from dblink('host=x','select 1') as t(a int) limit 5").ok
+
+
+@pytest.mark.parametrize("sql", [
+    "select g from generate_series(1, 3) g limit 5",
+    "select p from unnest(array[7, 30]) as p limit 5",
+    "with x as (select 1 as a) select * from x, v_ifood_order_ledger limit 5",
+])
+def test_accepts_safe_sources(sql):
+    assert check_sql(sql).ok, check_sql(sql).issues